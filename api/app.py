@@ -1,12 +1,37 @@
+import atexit
+import base64
+import json
 import os
-from datetime import datetime
+import threading
+import time
+
+_BOOT_T0 = time.perf_counter()  # inicio del import: base del tiempo de arranque en frío
+_BOOT_PID = os.getpid()
+from datetime import datetime, timedelta, timezone
 from importlib import import_module
-from flask import Flask, request, jsonify, make_response
+from flask import Flask, Response, request, jsonify, make_response, stream_with_context
 from flask_cors import CORS
-from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo import MongoClient, DESCENDING
 from pymongo.errors import PyMongoError
+import psycopg
 from psycopg_pool import ConnectionPool
-from models import SensorEvent
+from models import SensorEvent, parse_ts
+import events_raw
+import export
+import ingest
+import json_provider
+from json_provider import columnar, iso_sql, row_dicts
+from ingest_buffer import IngestBuffer
+from occupancy import OccupancyState
+from sensor_registry import SensorRegistry
+from health import HealthMonitor
+from response_cache import ResponseCache
+import metrics
+import partitions
+import rollups
+import sessions
+import snapshot
+from stream import ChangeHub, start_listener
 import certifi
 from pathlib import Path
 import sys
@@ -18,7 +43,41 @@ MONGODB_URI = os.environ.get("MONGODB_URI")
 ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
 DEFAULT_ALLOWED_ORIGINS = "https://smartparksysten.azurewebsites.net"
 raw_allowed_origins = os.environ.get("ALLOWED_ORIGINS", DEFAULT_ALLOWED_ORIGINS)
-
+BULK_MAX_EVENTS = int(os.environ.get("BULK_MAX_EVENTS", "5000"))
+BULK_MAX_BYTES = int(os.environ.get("BULK_MAX_BYTES", str(4 * 1024 * 1024)))  # 0 = sin tope
+INGEST_MODE = os.environ.get("INGEST_MODE", "sync").lower()  # sync | buffered | raw (Postgres vía projector.py)
+OCCUPANCY_REFRESH_SEC = float(os.environ.get("OCCUPANCY_REFRESH_SEC", "30"))
+ROLLUP_REFRESH_SEC = float(os.environ.get("ROLLUP_REFRESH_SEC", "0"))  # 0 = sólo CLI/admin
+REGISTRO_MODE = os.environ.get("REGISTRO_MODE", "all").lower()  # all | transitions
+REGISTRO_DEDUP = REGISTRO_MODE == "transitions"
+STREAM_NOTIFY = os.environ.get("STREAM_NOTIFY", "1") != "0"
+STREAM_BUFFER = int(os.environ.get("STREAM_BUFFER", "2000"))
+STREAM_HEARTBEAT_SEC = float(os.environ.get("STREAM_HEARTBEAT_SEC", "15"))
+STREAM_MAX_SUBSCRIBERS = int(os.environ.get("STREAM_MAX_SUBSCRIBERS", "8"))  # por worker gthread; 0 = sin tope
+SENSOR_REGISTRY_REFRESH_SEC = float(os.environ.get("SENSOR_REGISTRY_REFRESH_SEC", "60"))
+SENSOR_REGISTRY_FULL_SEC = float(os.environ.get("SENSOR_REGISTRY_FULL_SEC", "900"))
+SENSOR_REJECT_STATES = os.environ.get("SENSOR_REJECT_STATES", "inactivo,baja,retirado").split(",")
+METRICS_SAMPLE_SEC = float(os.environ.get("METRICS_SAMPLE_SEC", "5"))
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")  # opcional: exige Authorization: Bearer <token>
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "5"))  # 0 = sin caché (ETag igual)
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "512"))
+RESPONSE_CACHE_MAX_AGE = int(os.environ.get("RESPONSE_CACHE_MAX_AGE", "0"))  # 0 = revalidar siempre (304)
+HEALTH_INTERVAL_SEC = float(os.environ.get("HEALTH_INTERVAL_SEC", "10"))
+HEALTH_TIMEOUT_SEC = float(os.environ.get("HEALTH_TIMEOUT_SEC", "2"))
+EVENTS_RAW_COLLECTION = os.environ.get("EVENTS_RAW_COLLECTION", "events_raw")
+EVENTS_RAW_LAYOUT = os.environ.get("EVENTS_RAW_LAYOUT", "plain").lower()  # plain | timeseries
+EVENTS_RAW_TTL_SEC = int(os.environ.get("EVENTS_RAW_TTL_SEC", "0"))  # sólo timeseries; 0 = sin expiración
+EXPORT_MAX_CONCURRENT = int(os.environ.get("EXPORT_MAX_CONCURRENT", "2"))  # por worker
+EXPORT_TIMEOUT_SEC = int(os.environ.get("EXPORT_TIMEOUT_SEC", "3600"))
+EXPORT_IDLE_SEC = int(os.environ.get("EXPORT_IDLE_SEC", "60"))
+EXPORT_FETCH = int(os.environ.get("EXPORT_FETCH", "5000"))
+
+if EVENTS_RAW_LAYOUT not in events_raw.LAYOUTS:
+    raise RuntimeError(f"EVENTS_RAW_LAYOUT inválido: {EVENTS_RAW_LAYOUT}")
+if INGEST_MODE not in ingest.INGEST_MODES:
+    raise RuntimeError(f"INGEST_MODE inválido: {INGEST_MODE}")
+if REGISTRO_MODE not in ingest.REGISTRO_MODES:
+    raise RuntimeError(f"REGISTRO_MODE inválido: {REGISTRO_MODE}")
 if not PG_CONN:
     raise RuntimeError("PG_CONN no está configurado")
 if not MONGODB_URI:
@@ -30,68 +89,63 @@ else:
     ALLOWED_ORIGINS = [origin.strip() for origin in raw_allowed_origins.split(",") if origin.strip()]
 
 print(f"[BOOT] ALLOWED_ORIGINS={ALLOWED_ORIGINS}")
+print(f"[BOOT] INGEST_MODE={INGEST_MODE} REGISTRO_MODE={REGISTRO_MODE} EVENTS_RAW_LAYOUT={EVENTS_RAW_LAYOUT}")
 
 # ---- Postgres Pool ----
-pg_pool = ConnectionPool(PG_CONN, min_size=1, max_size=6, kwargs={"autocommit": True})
+# Sin conexiones al importar (open=False, connect=False): el master de gunicorn
+# con --preload no hereda sockets ni hilos; cada worker los abre en start_worker().
+pg_pool = ConnectionPool(PG_CONN, min_size=1, max_size=6, kwargs={"autocommit": True}, open=False)
 
 # ---- Mongo Client ----
-mongo = MongoClient(MONGODB_URI, tlsCAFile=certifi.where(), connectTimeoutMS=20000, serverSelectionTimeoutMS=20000)
+mongo = MongoClient(
+    MONGODB_URI, tlsCAFile=certifi.where(), connectTimeoutMS=20000, serverSelectionTimeoutMS=20000,
+    event_listeners=metrics.mongo_listeners(), connect=False,
+)
 
 mdb = mongo["smartpark"]
-col_events_raw = mdb["events_raw"]
+col_events_raw = mdb[EVENTS_RAW_COLLECTION]
 col_meta_sensors = mdb["sensors_meta"]  # opcional para metadata por sensor
 
-
-
-# ---- Crear índices si no existen (idempotente) ----
-def _ensure_mongo_indexes():
-    try:
-        col_events_raw.create_index([("sensor_id", ASCENDING), ("ts", DESCENDING)], name="sid_ts")
-        col_events_raw.create_index([("ts", DESCENDING)], name="ts_desc")
-    except PyMongoError as e:
-        print(f"[WARN] creando índices mongo: {e}")
-
-
-_ensure_mongo_indexes()
+# Colección events_raw e índices: migración de una sola vez (migrate.py), no en cada worker
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": ALLOWED_ORIGINS}}, supports_credentials=True)
+metrics.init_app(app)  # antes del resto de hooks: mide también los preflight
+json_provider.init_app(app)
+
+
+def cors_headers(req_headers):
+    # Para forzar CORS en Azure App Service, devuelve siempre un ACAO. Si hay Origin, refléjalo; si no, usa *.
+    # Compartido con asgi.py (rutas async).
+    return {
+        "Access-Control-Allow-Origin": req_headers.get("Origin") or "*",
+        "Access-Control-Allow-Credentials": "true",
+        "Access-Control-Allow-Headers": req_headers.get("Access-Control-Request-Headers", "Content-Type,Authorization"),
+        "Access-Control-Allow-Methods": "GET,POST,OPTIONS",
+        "Vary": "Origin",
+    }
 
 
 @app.before_request
 def handle_preflight():
     if request.method == "OPTIONS":
-        origin = request.headers.get("Origin", "")
-        allow_origin = origin or "*"
         resp = make_response("", 200)
-        resp.headers["Access-Control-Allow-Origin"] = allow_origin
-        resp.headers["Access-Control-Allow-Methods"] = "GET,POST,OPTIONS"
-        resp.headers["Access-Control-Allow-Headers"] = request.headers.get(
-            "Access-Control-Request-Headers", "Content-Type,Authorization"
-        )
-        resp.headers["Access-Control-Allow-Credentials"] = "true"
-        resp.headers["Vary"] = "Origin"
+        resp.headers.update(cors_headers(request.headers))
         return resp
 
 
 @app.after_request
 def ensure_cors_headers(response):
-    origin = request.headers.get("Origin")
-    # Para forzar CORS en Azure App Service, devuelve siempre un ACAO. Si hay Origin, refléjalo; si no, usa *.
-    allow_origin = origin or "*"
-    response.headers["Access-Control-Allow-Origin"] = allow_origin
-    response.headers["Access-Control-Allow-Credentials"] = "true"
-    response.headers["Access-Control-Allow-Headers"] = (
-        request.headers.get("Access-Control-Request-Headers", "Content-Type,Authorization")
-    )
-    response.headers["Access-Control-Allow-Methods"] = "GET,POST,OPTIONS"
-    response.headers["Vary"] = "Origin"
+    response.headers.update(cors_headers(request.headers))
     return response
 
 
 # Permitir importar seeds desde tools/
 ROOT = Path(__file__).resolve().parents[1]
 sys.path.append(str(ROOT / "tools"))
+DB_INIT_SQL = ROOT / "api" / "db_init.sql"
+SNAPSHOT_DIR = Path(os.environ.get("SNAPSHOT_DIR") or ROOT / "snapshots")  # baseline + estado del reset
+SNAPSHOT_BASELINE = SNAPSHOT_DIR / "baseline"
 
 
 
@@ -104,7 +158,11 @@ OPENAPI_SPEC = {
         },
         "/healthzdb": {
             "get": {
-                "summary": "Health DBs",
+                "summary": "Health DBs (último sondeo del monitor en segundo plano)",
+                "parameters": [
+                    {"name": "fresh", "in": "query", "schema": {"type": "integer", "enum": [1]},
+                     "description": "re-sondea antes de responder (máx. HEALTH_TIMEOUT_SEC)"}
+                ],
                 "responses": {"200": {"description": "ok"}, "503": {"description": "db error"}}
             }
         },
@@ -129,29 +187,206 @@ OPENAPI_SPEC = {
                         }
                     }
                 },
-                "responses": {"201": {"description": "evento aceptado"}}
+                "responses": {
+                    "201": {"description": "evento aceptado (transicion indica si cambió el estado del sensor)"},
+                    "400": {"description": "payload inválido"},
+                    "422": {"description": "sensor no registrado, de otro estacionamiento o no operativo"},
+                    "202": {"description": "evento encolado (INGEST_MODE=buffered) o sólo en events_raw (INGEST_MODE=raw)"},
+                    "429": {"description": "cola de ingesta llena"},
+                    "503": {"description": "ingesta no disponible"}
+                }
+            }
+        },
+        "/sensor_events": {
+            "post": {
+                "summary": "Ingesta en lote (arreglo JSON o NDJSON)",
+                "requestBody": {
+                    "required": True,
+                    "content": {
+                        "application/json": {"schema": {"type": "array", "items": {"type": "object"}}},
+                        "application/x-ndjson": {"schema": {"type": "string"}}
+                    }
+                },
+                "responses": {
+                    "200": {"description": "resultado por evento (index, ok, error, transicion)"},
+                    "202": {"description": "encolado (INGEST_MODE=buffered) o sólo en events_raw (INGEST_MODE=raw)"},
+                    "429": {"description": "cola de ingesta llena"},
+                    "400": {"description": "cuerpo inválido (con application/json debe ser un arreglo)"},
+                    "413": {"description": "lote demasiado grande (BULK_MAX_EVENTS o BULK_MAX_BYTES)"}
+                }
+            }
+        },
+        "/metrics": {
+            "get": {
+                "summary": "Métricas Prometheus (latencia por ruta, pool de Postgres, Mongo); agregadas entre workers",
+                "responses": {"200": {"description": "text/plain; version=0.0.4"}, "401": {"description": "unauthorized"}}
             }
         },
+        "/ingest/stats": {
+            "get": {"summary": "Modo de ingesta, profundidad de la cola del worker y avance del proyector (raw)", "responses": {"200": {"description": "ok"}}}
+        },
         "/status_overview": {
             "get": {
                 "summary": "Últimos eventos y registros",
+                "parameters": [
+                    {"name": "format", "in": "query", "schema": {"type": "string", "enum": ["rows", "columnar"]},
+                     "description": "columnar: registro_data como fields + columns"}
+                ],
+                "responses": {"200": {"description": "ok"}}
+            }
+        },
+        "/occupancy": {
+            "get": {
+                "summary": "Libres/ocupados actuales por campus, estacionamiento y piso",
+                "parameters": [{"name": "campus", "in": "query", "schema": {"type": "string"}}],
+                "responses": {"200": {"description": "ok"}}
+            }
+        },
+        "/sensor_state": {
+            "get": {
+                "summary": "Estado actual por sensor",
+                "parameters": [
+                    {"name": "sensor_id", "in": "query", "schema": {"type": "integer"}},
+                    {"name": "estacionamiento_id", "in": "query", "schema": {"type": "string"}},
+                    {"name": "campus", "in": "query", "schema": {"type": "string"}}
+                ],
+                "responses": {"200": {"description": "ok"}}
+            }
+        },
+        "/stream": {
+            "get": {
+                "summary": "Cambios de estado en vivo (Server-Sent Events); reanuda con Last-Event-ID",
+                "parameters": [
+                    {"name": "campus", "in": "query", "schema": {"type": "string"}},
+                    {"name": "estacionamiento_id", "in": "query", "schema": {"type": "string"}},
+                    {"name": "last_event_id", "in": "query", "schema": {"type": "string"}}
+                ],
+                "responses": {"200": {"description": "text/event-stream"},
+                              "503": {"description": "stream deshabilitado o tope de suscriptores del worker (Retry-After)"}}
+            }
+        },
+        "/nearby_free": {
+            "get": {
+                "summary": "Estacionamientos más cercanos con sensores libres (PostGIS, k-NN)",
+                "parameters": [
+                    {"name": "lat", "in": "query", "required": True, "schema": {"type": "number"}},
+                    {"name": "lon", "in": "query", "required": True, "schema": {"type": "number"}},
+                    {"name": "radius", "in": "query", "schema": {"type": "number", "default": 2000},
+                     "description": "metros (máx. 50000)"},
+                    {"name": "limit", "in": "query", "schema": {"type": "integer", "default": 5, "maximum": 50}}
+                ],
+                "responses": {"200": {"description": "ok (ordenado por distancia)"}, "400": {"description": "parámetros inválidos"}}
+            }
+        },
+        "/occupancy_history": {
+            "get": {
+                "summary": "Curvas de ocupación (rollups horarios/diarios)",
+                "parameters": [
+                    {"name": "scope", "in": "query", "schema": {"type": "string", "enum": ["campus", "estacionamiento"]}},
+                    {"name": "bucket", "in": "query", "schema": {"type": "string", "enum": ["1h", "1d"]}},
+                    {"name": "id", "in": "query", "schema": {"type": "string"}, "description": "código de campus o id de estacionamiento"},
+                    {"name": "from", "in": "query", "schema": {"type": "string", "format": "date-time"}},
+                    {"name": "to", "in": "query", "schema": {"type": "string", "format": "date-time"}}
+                ],
                 "responses": {"200": {"description": "ok"}}
             }
         },
+        "/dwell_stats": {
+            "get": {
+                "summary": "Permanencia promedio/mediana y rotación por estacionamiento (sesiones cerradas en el rango)",
+                "parameters": [
+                    {"name": "campus", "in": "query", "schema": {"type": "string"}},
+                    {"name": "estacionamiento_id", "in": "query", "schema": {"type": "string"}},
+                    {"name": "from", "in": "query", "schema": {"type": "string", "format": "date-time"},
+                     "description": "default: 7 días antes de to"},
+                    {"name": "to", "in": "query", "schema": {"type": "string", "format": "date-time"}}
+                ],
+                "responses": {"200": {"description": "ok"}, "400": {"description": "fechas inválidas"}}
+            }
+        },
         "/registro_data": {
             "get": {
                 "summary": "Listar registros normalizados",
                 "parameters": [
                     {"name": "limit", "in": "query", "schema": {"type": "integer", "default": 50}},
                     {"name": "estacionamiento_id", "in": "query", "schema": {"type": "string"}},
-                    {"name": "sensor_id", "in": "query", "schema": {"type": "integer"}}
+                    {"name": "sensor_id", "in": "query", "schema": {"type": "integer"}},
+                    {"name": "from", "in": "query", "schema": {"type": "string", "format": "date-time"}},
+                    {"name": "to", "in": "query", "schema": {"type": "string", "format": "date-time"}},
+                    {"name": "cursor", "in": "query", "schema": {"type": "string"},
+                     "description": "next_cursor de la página anterior"},
+                    {"name": "format", "in": "query", "schema": {"type": "string", "enum": ["rows", "columnar"]},
+                     "description": "columnar: fields + columns (un arreglo por campo) en lugar de items"}
                 ],
-                "responses": {"200": {"description": "ok"}}
+                "responses": {
+                    "200": {"description": "ok (incluye next_cursor si hay más filas)"},
+                    "400": {"description": "filtro, cursor o formato inválido"}
+                }
+            }
+        },
+        "/registro_data/export": {
+            "get": {
+                "summary": "Exportación en streaming de registro_data (orden created_at ascendente)",
+                "parameters": [
+                    {"name": "format", "in": "query",
+                     "schema": {"type": "string", "enum": ["csv", "ndjson", "parquet", "arrow"], "default": "csv"}},
+                    {"name": "from", "in": "query", "schema": {"type": "string", "format": "date-time"}},
+                    {"name": "to", "in": "query", "schema": {"type": "string", "format": "date-time"}},
+                    {"name": "campus", "in": "query", "schema": {"type": "string"}},
+                    {"name": "estacionamiento_id", "in": "query", "schema": {"type": "string"}},
+                    {"name": "sensor_id", "in": "query", "schema": {"type": "integer"}},
+                    {"name": "gzip", "in": "query", "schema": {"type": "integer", "enum": [1]},
+                     "description": "fuerza Content-Encoding: gzip (también con Accept-Encoding: gzip)"}
+                ],
+                "responses": {
+                    "200": {"description": "archivo en streaming"},
+                    "400": {"description": "filtro o formato inválido"},
+                    "429": {"description": "demasiadas exportaciones en curso (Retry-After)"},
+                    "501": {"description": "parquet/arrow sin pyarrow instalado"}
+                }
             }
         },
         "/admin/reset": {
             "post": {
-                "summary": "Reset DB y seed (requiere X-Admin-Token)",
+                "summary": "Reset del entorno en segundo plano (requiere X-Admin-Token)",
+                "parameters": [
+                    {"name": "mode", "in": "query",
+                     "schema": {"type": "string", "enum": ["restore", "rebuild", "capture"], "default": "restore"},
+                     "description": "restore: vuelve al snapshot (o rebuild si no hay uno válido); "
+                                    "rebuild: db_init.sql + seeds y nuevo snapshot; capture: sólo snapshot"},
+                    {"name": "wait", "in": "query", "schema": {"type": "number"},
+                     "description": "segundos a esperar el resultado (máx. 100)"}
+                ],
+                "responses": {
+                    "200": {"description": "terminado dentro de wait"},
+                    "202": {"description": "en curso (ver /admin/reset/status)"},
+                    "401": {"description": "unauthorized"},
+                    "409": {"description": "ya hay un reset en curso"}
+                }
+            }
+        },
+        "/admin/reset/status": {
+            "get": {
+                "summary": "Estado del último reset: running | done | error | interrupted (requiere X-Admin-Token)",
+                "responses": {"200": {"description": "ok"}, "401": {"description": "unauthorized"}}
+            }
+        },
+        "/admin/snapshot": {
+            "post": {
+                "summary": "Captura el estado actual como snapshot baseline, en segundo plano (requiere X-Admin-Token)",
+                "responses": {"202": {"description": "en curso"}, "401": {"description": "unauthorized"},
+                              "409": {"description": "ya hay un reset en curso"}}
+            }
+        },
+        "/admin/rollups": {
+            "post": {
+                "summary": "Refresco incremental de rollups de ocupación (requiere X-Admin-Token)",
+                "responses": {"200": {"description": "ok"}, "401": {"description": "unauthorized"}}
+            }
+        },
+        "/admin/partitions": {
+            "post": {
+                "summary": "Crea particiones futuras de registro_data y aplica retención (requiere X-Admin-Token)",
                 "responses": {"200": {"description": "ok"}, "401": {"description": "unauthorized"}}
             }
         }
@@ -173,36 +408,347 @@ def pg_fetchall(sql: str, params=None):
             return cur.fetchall()
 
 
-# ---- Rutas ----
-@app.get("/healthzdb")
-def healthzdb():
-    pg_ok = False
-    mongo_ok = False
-    errors = {}
+# ---- Ocupación en memoria ----
+occupancy = OccupancyState()
+
+# ---- Caché de respuestas de lectura (invalidada por la ingesta) ----
+response_cache = ResponseCache(
+    ttl=RESPONSE_CACHE_TTL, max_entries=RESPONSE_CACHE_MAX_ENTRIES, max_age=RESPONSE_CACHE_MAX_AGE
+)
+
+
+def _mark_ingested(docs):
+    for est_id in {doc["estacionamiento_id"] for doc in docs}:
+        response_cache.bump(occupancy.campus_of(est_id))
+
+
+def _campus_scope():
+    # Campus del que depende la respuesta (None = todos los campus)
+    if request.args.get("campus"):
+        return request.args["campus"]
+    if request.args.get("estacionamiento_id") and not request.args.get("sensor_id"):
+        return occupancy.campus_of(request.args["estacionamiento_id"])
+    return None
+
+
+def _load_occupancy():
+    lots = pg_fetchall("""
+        SELECT e.id, c.codigo, e.piso
+        FROM estacionamiento e JOIN campus c ON c.id = e.campus_id;
+    """)
+    sensors = pg_fetchall("""
+        SELECT s.id, s.estacionamiento_id, st.estado, st.last_seen_at
+        FROM sensor s
+        LEFT JOIN sensor_state st ON st.sensor_id = s.id;
+    """)
+    occupancy.load(lots, sensors)
+
 
-    # PG
+def _occupancy_refresher():
+    # Precalienta al arrancar y re-sincroniza periódicamente: cada worker sólo
+    # ve en vivo los eventos que él mismo ingiere.
+    while True:
+        try:
+            _load_occupancy()
+        except Exception as e:
+            print(f"[WARN] carga de ocupación: {e}")
+        if OCCUPANCY_REFRESH_SEC <= 0:
+            return
+        time.sleep(OCCUPANCY_REFRESH_SEC)
+
+
+
+# ---- Registro de sensores en memoria (validación previa a la ingesta) ----
+sensor_registry = SensorRegistry(reject_states=SENSOR_REJECT_STATES)
+_registry_misses = {}  # sensor_id -> instante hasta el que se considera inexistente
+_REGISTRY_MISS_TTL = 30.0
+# Margen al pedir cambios: filas con modified_at anterior al watermark que
+# se confirmaron tarde (transacciones largas) no se pierden.
+_REGISTRY_OVERLAP_SEC = 300
+
+SENSOR_REGISTRY_SQL = """
+    SELECT s.id, s.estacionamiento_id, s.estado_funcionamiento, c.codigo, s.config->>'tipo',
+           COALESCE(s.modified_at, s.created_at)
+    FROM sensor s
+    JOIN estacionamiento e ON e.id = s.estacionamiento_id
+    JOIN campus c ON c.id = e.campus_id
+"""
+
+
+def _sensors_meta(query=None):
     try:
-        pg_fetchall("SELECT 1;")
-        pg_ok = True
-    except Exception as e:
-        errors["postgres"] = str(e)
+        return list(col_meta_sensors.find(query or {}))
+    except PyMongoError as e:
+        print(f"[WARN] lectura sensors_meta: {e}")
+        return None
+
+
+def _load_sensor_registry(full: bool):
+    if full or not sensor_registry.warmed:
+        rows = pg_fetchall(SENSOR_REGISTRY_SQL + ";")
+        sensor_registry.load(rows, _sensors_meta())
+        return
+    since = sensor_registry.watermark
+    rows = pg_fetchall(
+        SENSOR_REGISTRY_SQL + " WHERE COALESCE(s.modified_at, s.created_at) > %s - make_interval(secs => %s);",
+        (since, _REGISTRY_OVERLAP_SEC),
+    ) if since else []
+    meta = _sensors_meta({"updated_at": {"$gt": since}}) if since else None
+    sensor_registry.upsert(rows, meta)
+
+
+def _sensor_registry_refresher():
+    last_full = 0.0
+    while True:
+        full = time.monotonic() - last_full >= SENSOR_REGISTRY_FULL_SEC
+        try:
+            _load_sensor_registry(full)
+            if full:
+                last_full = time.monotonic()
+                _registry_misses.clear()
+        except Exception as e:
+            print(f"[WARN] carga del registro de sensores: {e}")
+        if SENSOR_REGISTRY_REFRESH_SEC <= 0:
+            return
+        time.sleep(SENSOR_REGISTRY_REFRESH_SEC)
+
+
+
+def _check_sensor(sensor_id: int, est_id: str):
+    """Motivo de rechazo del evento o None. Sin registro cargado no bloquea (decide la FK)."""
+    if not sensor_registry.warmed:
+        return None
+    if not sensor_registry.known(sensor_id):
+        # Sensor dado de alta después del último refresco: una consulta puntual,
+        # con caché negativa para que ids inexistentes no lleguen siempre a PG.
+        if _registry_misses.get(sensor_id, 0) > time.monotonic():
+            return f"sensor_id {sensor_id} no registrado"
+        try:
+            rows = pg_fetchall(SENSOR_REGISTRY_SQL + " WHERE s.id = %s;", (sensor_id,))
+        except Exception as e:
+            print(f"[WARN] consulta de sensor {sensor_id}: {e}")
+            return None
+        if rows:
+            sensor_registry.upsert(rows)
+        else:
+            if len(_registry_misses) > 10000:
+                _registry_misses.clear()
+            _registry_misses[sensor_id] = time.monotonic() + _REGISTRY_MISS_TTL
+    return sensor_registry.check(sensor_id, est_id)
+
+
+# ---- Rollups de ocupación ----
+def _refresh_rollups():
+    # Conexión dedicada: el refresco puede tardar y no debe ocupar el pool
+    with psycopg.connect(PG_CONN, autocommit=True) as conn:
+        result = rollups.refresh(conn)
+    if not result.get("skipped"):
+        response_cache.bump()
+    return result
+
+
+def _rollup_refresher():
+    while True:
+        time.sleep(ROLLUP_REFRESH_SEC)
+        try:
+            _refresh_rollups()
+        except Exception as e:
+            print(f"[WARN] refresco de rollups: {e}")
+
+
+
+# ---- Cambios en vivo (LISTEN/NOTIFY -> /stream) ----
+change_hub = ChangeHub(buffer_size=STREAM_BUFFER)
+
+
+def _on_change(event):
+    # Llega desde cualquier worker: mantiene la ocupación en memoria al día
+    # entre workers y lo reparte a los suscriptores SSE de este proceso.
+    if event.get("reset"):
+        # Otro worker terminó un /admin/reset: las tablas cambiaron por completo
+        _reload_after_reset()
+        return
+    ts = datetime.fromisoformat(event["ts"])
+    occupancy.apply(event["sensor_id"], event["estacionamiento_id"], event["estado"], ts)
+    event["campus"] = occupancy.campus_of(event["estacionamiento_id"])
+    response_cache.bump(event["campus"])
+    change_hub.publish(event)
+
+
+
+# ---- Persistencia de eventos (lote) ----
+def _write_docs(docs):
+    # Crudo en Mongo (insert_many sin orden) y normalizado en Postgres (COPY en
+    # una transacción) sólo para lo que llegó a Mongo; con INGEST_MODE=raw
+    # Postgres lo escribe projector.py. Errores por posición y posiciones que
+    # fueron transiciones de estado.
+    errors = ingest.mongo_insert_many(
+        col_events_raw, [events_raw.to_layout(d, EVENTS_RAW_LAYOUT) for d in docs],
+        skip_existing=EVENTS_RAW_LAYOUT == "timeseries",
+    )
+    transiciones = set()
+    pending = [pos for pos in range(len(docs)) if pos not in errors]
+    if pending and INGEST_MODE != "raw":
+        with pg_pool.connection() as conn:
+            pg_errors, pg_trans = ingest.pg_write_events(
+                conn, [docs[pos] for pos in pending], notify=STREAM_NOTIFY, dedup=REGISTRO_DEDUP
+            )
+        for i, err in pg_errors.items():
+            errors[pending[i]] = err
+        transiciones = {pending[i] for i in pg_trans}
+    written = [doc for pos, doc in enumerate(docs) if pos not in errors]
+    for doc in written:
+        occupancy.apply(doc["sensor_id"], doc["estacionamiento_id"], doc["estado"], doc["ts"])
+    _mark_ingested(written)
+    return errors, transiciones
+
+
+def _persist_docs(docs):
+    return _write_docs(docs)[0]
+
+
+# ---- Ingesta diferida (INGEST_MODE=buffered) ----
+ingest_buffer = None
+if INGEST_MODE == "buffered":
+    ingest_buffer = IngestBuffer(
+        _persist_docs,
+        max_size=int(os.environ.get("INGEST_BUFFER_MAX", "10000")),
+        batch_size=int(os.environ.get("INGEST_BATCH_SIZE", "500")),
+        flush_interval=int(os.environ.get("INGEST_FLUSH_MS", "200")) / 1000,
+    )
+
+
+# ---- Salud de dependencias (/healthzdb) ----
+# Postgres con una conexión del pool (sin abrir una nueva por sondeo: ni TLS
+# ni cupos de conexión extra) y Mongo con un cliente propio de timeouts cortos
+# (los de la app, 20 s de selección de servidor, no aplican a los sondeos).
+health_mongo = MongoClient(
+    MONGODB_URI, tlsCAFile=certifi.where(), connect=False,
+    serverSelectionTimeoutMS=int(HEALTH_TIMEOUT_SEC * 1000), connectTimeoutMS=int(HEALTH_TIMEOUT_SEC * 1000),
+    socketTimeoutMS=int(HEALTH_TIMEOUT_SEC * 1000),
+)
+
+
+def _probe_postgres():
+    # Pool agotado más de HEALTH_TIMEOUT_SEC también cuenta como falla
+    with pg_pool.connection(timeout=HEALTH_TIMEOUT_SEC) as conn, conn.transaction():
+        conn.execute(f"SET LOCAL statement_timeout = {int(HEALTH_TIMEOUT_SEC * 1000)};")
+        conn.execute("SELECT 1;")
+
+
+def _probe_mongo():
+    health_mongo.admin.command("ping")
+
+
+health_monitor = HealthMonitor(
+    {"postgres": _probe_postgres, "mongo": _probe_mongo},
+    interval=HEALTH_INTERVAL_SEC, timeout=HEALTH_TIMEOUT_SEC, on_result=metrics.observe_dependency,
+)
 
-    # MONGO
+
+# ---- Arranque por worker ----
+WARMUP_TIMEOUT_SEC = float(os.environ.get("WARMUP_TIMEOUT_SEC", "30"))
+_worker = {"pid": None, "ready": False, "preloaded": False, "import_s": None, "warmup_s": None, "cold_start_s": None}
+_worker_lock = threading.Lock()
+_IMPORT_S = time.perf_counter() - _BOOT_T0
+
+
+def start_worker():
+    """
+    Abre los pools e inicia los hilos de fondo en este proceso (idempotente).
+    Se llama después del fork: post_fork de gunicorn.conf.py, create_app() o el
+    lifespan de asgi.py. No bloquea: las conexiones se calientan en segundo plano.
+    """
+    with _worker_lock:
+        if _worker["pid"] == os.getpid():
+            return
+        _worker.update(pid=os.getpid(), ready=False, preloaded=os.getpid() != _BOOT_PID, import_s=round(_IMPORT_S, 3))
+    started = time.perf_counter()
+
+    pg_pool.open(wait=False)  # min_size conexiones en segundo plano
+    if ingest_buffer:
+        ingest_buffer.start()
+        # gunicorn detiene workers con SIGTERM -> sys.exit -> atexit: drena la cola
+        atexit.register(ingest_buffer.close)
+    metrics.start_sampler(
+        pg_pool, METRICS_SAMPLE_SEC, queue_depth=(lambda: ingest_buffer.depth) if ingest_buffer else None
+    )
+    health_monitor.start()
+    if STREAM_NOTIFY:
+        start_listener(PG_CONN, ingest.STREAM_CHANNEL, [_on_change])
+    threading.Thread(target=_occupancy_refresher, name="occupancy-refresh", daemon=True).start()
+    threading.Thread(target=_sensor_registry_refresher, name="sensor-registry-refresh", daemon=True).start()
+    if ROLLUP_REFRESH_SEC > 0:
+        # Un advisory lock evita que los workers refresquen a la vez
+        threading.Thread(target=_rollup_refresher, name="rollup-refresh", daemon=True).start()
+    threading.Thread(target=_warm_up, args=(started,), name="warm-up", daemon=True).start()
+
+
+def _warm_up(started: float):
+    # Handshakes (TCP/TLS/auth) de Postgres y Mongo y primeras cargas en memoria
+    # antes de que los pida un request. Mide el arranque en frío del worker.
+    deadline = started + WARMUP_TIMEOUT_SEC
+    ready = True
     try:
-        mongo.admin.command("ping")
-        mongo_ok = True
+        pg_pool.wait(timeout=WARMUP_TIMEOUT_SEC)
     except Exception as e:
-        errors["mongo"] = str(e)
+        ready = False
+        print(f"[WARN] warm-up postgres: {e}")
+    try:
+        mongo.admin.command("ping")
+    except PyMongoError as e:
+        ready = False
+        print(f"[WARN] warm-up mongo: {e}")
+    while not (occupancy.warmed and sensor_registry.warmed) and time.perf_counter() < deadline:
+        time.sleep(0.05)
+
+    warmup = time.perf_counter() - started
+    # Con --preload el import ocurrió en el master, antes del fork: no cuenta para este worker
+    cold_start = warmup if _worker["preloaded"] else _IMPORT_S + warmup
+    _worker.update(ready=ready and occupancy.warmed and sensor_registry.warmed, warmup_s=round(warmup, 3),
+                   cold_start_s=round(cold_start, 3))
+    metrics.observe_cold_start(_IMPORT_S, warmup, cold_start)
+    print(f"[BOOT] worker {os.getpid()} listo={_worker['ready']} arranque={cold_start:.2f}s "
+          f"(import {_IMPORT_S:.2f}s{' en el master' if _worker['preloaded'] else ''}, warm-up {warmup:.2f}s)")
+
+
+def create_app():
+    """Fábrica para servidores sin hook post-fork (python app.py, tests): inicia el worker y devuelve la app."""
+    start_worker()
+    return app
+
+
+def _buffer_unavailable():
+    resp = jsonify({"ok": False, "error": "ingesta no disponible (worker en apagado)"})
+    resp.headers["Retry-After"] = "5"
+    return resp, 503
+
+
+# ---- Rutas ----
+@app.get("/healthzdb")
+def healthzdb():
+    # Responde desde el último sondeo del monitor; ?fresh=1 fuerza una ronda
+    # (acotada por HEALTH_TIMEOUT_SEC). Antes del primer sondeo también se espera.
+    if request.args.get("fresh") == "1" or not health_monitor.checked:
+        health_monitor.probe()
+    checks = health_monitor.snapshot()
+    pg_ok = checks["postgres"]["ok"]
+    mongo_ok = checks["mongo"]["ok"]
+    errors = {name: c["error"] for name, c in checks.items() if not c["ok"]}
 
     ok = pg_ok and mongo_ok
     status = 200 if ok else 503   # importante: NO 500 → 503 = service unavailable
 
-
     return jsonify({
         "ok": ok,
         "postgres": pg_ok,
         "mongo": mongo_ok,
-        "errors": errors if not ok else None
+        "errors": errors if not ok else None,
+        "checks": {
+            name: {**c, "checked_at": c["checked_at"].isoformat() if c["checked_at"] else None}
+            for name, c in checks.items()
+        },
+        "worker": dict(_worker),
     }), status
 
 
@@ -211,6 +757,14 @@ def healthz():
     return {"ok": True}
 
 
+@app.get("/metrics")
+def metrics_endpoint():
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return jsonify({"ok": False, "error": "unauthorized"}), 401
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+
 
 @app.post("/sensor_event")
 def sensor_event():
@@ -220,77 +774,448 @@ def sensor_event():
     except Exception as e:
         return jsonify({"ok": False, "error": f"payload inválido: {e}"}), 400
 
-    ts = data.ts or datetime.utcnow()
-    doc = {
-        "sensor_id": data.sensor_id,
-        "estacionamiento_id": data.estacionamiento_id,
-        "estado": data.estado,
-        "ts": ts,
-        "payload": data.payload or {}
-    }
+    # Sensor inexistente, de otro estacionamiento o fuera de servicio: se
+    # rechaza antes de escribir en Mongo/Postgres
+    rejected = _check_sensor(data.sensor_id, data.estacionamiento_id)
+    if rejected:
+        return jsonify({"ok": False, "error": rejected}), 422
+
+    doc = ingest.build_doc(data, sensor_meta=sensor_registry.meta(data.sensor_id))
+    ts = doc["ts"]
+
+    if ingest_buffer:
+        if not ingest_buffer.accepting:
+            return _buffer_unavailable()
+        if not ingest_buffer.offer(doc):
+            resp = jsonify({"ok": False, "error": "cola de ingesta llena"})
+            resp.headers["Retry-After"] = "1"
+            return resp, 429
+        return jsonify({"ok": True, "queued": True, "ts": ts.isoformat(), "estado": data.estado}), 202
 
     # 1) Inserta crudo en Mongo
     try:
-        col_events_raw.insert_one(doc)
+        col_events_raw.insert_one(events_raw.to_layout(doc, EVENTS_RAW_LAYOUT))
     except PyMongoError as e:
         return jsonify({"ok": False, "error": f"mongo insert: {e}"}), 502
 
-    # 2) Normaliza en Postgres
-    hora_ocupado = ts if data.estado == "ocupado" else None
-    hora_libre = ts if data.estado == "libre" else None
+    if INGEST_MODE == "raw":
+        # Postgres lo aplica el proyector; la ocupación en memoria se adelanta
+        occupancy.apply(data.sensor_id, data.estacionamiento_id, data.estado, ts)
+        _mark_ingested([doc])
+        return jsonify({"ok": True, "queued": True, "ts": ts.isoformat(), "estado": data.estado}), 202
+
+    # 2) Normaliza en Postgres (registro + estado actual)
     try:
-        pg_exec(
-            """
-            INSERT INTO registro_data(
-              sensor_id, estacionamiento_id, hora_libre, tiempo_libre, hora_ocupado, tiempo_ocupado, estado, created_at
-            ) VALUES (%s, %s, %s, NULL, %s, NULL, %s, %s)
-            """,
-            (data.sensor_id, data.estacionamiento_id, hora_libre, hora_ocupado, data.estado, ts)
-        )
+        with pg_pool.connection() as conn:
+            transicion = ingest.pg_write_event(conn, doc, notify=STREAM_NOTIFY, dedup=REGISTRO_DEDUP)
     except Exception as e:
         return jsonify({"ok": False, "error": f"pg insert: {e}"}), 502
 
-    return jsonify({"ok": True, "ts": ts.isoformat(), "estado": data.estado}), 201
+    occupancy.apply(data.sensor_id, data.estacionamiento_id, data.estado, ts)
+    _mark_ingested([doc])
+
+    return jsonify({"ok": True, "ts": ts.isoformat(), "estado": data.estado, "transicion": transicion}), 201
+
+
+@app.post("/sensor_events")
+def sensor_events():
+    # Ingesta en lote: arreglo JSON o NDJSON (una línea por evento). El tope en
+    # bytes se revisa antes de leer y parsear el cuerpo.
+    if BULK_MAX_BYTES and (request.content_length or 0) > BULK_MAX_BYTES:
+        return jsonify({"ok": False, "error": f"máximo {BULK_MAX_BYTES} bytes por lote"}), 413
+    raw = request.get_data(cache=False)
+    try:
+        items, errors = ingest.parse_body(raw, ingest.is_ndjson(request.mimetype, raw))
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+
+    total = len(items) + len(errors)
+    if total > BULK_MAX_EVENTS:
+        return jsonify({"ok": False, "error": f"máximo {BULK_MAX_EVENTS} eventos por lote"}), 413
+
+    events, invalid = ingest.validate_events(items)
+    errors.update(invalid)
+    transiciones = None  # desconocidas en modo diferido
+
+    for idx, ev in events:
+        rejected = _check_sensor(ev.sensor_id, ev.estacionamiento_id)
+        if rejected:
+            errors[idx] = rejected
+    events = [(idx, ev) for idx, ev in events if idx not in errors]
+
+    now = datetime.utcnow()
+    indexes = [idx for idx, _ in events]
+    docs = [ingest.build_doc(ev, now, sensor_registry.meta(ev.sensor_id)) for _, ev in events]
+
+    if ingest_buffer:
+        # Modo diferido: se encola y se confirma con 202
+        if not ingest_buffer.accepting:
+            return _buffer_unavailable()
+        for idx, doc in zip(indexes, docs):
+            if not ingest_buffer.offer(doc):
+                errors[idx] = "cola de ingesta llena"
+    else:
+        transiciones = set()
+        try:
+            persist_errors, persist_trans = _write_docs(docs)
+            transiciones = {indexes[pos] for pos in persist_trans} if INGEST_MODE != "raw" else None
+        except PyMongoError as e:
+            persist_errors = {pos: f"mongo insert: {e}" for pos in range(len(docs))}
+        except Exception as e:
+            persist_errors = {pos: f"pg insert: {e}" for pos in range(len(docs))}
+        for pos, err in persist_errors.items():
+            errors[indexes[pos]] = err
+
+    results = [
+        {"index": i, "ok": False, "error": errors[i]} if i in errors
+        else {"index": i, "ok": True} if transiciones is None
+        else {"index": i, "ok": True, "transicion": i in transiciones}
+        for i in range(total)
+    ]
+    accepted = total - len(errors)
+    status = 200
+    if ingest_buffer and docs:
+        status = 202 if accepted else 429
+    elif INGEST_MODE == "raw" and accepted:
+        status = 202
+    resp = jsonify({
+        "ok": not errors,
+        "accepted": accepted,
+        "rejected": len(errors),
+        "transiciones": len(transiciones) if transiciones is not None else None,
+        "results": results,
+    })
+    if status == 429:
+        resp.headers["Retry-After"] = "1"
+    return resp, status
+
+
+def _projector_status():
+    # Avance del proyector (projector.py) según su checkpoint en Postgres
+    try:
+        rows = pg_fetchall("""
+            SELECT name, last_ts, events, failed, behind, scan_before IS NOT NULL,
+                   EXTRACT(EPOCH FROM now() - coalesce(last_ts, updated_at))::float
+            FROM projector_checkpoint ORDER BY name;
+        """)
+    except psycopg.Error as e:
+        return {"error": str(e)}
+    return [
+        {"name": name, "last_ts": last_ts.isoformat() if last_ts else None, "events": events, "failed": failed,
+         "behind": behind,
+         "scan_pending": scan_pending, "lag_s": round(lag, 1) if lag is not None else None}
+        for name, last_ts, events, failed, behind, scan_pending, lag in rows
+    ]
+
+
+@app.get("/ingest/stats")
+def ingest_stats():
+    stats = ingest_buffer.snapshot() if ingest_buffer else None
+    return jsonify({"ok": True, "mode": INGEST_MODE, "pid": os.getpid(), "buffer": stats,
+                    "projector": _projector_status() if INGEST_MODE == "raw" else None,
+                    "stream_subscribers": change_hub.subscribers,
+                    "response_cache": response_cache.snapshot(),
+                    "sensor_registry": {
+                        "sensors": len(sensor_registry),
+                        "warmed_at": sensor_registry.warmed_at.isoformat() if sensor_registry.warmed_at else None,
+                    }})
+
+
+# Estado actual desde sensor_state (tamaño = nº de sensores, no el histórico)
+# Campos de las filas de registro en /status_overview y /registro_data; las
+# fechas llegan como texto ISO desde Postgres y las tuplas se usan tal cual.
+REGISTRO_FIELDS = ("sensor_id", "estacionamiento_id", "estado", "hora_libre", "hora_ocupado", "created_at")
+
+STATUS_OVERVIEW_SQL = f"""
+    SELECT sensor_id, estacionamiento_id, estado,
+           {iso_sql("CASE WHEN estado = 'libre' THEN last_change_at END")} AS hora_libre,
+           {iso_sql("CASE WHEN estado = 'ocupado' THEN last_change_at END")} AS hora_ocupado,
+           {iso_sql("last_seen_at")} AS created_at
+    FROM sensor_state
+    ORDER BY last_seen_at DESC
+    LIMIT 5;
+"""
+
+
+def status_rows(rows, fmt: str = "rows"):
+    return columnar(REGISTRO_FIELDS, rows) if fmt == "columnar" else row_dicts(REGISTRO_FIELDS, rows)
+
+
+def _list_format():
+    fmt = request.args.get("format", "rows")
+    return fmt if fmt in ("rows", "columnar") else None
 
 
 @app.get("/status_overview")
+@response_cache.cached()
 def status_overview():
+    fmt = _list_format()
+    if fmt is None:
+        return jsonify({"ok": False, "error": "format debe ser rows o columnar"}), 400
     try:
-        last_events = list(
-            col_events_raw.find({}, {"_id": 0})
-            .sort("ts", DESCENDING)
-            .limit(5)
-        )
+        last_events = [
+            events_raw.flatten(d)
+            for d in col_events_raw.find({}, {"_id": 0}).sort("ts", DESCENDING).limit(5)
+        ]
     except PyMongoError as e:
         last_events = []
         print(f"[WARN] mongo read: {e}")
 
     try:
-        rows = pg_fetchall("""
-            SELECT sensor_id, estacionamiento_id, estado, hora_libre, hora_ocupado, created_at
-            FROM registro_data
-            ORDER BY created_at DESC
-            LIMIT 5;
-        """)
-        reg = [
-            {
-                "sensor_id": r[0],
-                "estacionamiento_id": r[1],
-                "estado": r[2],
-                "hora_libre": r[3].isoformat() if r[3] else None,
-                "hora_ocupado": r[4].isoformat() if r[4] else None,
-                "created_at": r[5].isoformat() if r[5] else None,
-            }
-            for r in rows
-        ]
+        reg = status_rows(pg_fetchall(STATUS_OVERVIEW_SQL), fmt)
     except Exception as e:
-        reg = []
+        reg = status_rows([], fmt)
         print(f"[WARN] pg read: {e}")
 
     return jsonify({"last_events": last_events, "registro_data": reg})
 
 
+@app.get("/occupancy")
+@response_cache.cached(_campus_scope)
+def occupancy_summary():
+    if not occupancy.warmed:
+        try:
+            _load_occupancy()
+        except Exception as e:
+            return jsonify({"ok": False, "error": f"pg query: {e}"}), 502
+
+    campus = request.args.get("campus")
+    return jsonify({
+        "ok": True,
+        "warmed_at": occupancy.warmed_at.isoformat(),
+        **occupancy.summary(campus),
+    })
+
+
+def stream_match(campus, est_id):
+    # Filtro de /stream por campus y/o estacionamiento (también lo usa asgi.py)
+    def match(event):
+        return (not campus or event.get("campus") == campus) and (
+            not est_id or event.get("estacionamiento_id") == est_id
+        )
+
+    return match
+
+
+@app.get("/stream")
+def stream_changes():
+    # SSE: un evento "cambio" por transición de estado; "resync" pide recargar /occupancy.
+    # Aquí cada cliente retiene un hilo del worker: con tope para no dejar sin hilos
+    # al resto de las rutas (asgi.py sirve /stream sin ese costo).
+    if not STREAM_NOTIFY:
+        return jsonify({"ok": False, "error": "stream deshabilitado (STREAM_NOTIFY=0)"}), 503
+    if STREAM_MAX_SUBSCRIBERS and change_hub.subscribers >= STREAM_MAX_SUBSCRIBERS:
+        resp = jsonify({"ok": False, "error": "demasiados suscriptores en este worker"})
+        resp.headers["Retry-After"] = "30"
+        return resp, 503
+    last_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    match = stream_match(request.args.get("campus"), request.args.get("estacionamiento_id"))
+
+    gen = change_hub.subscribe(last_id, match, heartbeat=STREAM_HEARTBEAT_SEC)
+    resp = Response(stream_with_context(gen), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"  # sin buffering en proxies (nginx/Azure)
+    return resp
+
+
+@app.get("/sensor_state")
+@response_cache.cached(_campus_scope)
+def sensor_state_list():
+    where = []
+    params = []
+    if request.args.get("sensor_id"):
+        try:
+            params.append(int(request.args["sensor_id"]))
+        except ValueError:
+            return jsonify({"ok": False, "error": "sensor_id debe ser entero"}), 400
+        where.append("st.sensor_id = %s")
+    if request.args.get("estacionamiento_id"):
+        where.append("st.estacionamiento_id = %s")
+        params.append(request.args["estacionamiento_id"])
+    if request.args.get("campus"):
+        where.append("c.codigo = %s")
+        params.append(request.args["campus"])
+
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+    try:
+        rows = pg_fetchall(f"""
+            SELECT st.sensor_id, st.estacionamiento_id, st.estado, st.last_change_at, st.last_seen_at
+            FROM sensor_state st
+            JOIN estacionamiento e ON e.id = st.estacionamiento_id
+            JOIN campus c ON c.id = e.campus_id
+            {where_sql}
+            ORDER BY st.sensor_id;
+        """, params)
+    except Exception as e:
+        return jsonify({"ok": False, "error": f"pg query: {e}"}), 502
+
+    items = [
+        {
+            "sensor_id": r[0],
+            "estacionamiento_id": r[1],
+            "estado": r[2],
+            "last_change_at": r[3].isoformat() if r[3] else None,
+            "last_seen_at": r[4].isoformat() if r[4] else None,
+        }
+        for r in rows
+    ]
+    return jsonify({"ok": True, "count": len(items), "items": items})
+
+
+def _encode_cursor(created_at: str, row_id):
+    raw = json.dumps([created_at, row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str):
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+    created_at, row_id = json.loads(raw)
+    return datetime.fromisoformat(created_at), int(row_id)
+
+
+# k-NN indexado: el GiST de estacionamiento.geo entrega los más cercanos en
+# orden (<->) y la búsqueda se detiene al juntar `limit` con sensores libres.
+NEARBY_FREE_SQL = """
+    WITH origen AS (SELECT ST_SetSRID(ST_MakePoint(%(lon)s, %(lat)s), 4326)::geography AS g)
+    SELECT e.id, c.codigo, e.piso, e.ubicacion, e.accesibilidad,
+           (SELECT count(*) FROM sensor_state st WHERE st.estacionamiento_id = e.id AND st.estado = 'libre'),
+           ST_Distance(e.geo, o.g), ST_Y(e.geo::geometry), ST_X(e.geo::geometry)
+    FROM origen o
+    JOIN estacionamiento e ON ST_DWithin(e.geo, o.g, %(radius)s)
+    JOIN campus c ON c.id = e.campus_id
+    WHERE EXISTS (SELECT 1 FROM sensor_state st WHERE st.estacionamiento_id = e.id AND st.estado = 'libre')
+    ORDER BY e.geo <-> o.g
+    LIMIT %(limit)s;
+"""
+
+
+@app.get("/nearby_free")
+def nearby_free():
+    try:
+        lat = float(request.args["lat"])
+        lon = float(request.args["lon"])
+        radius = float(request.args.get("radius", "2000"))
+        limit = int(request.args.get("limit", "5"))
+    except KeyError:
+        return jsonify({"ok": False, "error": "lat y lon son obligatorios"}), 400
+    except ValueError:
+        return jsonify({"ok": False, "error": "lat, lon, radius y limit deben ser numéricos"}), 400
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return jsonify({"ok": False, "error": "coordenadas fuera de rango"}), 400
+    radius = max(1.0, min(radius, 50000.0))
+    limit = max(1, min(limit, 50))
+
+    try:
+        rows = pg_fetchall(NEARBY_FREE_SQL, {"lat": lat, "lon": lon, "radius": radius, "limit": limit})
+    except Exception as e:
+        return jsonify({"ok": False, "error": f"pg query: {e}"}), 502
+
+    items = [
+        {
+            "estacionamiento_id": r[0],
+            "campus": r[1],
+            "piso": r[2],
+            "ubicacion": r[3],
+            "accesibilidad": r[4],
+            "libres": r[5],
+            "distancia_m": round(r[6], 1),
+            "lat": r[7],
+            "lon": r[8],
+        }
+        for r in rows
+    ]
+    return jsonify({"ok": True, "radius": radius, "count": len(items), "items": items})
+
+
+@app.get("/occupancy_history")
+@response_cache.cached()
+def occupancy_history():
+    scope = request.args.get("scope", "campus")
+    bucket = request.args.get("bucket", "1h")
+    if scope not in rollups.SCOPES:
+        return jsonify({"ok": False, "error": f"scope debe ser uno de {', '.join(rollups.SCOPES)}"}), 400
+    if bucket not in rollups.BUCKETS:
+        return jsonify({"ok": False, "error": f"bucket debe ser uno de {', '.join(rollups.BUCKETS)}"}), 400
+
+    try:
+        to = parse_ts(request.args["to"]) if request.args.get("to") else datetime.now(timezone.utc)
+        default_from = to - rollups.BUCKETS[bucket] * (7 * 24 if bucket == "1h" else 180)
+        frm = parse_ts(request.args["from"]) if request.args.get("from") else default_from
+    except ValueError:
+        return jsonify({"ok": False, "error": "from/to deben ser fechas ISO 8601"}), 400
+
+    params = [scope, bucket, frm, to]
+    id_filter = ""
+    if request.args.get("id"):
+        id_filter = "AND scope_id = %s"
+        params.append(request.args["id"])
+    params.append(20000)
+
+    try:
+        rows = pg_fetchall(rollups.HISTORY_SQL.format(id_filter=id_filter), params)
+    except Exception as e:
+        return jsonify({"ok": False, "error": f"pg query: {e}"}), 502
+
+    items = [
+        {
+            "id": r[0],
+            "bucket_start": r[1].isoformat(),
+            "sensores": r[2],
+            "ocupacion": round(r[4] / r[3], 4) if r[3] else None,
+            "segundos_ocupados": r[4],
+            "eventos": r[5],
+            "cambios_estado": r[6],
+            "pico_ocupados": r[7],
+        }
+        for r in rows
+    ]
+    return jsonify({"ok": True, "scope": scope, "bucket": bucket, "count": len(items), "items": items})
+
+
+@app.get("/dwell_stats")
+@response_cache.cached(_campus_scope)
+def dwell_stats():
+    try:
+        to = parse_ts(request.args["to"]) if request.args.get("to") else datetime.now(timezone.utc)
+        frm = parse_ts(request.args["from"]) if request.args.get("from") else to - timedelta(days=7)
+    except ValueError:
+        return jsonify({"ok": False, "error": "from/to deben ser fechas ISO 8601"}), 400
+    if frm >= to:
+        return jsonify({"ok": False, "error": "from debe ser anterior a to"}), 400
+
+    params = [frm, to]
+    filters = ""
+    if request.args.get("estacionamiento_id"):
+        filters += " AND p.estacionamiento_id = %s"
+        params.append(request.args["estacionamiento_id"])
+    if request.args.get("campus"):
+        filters += """ AND p.estacionamiento_id IN (
+            SELECT e.id FROM estacionamiento e JOIN campus c ON c.id = e.campus_id WHERE c.codigo = %s)"""
+        params.append(request.args["campus"])
+
+    try:
+        rows = pg_fetchall(sessions.STATS_SQL.format(filter=filters), params)
+    except Exception as e:
+        return jsonify({"ok": False, "error": f"pg query: {e}"}), 502
+
+    days = (to - frm).total_seconds() / 86400
+    items = [
+        {
+            "estacionamiento_id": r[0],
+            "plazas": r[1],
+            "sesiones_ocupado": r[2],
+            "ocupado_promedio_s": round(r[3], 1) if r[3] is not None else None,
+            "ocupado_mediana_s": round(r[4], 1) if r[4] is not None else None,
+            "libre_promedio_s": round(r[5], 1) if r[5] is not None else None,
+            "rotacion_por_plaza_dia": round(r[2] / r[1] / days, 3) if r[1] else None,
+        }
+        for r in rows
+    ]
+    return jsonify({"ok": True, "from": frm.isoformat(), "to": to.isoformat(), "count": len(items), "items": items})
+
+
 @app.get("/registro_data")
+@response_cache.cached(_campus_scope)
 def registro_data_list():
     try:
         limit = int(request.args.get("limit", "50"))
@@ -298,8 +1223,12 @@ def registro_data_list():
         return jsonify({"ok": False, "error": "limit debe ser entero"}), 400
 
     limit = max(1, min(limit, 500))
+    fmt = _list_format()
+    if fmt is None:
+        return jsonify({"ok": False, "error": "format debe ser rows o columnar"}), 400
     estacionamiento_id = request.args.get("estacionamiento_id")
     sensor_id = request.args.get("sensor_id")
+    cursor = request.args.get("cursor")
 
     where = []
     params = []
@@ -307,79 +1236,274 @@ def registro_data_list():
         where.append("estacionamiento_id = %s")
         params.append(estacionamiento_id)
     if sensor_id:
+        try:
+            params.append(int(sensor_id))
+        except ValueError:
+            return jsonify({"ok": False, "error": "sensor_id debe ser entero"}), 400
         where.append("sensor_id = %s")
-        params.append(int(sensor_id))
+    # Rango temporal: permite a Postgres descartar particiones (partition pruning)
+    for arg, op in (("from", ">="), ("to", "<")):
+        if request.args.get(arg):
+            try:
+                params.append(parse_ts(request.args[arg]))
+            except ValueError:
+                return jsonify({"ok": False, "error": f"{arg} debe ser fecha ISO 8601"}), 400
+            where.append(f"created_at {op} %s")
+    if cursor:
+        # Paginación por cursor (keyset): la página N cuesta lo mismo que la primera
+        try:
+            params.extend(_decode_cursor(cursor))
+        except (ValueError, TypeError):
+            return jsonify({"ok": False, "error": "cursor inválido"}), 400
+        where.append("(created_at, id) < (%s, %s)")
 
     where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+    # ORDER BY con la columna calificada: el alias created_at es el texto ISO
     sql = f"""
-        SELECT sensor_id, estacionamiento_id, estado, hora_libre, hora_ocupado, created_at
-        FROM registro_data
+        SELECT sensor_id, estacionamiento_id, estado, {iso_sql("hora_libre")}, {iso_sql("hora_ocupado")},
+               {iso_sql("created_at")} AS created_at, id
+        FROM registro_data r
         {where_sql}
-        ORDER BY created_at DESC
+        ORDER BY r.created_at DESC, r.id DESC
         LIMIT %s;
     """
-    params.append(limit)
+    params.append(limit + 1)
 
     try:
         rows = pg_fetchall(sql, params)
     except Exception as e:
         return jsonify({"ok": False, "error": f"pg query: {e}"}), 502
 
-    reg = [
-        {
-            "sensor_id": r[0],
-            "estacionamiento_id": r[1],
-            "estado": r[2],
-            "hora_libre": r[3].isoformat() if r[3] else None,
-            "hora_ocupado": r[4].isoformat() if r[4] else None,
-            "created_at": r[5].isoformat() if r[5] else None,
-        }
-        for r in rows
-    ]
-    return jsonify({"ok": True, "count": len(reg), "items": reg})
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1][5], rows[-1][6])
 
+    body = columnar(REGISTRO_FIELDS, rows) if fmt == "columnar" else {"items": row_dicts(REGISTRO_FIELDS, rows)}
+    return jsonify({"ok": True, "count": len(rows), **body, "next_cursor": next_cursor})
 
-@app.post("/admin/reset")
-def admin_reset():
+
+# Cupos de exportación: cada una retiene una conexión propia durante todo el stream
+_export_slots = threading.BoundedSemaphore(EXPORT_MAX_CONCURRENT)
+
+
+@app.get("/registro_data/export")
+def registro_data_export():
+    fmt = request.args.get("format", "csv").lower()
+    problem = export.available(fmt)
+    if problem:
+        return jsonify({"ok": False, "error": problem}), 400 if fmt not in export.FORMATS else 501
+    try:
+        sql, params = export.build_query(request.args)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    # Parquet ya va comprimido por columna
+    gzip = fmt != "parquet" and (
+        request.args.get("gzip") == "1" or "gzip" in request.headers.get("Accept-Encoding", "")
+    )
+
+    if not _export_slots.acquire(blocking=False):
+        resp = jsonify({"ok": False, "error": "demasiadas exportaciones en curso"})
+        resp.headers["Retry-After"] = "30"
+        return resp, 429
+    try:
+        conn = export.open_connection(PG_CONN, EXPORT_TIMEOUT_SEC, EXPORT_IDLE_SEC)
+    except Exception as e:
+        _export_slots.release()
+        return jsonify({"ok": False, "error": f"pg connect: {e}"}), 502
+
+    body = export.Export(conn, _export_slots, fmt, sql, params, gzip=gzip, fetch=EXPORT_FETCH)
+    resp = Response(body, content_type=export.FORMATS[fmt][0], headers=export.headers(fmt, gzip))
+    resp.vary.add("Accept-Encoding")
+    return resp
+
+
+def _admin_denied():
     if not ADMIN_TOKEN:
         return jsonify({"ok": False, "error": "ADMIN_TOKEN no configurado en el servidor"}), 501
 
     token = request.headers.get("X-Admin-Token") or request.args.get("token")
     if token != ADMIN_TOKEN:
         return jsonify({"ok": False, "error": "unauthorized"}), 401
+    return None
 
-    sql_path = ROOT / "api" / "db_init.sql"
-    try:
-        sql = sql_path.read_text()
-    except Exception as e:
-        return jsonify({"ok": False, "error": f"no se pudo leer db_init.sql: {e}"}), 500
 
+# ---- Reset de entorno (job en segundo plano) ----
+RESET_MODES = ("restore", "rebuild", "capture")
+_RESET_STATUS = SNAPSHOT_DIR / "reset_status.json"
+
+
+def _reset_status():
     try:
-        import psycopg
+        return json.loads(_RESET_STATUS.read_text())
+    except (OSError, ValueError):
+        return None
 
-        with psycopg.connect(PG_CONN, autocommit=True) as conn:
-            with conn.cursor() as cur:
-                cur.execute(sql)
+
+def _write_reset_status(status):
+    # Archivo compartido: cualquier worker responde /admin/reset/status
+    SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = _RESET_STATUS.with_suffix(".tmp")
+    tmp.write_text(json.dumps(status))
+    os.replace(tmp, _RESET_STATUS)
+
+
+def _rebuild(conn, progress):
+    # Reset completo: DDL + seeds (lento; el resultado se captura como baseline)
+    progress("pg: db_init.sql")
+    conn.execute(DB_INIT_SQL.read_text())
+    partitions.maintain(conn)
+    progress("seeds")
+    seeds_mod = import_module("seed_basics")
+    seeds_mod.seed_postgres()
+    seeds_mod.seed_mongo()
+
+
+def _reload_after_reset():
+    _load_sensor_registry(full=True)
+    _registry_misses.clear()
+    _load_occupancy()
+    response_cache.bump()
+
+
+def _run_reset(conn, mode, status):
+    def progress(step):
+        status["step"] = step
+        _write_reset_status(status)
+
+    started = time.monotonic()
+    try:
+        if mode == "restore":
+            try:
+                status["result"] = snapshot.restore(conn, mdb, SNAPSHOT_BASELINE, DB_INIT_SQL, progress)
+            except snapshot.SnapshotError as e:
+                # Sin snapshot válido (primera vez o esquema nuevo): reset completo y nuevo baseline
+                status["fallback"] = str(e)
+                mode = "rebuild"
+        if mode == "rebuild":
+            _rebuild(conn, progress)
+        if mode in ("rebuild", "capture"):
+            status["result"] = snapshot.capture(conn, mdb, SNAPSHOT_BASELINE, DB_INIT_SQL, progress)
+        status["state"] = "done"
+    except Exception as e:
+        status["state"], status["error"] = "error", str(e)
+    finally:
+        if mode in ("restore", "rebuild"):
+            # Registro de sensores y ocupación de este worker ya; los demás por NOTIFY
+            try:
+                _reload_after_reset()
+                if STREAM_NOTIFY:
+                    conn.execute("SELECT pg_notify(%s, %s);", (ingest.STREAM_CHANNEL, json.dumps({"reset": True})))
+            except Exception as e:
+                print(f"[WARN] recarga tras el reset: {e}")
+        response_cache.bump()
+        try:
+            conn.close()  # libera también el advisory lock
+        except Exception:
+            pass
+        status["finished_at"] = datetime.now(timezone.utc).isoformat()
+        status["duration_s"] = round(time.monotonic() - started, 1)
+        _write_reset_status(status)
+        print(f"[ADMIN] reset {status['id']} ({status['mode']}): {status['state']} en {status['duration_s']} s")
+
+
+def _start_reset(mode):
+    try:
+        conn = psycopg.connect(PG_CONN, autocommit=True)
     except Exception as e:
-        return jsonify({"ok": False, "error": f"pg reset: {e}"}), 500
+        return jsonify({"ok": False, "error": f"pg connect: {e}"}), 502
+    if not snapshot.try_lock(conn):
+        conn.close()
+        return jsonify({"ok": False, "error": "ya hay un reset en curso", "job": _reset_status()}), 409
+
+    status = {
+        "id": os.urandom(6).hex(),
+        "mode": mode,
+        "state": "running",
+        "step": "inicio",
+        "started_at": datetime.now(timezone.utc).isoformat(),
+    }
+    _write_reset_status(status)
+    thread = threading.Thread(target=_run_reset, args=(conn, mode, status), name="admin-reset", daemon=True)
+    thread.start()
+
+    # ?wait=N: espera hasta N s (acotado por el timeout de gunicorn) para scripts de CI
+    wait = request.args.get("wait", type=float)
+    if wait:
+        thread.join(min(wait, 100))
+    job = dict(status)
+    code = {"running": 202, "done": 200}.get(job["state"], 500)
+    resp = jsonify({"ok": job["state"] != "error", "job": job})
+    resp.status_code = code
+    resp.headers["Location"] = "/admin/reset/status"
+    return resp
+
+
+@app.post("/admin/reset")
+def admin_reset():
+    denied = _admin_denied()
+    if denied:
+        return denied
+
+    mode = request.args.get("mode", "restore")
+    if mode not in RESET_MODES:
+        return jsonify({"ok": False, "error": f"mode debe ser uno de: {', '.join(RESET_MODES)}"}), 400
+    return _start_reset(mode)
+
+
+@app.post("/admin/snapshot")
+def admin_snapshot():
+    # Captura el estado actual como baseline (p. ej. tras sembrar un histórico con seed_basics.py)
+    denied = _admin_denied()
+    if denied:
+        return denied
+    return _start_reset("capture")
+
+
+@app.get("/admin/reset/status")
+def admin_reset_status():
+    denied = _admin_denied()
+    if denied:
+        return denied
+
+    status = _reset_status()
+    if status and status.get("state") == "running":
+        # Nadie tiene el lock: el worker que corría el job murió (reinicio, OOM)
+        with pg_pool.connection() as conn:
+            if snapshot.try_lock(conn):
+                snapshot.unlock(conn)
+                status["state"] = "interrupted"
+    return jsonify({"ok": True, "job": status})
+
+
+@app.post("/admin/partitions")
+def admin_partitions():
+    # Mantenimiento de particiones (programable p. ej. con un cron diario)
+    denied = _admin_denied()
+    if denied:
+        return denied
 
     try:
-        seeds_mod = import_module("seed_basics")
-        seed_postgres_fn = getattr(seeds_mod, "seed_postgres", None)
-        seed_mongo_fn = getattr(seeds_mod, "seed_mongo", None)
+        with psycopg.connect(PG_CONN, autocommit=True) as conn:
+            result = partitions.maintain(conn)
     except Exception as e:
-        return jsonify({"ok": True, "seeded": False, "warning": f"no se pudieron importar seeds: {e}"}), 200
+        return jsonify({"ok": False, "error": f"pg partitions: {e}"}), 500
+
+    return jsonify({"ok": True, **result})
+
 
-    if not seed_postgres_fn or not seed_mongo_fn:
-        return jsonify({"ok": True, "seeded": False, "warning": "seed_postgres/seed_mongo no definidos"}), 200
+@app.post("/admin/rollups")
+def admin_rollups():
+    denied = _admin_denied()
+    if denied:
+        return denied
 
     try:
-        seed_postgres_fn()
-        seed_mongo_fn()
+        result = _refresh_rollups()
     except Exception as e:
-        return jsonify({"ok": False, "error": f"seed error: {e}"}), 500
+        return jsonify({"ok": False, "error": f"pg rollups: {e}"}), 500
 
-    return jsonify({"ok": True, "seeded": True})
+    return jsonify({"ok": True, **result})
 
 
 @app.get("/openapi.json")
@@ -416,4 +1540,4 @@ def swagger_ui():
 # ---- Entry ----
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", "8080"))
-    app.run(host="0.0.0.0", port=port)
+    create_app().run(host="0.0.0.0", port=port)
@@ -0,0 +1,225 @@
+"""
+Entrada ASGI (Starlette) con drivers async para las rutas calientes:
+/sensor_event escribe Mongo y Postgres en paralelo y /status_overview lee
+ambos en paralelo, con AsyncConnectionPool y AsyncMongoClient. /stream (SSE)
+espera en el event loop sin retener hilos: admite miles de clientes por
+worker. El resto de las rutas se sirven montando la app Flask (app.py) vía
+WSGI, compartiendo con ella el estado en memoria (ocupación, registro de
+sensores, caché).
+
+Uso: gunicorn -c gunicorn.conf.py -k uvicorn_worker.UvicornWorker asgi:app
+     (o API_SERVER=asgi ./startup.sh; en local: uvicorn asgi:app --port 8080)
+Config:
+  ASYNC_PG_POOL_MAX=20     # conexiones async por worker
+  ASGI_WSGI_THREADS=32     # hilos para las rutas Flask montadas
+  STREAM_MAX_ASYNC_SUBSCRIBERS=5000   # clientes /stream por worker; 0 = sin tope
+"""
+import asyncio
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+
+import certifi
+from a2wsgi import WSGIMiddleware
+from psycopg_pool import AsyncConnectionPool
+from pymongo import AsyncMongoClient, DESCENDING
+from pymongo.errors import PyMongoError
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.http import parse_etags
+
+import app as flask_module
+import events_raw
+import ingest
+import metrics
+from models import SensorEvent
+
+ASYNC_PG_POOL_MAX = int(os.environ.get("ASYNC_PG_POOL_MAX", "20"))
+ASGI_WSGI_THREADS = int(os.environ.get("ASGI_WSGI_THREADS", "32"))
+STREAM_MAX_ASYNC_SUBSCRIBERS = int(os.environ.get("STREAM_MAX_ASYNC_SUBSCRIBERS", "5000"))
+
+flask_app = flask_module.app
+_db = {}
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    flask_module.start_worker()  # ya iniciado por post_fork bajo gunicorn; necesario con uvicorn solo
+    pool = AsyncConnectionPool(
+        flask_module.PG_CONN, min_size=1, max_size=ASYNC_PG_POOL_MAX, kwargs={"autocommit": True}, open=False
+    )
+    await pool.open()
+    mongo = AsyncMongoClient(
+        flask_module.MONGODB_URI, tlsCAFile=certifi.where(), connectTimeoutMS=20000, serverSelectionTimeoutMS=20000,
+        event_listeners=metrics.mongo_listeners(),
+    )
+    _db["pg"] = pool
+    _db["events_raw"] = mongo["smartpark"][flask_module.EVENTS_RAW_COLLECTION]
+    try:
+        yield
+    finally:
+        await pool.close()
+        await mongo.close()
+
+
+# ---- Utilidades ----
+def _json(payload, status: int = 200, request: Request = None, headers=None) -> Response:
+    # Mismo serializador que jsonify (fechas incluidas) para respuestas idénticas a Flask
+    body = (flask_app.json.dumps(payload) + "\n").encode()
+    resp = Response(body, status_code=status, media_type="application/json", headers=headers)
+    if request is not None:
+        resp.headers.update(flask_module.cors_headers(request.headers))
+    return resp
+
+
+def _route(path: str, handler, method: str) -> Route:
+    # Preflight CORS y métricas con las mismas etiquetas que las rutas Flask
+    async def endpoint(request: Request):
+        start = time.perf_counter()
+        if request.method == "OPTIONS":
+            resp = Response("", headers=flask_module.cors_headers(request.headers))
+        else:
+            try:
+                resp = await handler(request)
+            except Exception:
+                metrics.observe(request.method, path, 500, time.perf_counter() - start)
+                raise
+        metrics.observe(request.method, path, resp.status_code, time.perf_counter() - start)
+        return resp
+
+    return Route(path, endpoint, methods=[method, "OPTIONS"])
+
+
+# ---- Rutas async ----
+async def sensor_event(request: Request) -> Response:
+    try:
+        data = SensorEvent(**json.loads(await request.body()))
+    except Exception as e:
+        return _json({"ok": False, "error": f"payload inválido: {e}"}, 400, request)
+
+    if flask_module.sensor_registry.known(data.sensor_id) or not flask_module.sensor_registry.warmed:
+        rejected = flask_module._check_sensor(data.sensor_id, data.estacionamiento_id)
+    else:
+        # Sensor no cargado: la consulta puntual a Postgres es síncrona
+        rejected = await asyncio.to_thread(flask_module._check_sensor, data.sensor_id, data.estacionamiento_id)
+    if rejected:
+        return _json({"ok": False, "error": rejected}, 422, request)
+
+    doc = ingest.build_doc(data, sensor_meta=flask_module.sensor_registry.meta(data.sensor_id))
+    ts = doc["ts"]
+
+    buffer = flask_module.ingest_buffer
+    if buffer:
+        if not buffer.accepting:
+            return _json({"ok": False, "error": "ingesta no disponible (worker en apagado)"}, 503, request,
+                         {"Retry-After": "5"})
+        if not buffer.offer(doc):
+            return _json({"ok": False, "error": "cola de ingesta llena"}, 429, request, {"Retry-After": "1"})
+        return _json({"ok": True, "queued": True, "ts": ts.isoformat(), "estado": data.estado}, 202, request)
+
+    if flask_module.INGEST_MODE == "raw":
+        # Sólo el crudo: Postgres lo aplica projector.py
+        try:
+            await _db["events_raw"].insert_one(events_raw.to_layout(doc, flask_module.EVENTS_RAW_LAYOUT))
+        except Exception as e:
+            return _json({"ok": False, "error": f"mongo insert: {e}"}, 502, request)
+        flask_module.occupancy.apply(data.sensor_id, data.estacionamiento_id, data.estado, ts)
+        flask_module._mark_ingested([doc])
+        return _json({"ok": True, "queued": True, "ts": ts.isoformat(), "estado": data.estado}, 202, request)
+
+    # Crudo y normalizado en paralelo: la latencia es la del más lento, no la suma.
+    # Si falla sólo uno se responde 502 igual que en Flask; el reintento del
+    # cliente no duplica estado (upsert) y con REGISTRO_MODE=transitions
+    # tampoco registro_data. El _id ya viene de build_doc: insert_one no toca doc.
+    async def write_pg():
+        async with _db["pg"].connection() as conn:
+            return await ingest.apg_write_event(
+                conn, doc, notify=flask_module.STREAM_NOTIFY, dedup=flask_module.REGISTRO_DEDUP
+            )
+
+    mongo_res, pg_res = await asyncio.gather(_db["events_raw"].insert_one(events_raw.to_layout(doc, flask_module.EVENTS_RAW_LAYOUT)), write_pg(), return_exceptions=True)
+    if isinstance(mongo_res, BaseException):
+        return _json({"ok": False, "error": f"mongo insert: {mongo_res}"}, 502, request)
+    if isinstance(pg_res, BaseException):
+        return _json({"ok": False, "error": f"pg insert: {pg_res}"}, 502, request)
+
+    flask_module.occupancy.apply(data.sensor_id, data.estacionamiento_id, data.estado, ts)
+    flask_module._mark_ingested([doc])
+    return _json({"ok": True, "ts": ts.isoformat(), "estado": data.estado, "transicion": pg_res}, 201, request)
+
+
+async def status_overview(request: Request) -> Response:
+    fmt = request.query_params.get("format", "rows")
+    if fmt not in ("rows", "columnar"):
+        return _json({"ok": False, "error": "format debe ser rows o columnar"}, 400, request)
+    cache = flask_module.response_cache
+    # Misma clave que @response_cache.cached en Flask
+    key = ("/status_overview", None, tuple(sorted(request.query_params.multi_items())))
+    entry = cache.get(key, None) if cache.ttl > 0 else None
+    if entry is not None:
+        cache.count("hits")
+        body, etag = entry[2], entry[3]
+    else:
+        cache.count("misses")
+        token = cache.token(None)
+
+        async def last_events():
+            try:
+                cursor = _db["events_raw"].find({}, {"_id": 0}).sort("ts", DESCENDING).limit(5)
+                return [events_raw.flatten(d) for d in await cursor.to_list()]
+            except PyMongoError as e:
+                print(f"[WARN] mongo read: {e}")
+                return []
+
+        async def last_registros():
+            try:
+                async with _db["pg"].connection() as conn:
+                    cur = await conn.execute(flask_module.STATUS_OVERVIEW_SQL)
+                    return flask_module.status_rows(await cur.fetchall(), fmt)
+            except Exception as e:
+                print(f"[WARN] pg read: {e}")
+                return flask_module.status_rows([], fmt)
+
+        events, reg = await asyncio.gather(last_events(), last_registros())
+        body = (flask_app.json.dumps({"last_events": events, "registro_data": reg}) + "\n").encode()
+        etag = cache.etag_of(body)
+        if cache.ttl > 0:
+            cache.put(key, token, body, etag, "application/json")
+
+    headers = {**flask_module.cors_headers(request.headers), **cache.validators(etag)}
+    if etag in parse_etags(request.headers.get("If-None-Match")):
+        cache.count("not_modified")
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+async def stream_changes(request: Request) -> Response:
+    # Misma semántica que /stream en Flask (filtros, Last-Event-ID, resync, heartbeat)
+    if not flask_module.STREAM_NOTIFY:
+        return _json({"ok": False, "error": "stream deshabilitado (STREAM_NOTIFY=0)"}, 503, request)
+    hub = flask_module.change_hub
+    if STREAM_MAX_ASYNC_SUBSCRIBERS and hub.subscribers >= STREAM_MAX_ASYNC_SUBSCRIBERS:
+        return _json({"ok": False, "error": "demasiados suscriptores en este worker"}, 503, request,
+                     {"Retry-After": "30"})
+    params = request.query_params
+    last_id = request.headers.get("Last-Event-ID") or params.get("last_event_id")
+    match = flask_module.stream_match(params.get("campus"), params.get("estacionamiento_id"))
+    headers = {**flask_module.cors_headers(request.headers), "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(
+        hub.asubscribe(last_id, match, heartbeat=flask_module.STREAM_HEARTBEAT_SEC),
+        media_type="text/event-stream", headers=headers,
+    )
+
+
+app = Starlette(
+    routes=[
+        _route("/sensor_event", sensor_event, "POST"),
+        _route("/status_overview", status_overview, "GET"),
+        _route("/stream", stream_changes, "GET"),
+        Mount("/", app=WSGIMiddleware(flask_app, workers=ASGI_WSGI_THREADS)),
+    ],
+    lifespan=lifespan,
+)
@@ -2,7 +2,17 @@
 CREATE EXTENSION IF NOT EXISTS postgis;
 
 -- Limpieza de tablas de la demo anterior (precaución: elimina datos).
-DROP TABLE IF EXISTS sensor_threshold, gateway, registro_data, reserva, usuario, rol, sensor, estacionamiento, campus, events, occupancy, lot CASCADE;
+DROP TABLE IF EXISTS parking_session, projector_checkpoint, occupancy_rollup, occupancy_rollup_state, sensor_state, sensor_threshold, gateway, registro_data, reserva, usuario, rol, sensor, estacionamiento, campus, events, occupancy, lot CASCADE;
+
+-- Particiones de registro_data separadas (detach) por retención en resets previos.
+DO $$
+DECLARE t TEXT;
+BEGIN
+  FOR t IN SELECT tablename FROM pg_tables WHERE schemaname = current_schema() AND tablename ~ '^registro_data_p[0-9]+$'
+  LOOP
+    EXECUTE format('DROP TABLE IF EXISTS %I CASCADE', t);
+  END LOOP;
+END $$;
 
 -- Campus universitarios donde existen estacionamientos.
 CREATE TABLE campus (
@@ -11,6 +21,7 @@ CREATE TABLE campus (
   nombre TEXT NOT NULL,
   direccion TEXT NOT NULL,
   coordenadas TEXT,
+  geo GEOGRAPHY(Point, 4326),
   cantidad_estacionamientos INTEGER NOT NULL CHECK (cantidad_estacionamientos >= 0),
   created_by TEXT,
   created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
@@ -26,12 +37,16 @@ CREATE TABLE estacionamiento (
   numero INTEGER NOT NULL,
   piso INTEGER NOT NULL,
   accesibilidad TEXT NOT NULL,
+  geo GEOGRAPHY(Point, 4326),
   created_by TEXT,
   created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
   modified_by TEXT,
   modified_at TIMESTAMPTZ
 );
 CREATE INDEX idx_estacionamiento_campus ON estacionamiento(campus_id);
+-- Índices GiST: ST_DWithin y orden k-NN (<->) de /nearby_free sin recorrer la tabla.
+CREATE INDEX idx_campus_geo ON campus USING GIST (geo);
+CREATE INDEX idx_estacionamiento_geo ON estacionamiento USING GIST (geo);
 
 -- Catálogo de roles y usuarios del sistema.
 CREATE TABLE rol (
@@ -110,22 +125,114 @@ CREATE INDEX idx_reserva_usuario ON reserva(usuario_id);
 CREATE INDEX idx_reserva_estacionamiento ON reserva(estacionamiento_id);
 
 -- Registro histórico de ocupación detectada por sensores.
+-- Particionado por rango de created_at: las particiones (mensuales o diarias)
+-- las crea/retira api/partitions.py; lo que no tenga partición cae en default.
 CREATE TABLE registro_data (
-  id INTEGER GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+  id INTEGER GENERATED ALWAYS AS IDENTITY,
   sensor_id INTEGER NOT NULL REFERENCES sensor(id) ON DELETE CASCADE,
   estacionamiento_id TEXT NOT NULL REFERENCES estacionamiento(id) ON DELETE CASCADE,
   hora_libre TIMESTAMPTZ,
-  tiempo_libre TIME,
+  tiempo_libre INTERVAL,         -- duración del tramo libre que abre esta fila (al cerrarse la sesión)
   hora_ocupado TIMESTAMPTZ,
-  tiempo_ocupado TIME,
+  tiempo_ocupado INTERVAL,
   estado TEXT NOT NULL,
   created_by TEXT,
   created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
   modified_by TEXT,
-  modified_at TIMESTAMPTZ
+  modified_at TIMESTAMPTZ,
+  PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+CREATE TABLE registro_data_default PARTITION OF registro_data DEFAULT;
+-- Índices compuestos para paginación por cursor (created_at, id) con filtros;
+-- INCLUDE permite index-only scans de las columnas que expone /registro_data.
+CREATE INDEX idx_registro_data_created ON registro_data(created_at DESC, id DESC);
+CREATE INDEX idx_registro_data_est_created ON registro_data(estacionamiento_id, created_at DESC, id DESC)
+  INCLUDE (sensor_id, estado, hora_libre, hora_ocupado);
+CREATE INDEX idx_registro_data_sensor_created ON registro_data(sensor_id, created_at DESC, id DESC)
+  INCLUDE (estacionamiento_id, estado, hora_libre, hora_ocupado);
+
+-- Estado actual por sensor (una fila por sensor, upsert en cada evento).
+-- Las lecturas de "estado actual" no dependen del tamaño del histórico.
+CREATE TABLE sensor_state (
+  sensor_id INTEGER PRIMARY KEY REFERENCES sensor(id) ON DELETE CASCADE,
+  estacionamiento_id TEXT NOT NULL REFERENCES estacionamiento(id) ON DELETE CASCADE,
+  estado TEXT NOT NULL,
+  last_change_at TIMESTAMPTZ NOT NULL,
+  last_seen_at TIMESTAMPTZ NOT NULL,
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX idx_sensor_state_est ON sensor_state(estacionamiento_id);
+CREATE INDEX idx_sensor_state_last_seen ON sensor_state(last_seen_at DESC);
+-- Sensores libres por estacionamiento (/nearby_free): índice parcial, sólo filas libres.
+CREATE INDEX idx_sensor_state_est_libre ON sensor_state(estacionamiento_id) WHERE estado = 'libre';
+
+-- Sesiones por sensor: tramos [started_at, ended_at) de estado constante. La
+-- sesión abierta (ended_at NULL) es el estado vigente; la siguiente transición
+-- la cierra en la misma transacción de la ingesta (ingest.SESSION_SQL) y
+-- completa tiempo_libre/tiempo_ocupado de la fila de registro_data que la abrió.
+-- El histórico previo se reconstruye con api/sessions.py.
+CREATE TABLE parking_session (
+  id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+  sensor_id INTEGER NOT NULL REFERENCES sensor(id) ON DELETE CASCADE,
+  estacionamiento_id TEXT NOT NULL REFERENCES estacionamiento(id) ON DELETE CASCADE,
+  estado TEXT NOT NULL,
+  started_at TIMESTAMPTZ NOT NULL,
+  ended_at TIMESTAMPTZ,
+  duracion_s DOUBLE PRECISION GENERATED ALWAYS AS (EXTRACT(EPOCH FROM ended_at - started_at)) STORED,
+  UNIQUE (sensor_id, started_at)
+);
+CREATE INDEX idx_parking_session_open ON parking_session(sensor_id) WHERE ended_at IS NULL;
+-- Permanencia y rotación por estacionamiento (/dwell_stats): index-only scan por rango de cierre.
+CREATE INDEX idx_parking_session_est_ended ON parking_session(estacionamiento_id, ended_at)
+  INCLUDE (estado, duracion_s) WHERE ended_at IS NOT NULL;
+
+-- Ids de los avisos de cambio de estado (/stream, Last-Event-ID).
+DROP SEQUENCE IF EXISTS stream_event_seq;
+CREATE SEQUENCE stream_event_seq;
+
+-- Avance del proyector events_raw -> registro_data/sensor_state (api/projector.py, INGEST_MODE=raw).
+-- Se actualiza en la misma transacción que cada lote: un lote se aplica una sola vez.
+CREATE TABLE projector_checkpoint (
+  name TEXT PRIMARY KEY,
+  last_ts TIMESTAMPTZ,          -- hora de inserción del último evento aplicado (atraso en /ingest/stats)
+  last_id TEXT,                 -- fuente cursor: último _id (orden de inserción) aplicado
+  resume_token JSONB,           -- fuente changestream
+  scan_before TEXT,             -- rebuild con changestream: ObjectId de corte entre recorrido y stream
+  events BIGINT NOT NULL DEFAULT 0,
+  failed BIGINT NOT NULL DEFAULT 0,
+  behind BIGINT NOT NULL DEFAULT 0,   -- insertados detrás del checkpoint: no proyectados hasta un --rebuild
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- Rollups de ocupación por hora/día (api/rollups.py), por campus y estacionamiento.
+-- Ocupación ponderada en el tiempo = segundos_ocupados / segundos_observados.
+CREATE TABLE occupancy_rollup (
+  scope TEXT NOT NULL CHECK (scope IN ('campus', 'estacionamiento')),
+  scope_id TEXT NOT NULL,
+  bucket TEXT NOT NULL CHECK (bucket IN ('1h', '1d')),
+  bucket_start TIMESTAMPTZ NOT NULL,
+  sensores INTEGER NOT NULL,
+  segundos_observados DOUBLE PRECISION NOT NULL,
+  segundos_ocupados DOUBLE PRECISION NOT NULL,
+  eventos INTEGER NOT NULL,
+  cambios_estado INTEGER NOT NULL,
+  pico_ocupados INTEGER NOT NULL,
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (scope, bucket, scope_id, bucket_start)
+);
+
+-- Marca de agua del refresco incremental (una sola fila).
+CREATE TABLE occupancy_rollup_state (
+  id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+  last_registro_id INTEGER NOT NULL DEFAULT 0,  -- ids firmes (sin transacciones en curso) ya agregados
+  rolled_until TIMESTAMPTZ,
+  seen_id BIGINT,       -- último id de la secuencia en la pasada anterior
+  wait_id BIGINT,       -- candidato a last_registro_id ...
+  wait_xmax XID8,       -- ... cuando el xmin de una pasada supere este xmax
+  snapshot PG_SNAPSHOT,  -- snapshot de la pasada anterior (lo visible ahí ya está agregado)
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
 );
-CREATE INDEX idx_registro_data_sensor ON registro_data(sensor_id);
-CREATE INDEX idx_registro_data_est ON registro_data(estacionamiento_id);
+INSERT INTO occupancy_rollup_state (id) VALUES (TRUE);
 
 -- Umbrales configurables por sensor.
 CREATE TABLE sensor_threshold (
@@ -0,0 +1,164 @@
+"""
+Colección cruda de eventos en Mongo (events_raw) en uno de dos formatos:
+- plain: un documento por lectura con sensor_id/estacionamiento_id arriba e
+  índices sid_ts y ts_desc (formato original).
+- timeseries: colección time-series nativa (timeField "ts", metaField
+  "meta" con sensor_id/estacionamiento_id), comprimida por sensor y con
+  expiración opcional (expireAfterSeconds).
+Las lecturas pasan por `flatten`, así que las respuestas son las mismas con
+cualquiera de los dos formatos.
+
+Migración (copia por lotes una colección existente a una time-series):
+  export $(grep -v '^#' tools/.env | xargs)
+  python api/events_raw.py --source events_raw --target events_raw_ts --ttl 7776000
+La API se apunta antes a la nueva colección (EVENTS_RAW_COLLECTION=events_raw_ts,
+EVENTS_RAW_LAYOUT=timeseries) para que lo nuevo ya llegue ahí; la copia es
+reanudable (checkpoint por _id en la colección `migrations`).
+"""
+import argparse
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+import certifi
+from pymongo import ASCENDING, DESCENDING, MongoClient
+from pymongo.collection import Collection
+from pymongo.database import Database
+from pymongo.errors import BulkWriteError, CollectionInvalid
+
+LAYOUTS = ("plain", "timeseries")
+META_FIELDS = ("sensor_id", "estacionamiento_id")
+
+
+def timeseries_options(ttl_seconds: int = 0) -> Dict[str, Any]:
+    opts: Dict[str, Any] = {"timeseries": {"timeField": "ts", "metaField": "meta", "granularity": "seconds"}}
+    if ttl_seconds > 0:
+        opts["expireAfterSeconds"] = ttl_seconds
+    return opts
+
+
+def collection_info(db: Database, name: str) -> Optional[Dict[str, Any]]:
+    """Entrada de listCollections (type, options) o None si todavía no existe."""
+    for info in db.list_collections(filter={"name": name}):
+        return info
+    return None
+
+
+def ensure_collection(db: Database, name: str, layout: str = "plain", ttl_seconds: int = 0) -> Collection:
+    """Crea la colección e índices si faltan (idempotente) y ajusta la expiración."""
+    col = db[name]
+    if layout == "timeseries":
+        info = collection_info(db, name)
+        if info is None:
+            try:
+                db.create_collection(name, **timeseries_options(ttl_seconds))
+            except CollectionInvalid:
+                pass  # otro worker la creó primero
+            info = collection_info(db, name) or {}
+        if info.get("type") == "timeseries":
+            # expireAfterSeconds se cambia en caliente (collMod sólo si difiere)
+            current = info.get("options", {}).get("expireAfterSeconds")
+            wanted = ttl_seconds if ttl_seconds > 0 else None
+            if current != wanted:
+                db.command("collMod", name, expireAfterSeconds=wanted if wanted else "off")
+            col.create_index([("meta.sensor_id", ASCENDING), ("ts", DESCENDING)], name="meta_sid_ts")
+            # Las time-series no indexan _id: el proyector (projector.py) lo recorre en orden de inserción
+            col.create_index([("_id", ASCENDING)], name="id_asc")
+        else:
+            print(f"[WARN] {name} existe como colección normal: migrar con api/events_raw.py")
+        return col
+    col.create_index([("sensor_id", ASCENDING), ("ts", DESCENDING)], name="sid_ts")
+    col.create_index([("ts", DESCENDING)], name="ts_desc")
+    return col
+
+
+def to_layout(doc: Dict[str, Any], layout: str) -> Dict[str, Any]:
+    """Documento a insertar. En plain es el mismo dict; en timeseries una copia con `meta` (y el mismo _id)."""
+    if layout != "timeseries":
+        return doc
+    out = {"meta": {f: doc[f] for f in META_FIELDS}}
+    out.update((k, v) for k, v in doc.items() if k not in META_FIELDS)
+    return out
+
+
+def flatten(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Vuelve a la forma plana (sensor_id/estacionamiento_id arriba) para las respuestas."""
+    meta = doc.pop("meta", None)
+    if meta:
+        doc.update(meta)
+    return doc
+
+
+# ---- Migración ----
+def migrate(db: Database, source: str, target: str, ttl_seconds: int = 0, batch: int = 5000) -> Dict[str, int]:
+    """
+    Copia `source` a la colección time-series `target` en orden de _id,
+    guardando el último _id copiado tras cada lote. Las time-series no
+    tienen _id único: si se corta entre un lote y su checkpoint, ese lote
+    puede quedar duplicado al reanudar. Con TTL se omite lo ya vencido.
+    """
+    ensure_collection(db, target, "timeseries", ttl_seconds)
+    src, dst, checkpoints = db[source], db[target], db["migrations"]
+    key = f"{source}->{target}"
+    state = checkpoints.find_one({"_id": key}) or {}
+    query: Dict[str, Any] = {}
+    if state.get("last_id") is not None:
+        query["_id"] = {"$gt": state["last_id"]}
+    if ttl_seconds > 0:
+        query["ts"] = {"$gte": datetime.now(timezone.utc) - timedelta(seconds=ttl_seconds)}
+
+    stats = {"copied": state.get("copied", 0), "skipped": state.get("skipped", 0), "failed": state.get("failed", 0)}
+    started = time.monotonic()
+    pending = []
+
+    def flush():
+        docs = []
+        for doc in pending:
+            doc = flatten(doc)
+            if not isinstance(doc.get("ts"), datetime) or any(f not in doc for f in META_FIELDS):
+                stats["skipped"] += 1  # time-series exige ts fecha; sin sensor no hay serie
+                continue
+            docs.append(to_layout(doc, "timeseries"))
+        failed = 0
+        if docs:
+            try:
+                dst.insert_many(docs, ordered=False)
+            except BulkWriteError as e:
+                failed = len(e.details.get("writeErrors", []))
+        stats["copied"] += len(docs) - failed
+        stats["failed"] += failed
+        checkpoints.update_one({"_id": key}, {"$set": {"last_id": pending[-1]["_id"], **stats}}, upsert=True)
+        rate = (stats["copied"] + stats["skipped"]) / max(time.monotonic() - started, 1e-6)
+        print(f"[MIGRATE] {key}: copiados={stats['copied']} omitidos={stats['skipped']} "
+              f"fallidos={stats['failed']} ({rate:.0f} docs/s)")
+        pending.clear()
+
+    for doc in src.find(query).sort("_id", ASCENDING).batch_size(batch):
+        pending.append(doc)
+        if len(pending) >= batch:
+            flush()
+    if pending:
+        flush()
+    checkpoints.update_one({"_id": key}, {"$set": {"done_at": datetime.now(timezone.utc)}}, upsert=True)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copia events_raw a una colección time-series")
+    parser.add_argument("--source", default="events_raw")
+    parser.add_argument("--target", default=os.environ.get("EVENTS_RAW_COLLECTION", "events_raw_ts"))
+    parser.add_argument("--ttl", type=int, default=int(os.environ.get("EVENTS_RAW_TTL_SEC", "0")),
+                        help="expireAfterSeconds de la colección destino (0 = sin expiración)")
+    parser.add_argument("--batch", type=int, default=5000)
+    args = parser.parse_args()
+    if args.source == args.target:
+        parser.error("--source y --target deben ser colecciones distintas")
+
+    mongo = MongoClient(os.environ["MONGODB_URI"], tlsCAFile=certifi.where())
+    stats = migrate(mongo["smartpark"], args.source, args.target, ttl_seconds=args.ttl, batch=args.batch)
+    print(f"Copiados: {stats['copied']}  omitidos: {stats['skipped']}  fallidos: {stats['failed']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""
+Exportación masiva de registro_data para /registro_data/export.
+Cada exportación usa una conexión propia (no del pool) y la recorre en
+streaming: CSV con COPY ... TO STDOUT, NDJSON y Parquet/Arrow con un
+cursor con nombre (server-side) de EXPORT_FETCH filas por viaje. La
+memoria del worker queda acotada por un bloque, no por el resultado.
+Parquet/Arrow requieren pyarrow (opcional).
+"""
+import json
+import threading
+import zlib
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import psycopg
+
+from models import parse_ts
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - dependencia opcional
+    pa = None
+    pq = None
+
+FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+COLUMNS = ("id", "sensor_id", "estacionamiento_id", "estado", "hora_libre", "hora_ocupado", "created_at")
+CHUNK_BYTES = 64 * 1024
+
+
+def build_query(args) -> Tuple[str, List[Any]]:
+    """SELECT filtrado por rango y campus/estacionamiento/sensor. ValueError si un filtro es inválido."""
+    where = []
+    params: List[Any] = []
+    for arg, op in (("from", ">="), ("to", "<")):
+        if args.get(arg):
+            try:
+                params.append(parse_ts(args[arg]))
+            except ValueError:
+                raise ValueError(f"{arg} debe ser fecha ISO 8601")
+            where.append(f"r.created_at {op} %s")
+    if args.get("campus"):
+        where.append("r.estacionamiento_id IN (SELECT e.id FROM estacionamiento e "
+                     "JOIN campus c ON c.id = e.campus_id WHERE c.codigo = %s)")
+        params.append(args["campus"])
+    if args.get("estacionamiento_id"):
+        where.append("r.estacionamiento_id = %s")
+        params.append(args["estacionamiento_id"])
+    if args.get("sensor_id"):
+        try:
+            params.append(int(args["sensor_id"]))
+        except ValueError:
+            raise ValueError("sensor_id debe ser entero")
+        where.append("r.sensor_id = %s")
+
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+    sql = f"""
+        SELECT {', '.join('r.' + c for c in COLUMNS)}
+        FROM registro_data r
+        {where_sql}
+        ORDER BY r.created_at, r.id
+    """
+    return sql, params
+
+
+class Export:
+    """
+    Iterable de respuesta (bytes). La conexión y el cupo del semáforo se
+    liberan en close(), que Werkzeug llama al terminar o si el cliente corta.
+    """
+
+    def __init__(self, conn: psycopg.Connection, slot: threading.Semaphore, fmt: str, sql: str,
+                 params: List[Any], gzip: bool = False, fetch: int = 5000):
+        self.conn = conn
+        self.slot = slot
+        self.rows = 0
+        self._gen = self._compress(self._body(fmt, sql, params, fetch)) if gzip else self._body(fmt, sql, params, fetch)
+        self._closed = False
+
+    def __iter__(self) -> Iterator[bytes]:
+        try:
+            yield from self._gen
+        except Exception as e:
+            # Los headers ya salieron: se corta el stream (el cliente ve el cuerpo incompleto)
+            print(f"[WARN] exportación interrumpida tras {self.rows} filas: {e}")
+        finally:
+            self.close()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._gen.close()
+        try:
+            self.conn.close()
+        finally:
+            self.slot.release()
+
+    # ---- Formatos ----
+    def _body(self, fmt: str, sql: str, params: List[Any], fetch: int) -> Iterator[bytes]:
+        if fmt == "csv":
+            yield from self._csv(sql, params)
+        elif fmt == "ndjson":
+            yield from self._ndjson(sql, params, fetch)
+        else:
+            yield from self._arrow(sql, params, fetch, parquet=fmt == "parquet")
+
+    def _csv(self, sql: str, params: List[Any]) -> Iterator[bytes]:
+        # COPY entrega una fila por bloque: se juntan en trozos de CHUNK_BYTES
+        buf = bytearray()
+        with self.conn.cursor() as cur:
+            with cur.copy(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER)", params) as copy:
+                for data in copy:
+                    buf += data
+                    if len(buf) >= CHUNK_BYTES:
+                        yield bytes(buf)
+                        buf.clear()
+                    self.rows += 1
+        if buf:
+            yield bytes(buf)
+        self.rows = max(self.rows - 1, 0)  # sin el header
+
+    def _batches(self, sql: str, params: List[Any], fetch: int) -> Iterator[List[tuple]]:
+        # Cursor con nombre: Postgres mantiene el resultado y entrega `fetch` filas por viaje
+        with self.conn.transaction():
+            with self.conn.cursor(name="registro_export") as cur:
+                cur.itersize = fetch
+                cur.execute(sql, params)
+                while True:
+                    rows = cur.fetchmany(fetch)
+                    if not rows:
+                        break
+                    self.rows += len(rows)
+                    yield rows
+
+    def _ndjson(self, sql: str, params: List[Any], fetch: int) -> Iterator[bytes]:
+        for rows in self._batches(sql, params, fetch):
+            lines = []
+            for r in rows:
+                item = {
+                    "id": r[0],
+                    "sensor_id": r[1],
+                    "estacionamiento_id": r[2],
+                    "estado": r[3],
+                    "hora_libre": r[4].isoformat() if r[4] else None,
+                    "hora_ocupado": r[5].isoformat() if r[5] else None,
+                    "created_at": r[6].isoformat(),
+                }
+                lines.append(json.dumps(item, ensure_ascii=False))
+            lines.append("")
+            yield "\n".join(lines).encode()
+
+    def _arrow(self, sql: str, params: List[Any], fetch: int, parquet: bool) -> Iterator[bytes]:
+        schema = pa.schema([
+            ("id", pa.int32()),
+            ("sensor_id", pa.int32()),
+            ("estacionamiento_id", pa.string()),
+            ("estado", pa.string()),
+            ("hora_libre", pa.timestamp("us", tz="UTC")),
+            ("hora_ocupado", pa.timestamp("us", tz="UTC")),
+            ("created_at", pa.timestamp("us", tz="UTC")),
+        ])
+        sink = _Sink()
+        if parquet:
+            writer = pq.ParquetWriter(sink, schema, compression="zstd")
+        else:
+            writer = pa.ipc.new_stream(sink, schema)
+        for rows in self._batches(sql, params, fetch):
+            # Un row group / record batch por bloque del cursor
+            columns = list(zip(*rows))
+            writer.write_batch(pa.record_batch([pa.array(col, type=f.type) for col, f in zip(columns, schema)],
+                                               schema=schema))
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+        writer.close()
+        yield sink.drain()
+
+    @staticmethod
+    def _compress(body: Iterator[bytes]) -> Iterator[bytes]:
+        gz = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: formato gzip
+        for chunk in body:
+            out = gz.compress(chunk)
+            if out:
+                yield out
+        yield gz.flush()
+
+
+class _Sink:
+    """Archivo de sólo escritura para pyarrow; el contenido se vacía en cada bloque."""
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._pos = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self._buf += data
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self) -> bool:
+        return True
+
+    def drain(self) -> bytes:
+        data = bytes(self._buf)
+        self._buf.clear()
+        return data
+
+
+def open_connection(conninfo: str, timeout_sec: int, idle_sec: int) -> psycopg.Connection:
+    # statement_timeout acota el COPY; idle_in_transaction corta el cursor con
+    # nombre si el cliente deja de leer y el generador queda detenido.
+    return psycopg.connect(
+        conninfo,
+        options=f"-c statement_timeout={timeout_sec * 1000} "
+                f"-c idle_in_transaction_session_timeout={idle_sec * 1000} -c TimeZone=UTC",
+    )
+
+
+def headers(fmt: str, gzip: bool) -> Dict[str, str]:
+    _, ext = FORMATS[fmt]
+    out = {"Content-Disposition": f'attachment; filename="registro_data.{ext}"', "X-Accel-Buffering": "no"}
+    if gzip:
+        out["Content-Encoding"] = "gzip"
+    return out
+
+
+def available(fmt: str) -> Optional[str]:
+    """Motivo por el que el formato no se puede servir, o None."""
+    if fmt not in FORMATS:
+        return f"format debe ser uno de: {', '.join(FORMATS)}"
+    if fmt in ("parquet", "arrow") and pa is None:
+        return f"{fmt} requiere pyarrow instalado en el servidor"
+    return None
@@ -0,0 +1,33 @@
+"""
+Configuración de gunicorn (startup.sh la carga con -c).
+Prepara el directorio de métricas multiproceso de prometheus_client: se
+define antes de que los workers importen la app, se vacía al arrancar el
+master y cada worker que termina se marca como muerto para que sus gauges
+"livesum" dejen de sumarse.
+post_fork abre pools e hilos de fondo en cada worker (app.start_worker):
+importar app.py no conecta, así que con --preload el master no comparte
+sockets ni hilos con los hijos.
+"""
+import os
+import shutil
+
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/smartpark_metrics")
+
+
+def on_starting(server):
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_fork(server, worker):
+    # Sin --preload importa la app aquí mismo (el worker la reutiliza desde sys.modules)
+    import app
+
+    app.start_worker()
@@ -0,0 +1,106 @@
+"""
+Monitor de salud de las dependencias para /healthzdb.
+Un hilo por worker sondea todos los backends en paralelo cada `interval`
+segundos, cada sondeo acotado por `timeout`, y guarda el último resultado
+(ok, latencia, hora, error). La ruta responde desde esa foto sin tocar las
+bases, así que un backend degradado no retiene hilos de gunicorn.
+"""
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional
+
+
+class HealthMonitor:
+    def __init__(
+        self,
+        probes: Dict[str, Callable[[], None]],
+        interval: float = 10.0,
+        timeout: float = 2.0,
+        on_result: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+    ):
+        self.probes = probes
+        self.interval = interval
+        self.timeout = timeout
+        self.on_result = on_result
+        self._executor = ThreadPoolExecutor(max_workers=len(probes), thread_name_prefix="health-probe")
+        self._lock = threading.Lock()
+        self._round = threading.Lock()
+        # Sondeos que siguen colgados tras su timeout: no se relanzan hasta que terminen
+        self._pending: Dict[str, Future] = {}
+        self._results: Dict[str, Dict[str, Any]] = {
+            name: {"ok": False, "latency_ms": None, "checked_at": None, "error": "sin sondear"} for name in probes
+        }
+        self.checked = False
+
+    @staticmethod
+    def _run(fn: Callable[[], None]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            fn()
+            ok, error = True, None
+        except Exception as e:
+            ok, error = False, str(e)
+        return {
+            "ok": ok,
+            "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+            "checked_at": datetime.now(timezone.utc),
+            "error": error,
+        }
+
+    def probe(self):
+        """Una ronda de sondeos (~`timeout` s como máximo). Si ya hay una en curso, espera esa."""
+        if not self._round.acquire(blocking=False):
+            with self._round:
+                return
+        try:
+            futures = {}
+            for name, fn in self.probes.items():
+                fut = self._pending.get(name)
+                if fut is None or fut.done():
+                    fut = self._executor.submit(self._run, fn)
+                    self._pending[name] = fut
+                futures[name] = fut
+            # Margen para que los clientes con el mismo timeout alcancen a fallar solos
+            wait(futures.values(), timeout=self.timeout + 0.5)
+            for name, fut in futures.items():
+                if fut.done():
+                    result = fut.result()
+                else:
+                    result = {
+                        "ok": False, "latency_ms": None, "checked_at": datetime.now(timezone.utc),
+                        "error": f"sin respuesta en {self.timeout:g}s",
+                    }
+                with self._lock:
+                    self._results[name] = result
+                if self.on_result:
+                    self.on_result(name, result)
+            self.checked = True
+        finally:
+            self._round.release()
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Último resultado por backend. Uno sin sondeo reciente (hilo caído) cuenta como no ok."""
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            results = {name: dict(r) for name, r in self._results.items()}
+        for r in results.values():
+            age = (now - r["checked_at"]).total_seconds() if r["checked_at"] else None
+            r["age_s"] = round(age, 1) if age is not None else None
+            if age is not None and age > 3 * self.interval + self.timeout and r["ok"]:
+                r["ok"], r["error"] = False, "resultado vencido"
+        return results
+
+    def start(self) -> threading.Thread:
+        def run():
+            while True:
+                try:
+                    self.probe()
+                except Exception as e:
+                    print(f"[WARN] health monitor: {e}")
+                time.sleep(self.interval)
+
+        thread = threading.Thread(target=run, name="health-monitor", daemon=True)
+        thread.start()
+        return thread
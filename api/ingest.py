@@ -0,0 +1,350 @@
+"""
+Ingesta de eventos de sensores: parseo/validación en lote y escritura
+cruda (Mongo) + normalizada (Postgres).
+Compartido por /sensor_event y /sensor_events.
+"""
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import psycopg
+from bson import ObjectId
+from pydantic import TypeAdapter, ValidationError
+from pymongo.errors import BulkWriteError
+
+from models import SensorEvent
+
+
+REGISTRO_COLUMNS = (
+    "sensor_id", "estacionamiento_id", "hora_libre", "hora_ocupado", "estado", "created_at",
+)
+
+REGISTRO_INSERT_SQL = f"""
+    INSERT INTO registro_data({", ".join(REGISTRO_COLUMNS)})
+    VALUES (%s, %s, %s, %s, %s, %s)
+"""
+
+REGISTRO_COPY_SQL = f"COPY registro_data({', '.join(REGISTRO_COLUMNS)}) FROM STDIN"
+
+# Upsert del estado actual. last_change_at sólo avanza si cambia el estado y
+# un evento atrasado (ts anterior a last_seen_at) no pisa el estado vigente.
+# La transición se compara contra el estado previo (prev, con la fila
+# bloqueada): un evento repetido con el mismo ts no cuenta como cambio.
+STATE_UPSERT_CTES = """
+    ev(sensor_id, estacionamiento_id, estado, last_change_at, last_seen_at) AS (
+      VALUES (%s::int, %s::text, %s::text, %s::timestamptz, %s::timestamptz)
+    ),
+    prev AS (
+      SELECT s.estado FROM sensor_state s JOIN ev USING (sensor_id) FOR UPDATE OF s
+    ),
+    st AS (
+      INSERT INTO sensor_state AS s (sensor_id, estacionamiento_id, estado, last_change_at, last_seen_at)
+      SELECT ev.* FROM ev LEFT JOIN prev ON true  -- prev se lee (y bloquea) antes de escribir
+      ON CONFLICT (sensor_id) DO UPDATE SET
+        estacionamiento_id = EXCLUDED.estacionamiento_id,
+        estado = EXCLUDED.estado,
+        last_change_at = CASE WHEN s.estado = EXCLUDED.estado THEN s.last_change_at ELSE EXCLUDED.last_seen_at END,
+        last_seen_at = EXCLUDED.last_seen_at,
+        updated_at = now()
+      WHERE s.last_seen_at <= EXCLUDED.last_seen_at
+      RETURNING s.estado IS DISTINCT FROM (SELECT estado FROM prev) AS transicion
+    )
+"""
+
+SENSOR_STATE_UPSERT_SQL = f"""
+    WITH {STATE_UPSERT_CTES}
+    SELECT transicion FROM st
+"""
+
+# Modo "transitions": el upsert decide y registro_data sólo recibe la fila si
+# el estado cambió (o es el primer evento del sensor). Un evento repetido sólo
+# refresca last_seen_at; uno atrasado no se normaliza (queda en events_raw).
+REGISTRO_DEDUP_SQL = f"""
+    WITH {STATE_UPSERT_CTES},
+    ins AS (
+      INSERT INTO registro_data({", ".join(REGISTRO_COLUMNS)})
+      SELECT %s, %s, %s, %s, %s, %s FROM st WHERE st.transicion
+    )
+    SELECT transicion FROM st
+"""
+
+# Sesiones (parking_session), sólo para transiciones y en orden de ts: cierra la
+# sesión abierta del sensor, abre la del nuevo estado y completa la duración en
+# la fila de registro_data que abrió la sesión cerrada. Un cambio con el mismo
+# ts que el anterior reemplaza el estado de la sesión recién abierta.
+SESSION_SQL = """
+    WITH ev(sensor_id, estacionamiento_id, estado, at) AS (
+      VALUES (%s::int, %s::text, %s::text, %s::timestamptz)
+    ),
+    cerrada AS (
+      UPDATE parking_session p SET ended_at = ev.at
+      FROM ev
+      WHERE p.sensor_id = ev.sensor_id AND p.ended_at IS NULL AND p.started_at < ev.at
+      RETURNING p.sensor_id, p.estado, p.started_at, p.ended_at
+    ),
+    abierta AS (
+      INSERT INTO parking_session (sensor_id, estacionamiento_id, estado, started_at)
+      SELECT sensor_id, estacionamiento_id, estado, at FROM ev
+      ON CONFLICT (sensor_id, started_at) DO UPDATE SET estado = EXCLUDED.estado
+    )
+    UPDATE registro_data r SET
+      tiempo_libre = CASE WHEN c.estado = 'libre' THEN c.ended_at - c.started_at END,
+      tiempo_ocupado = CASE WHEN c.estado = 'ocupado' THEN c.ended_at - c.started_at END
+    FROM cerrada c
+    WHERE r.sensor_id = c.sensor_id AND r.created_at = c.started_at AND r.estado = c.estado
+"""
+
+REGISTRO_MODES = ("all", "transitions")
+INGEST_MODES = ("sync", "buffered", "raw")
+
+# Aviso de cambio de estado a los workers (LISTEN en stream.py); se entrega al commit.
+# ts con seis decimales en UTC (mismo formato que json_provider.iso_sql): el
+# texto de json_build_object los recorta y fromisoformat de 3.10 no lo acepta.
+STREAM_CHANNEL = "smartpark_cambios"
+NOTIFY_SQL = f"""
+    SELECT pg_notify('{STREAM_CHANNEL}', json_build_object(
+      'id', nextval('stream_event_seq'),
+      'sensor_id', %s::int, 'estacionamiento_id', %s::text, 'estado', %s::text,
+      'ts', to_char(%s::timestamptz AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS.US"+00:00"')
+    )::text)
+"""
+
+_EVENTS_ADAPTER = TypeAdapter(List[SensorEvent])
+
+
+# ---- Parseo y validación ----
+NDJSON_MIMETYPES = ("application/x-ndjson", "application/jsonl")
+
+
+def is_ndjson(mimetype: str, raw: bytes) -> bool:
+    """
+    Formato del lote según Content-Type: NDJSON con NDJSON_MIMETYPES y arreglo
+    JSON con application/json (un objeto suelto es 400, no un lote de uno).
+    Sin ninguno de los dos, NDJSON salvo que el cuerpo empiece con '['.
+    """
+    if mimetype in NDJSON_MIMETYPES:
+        return True
+    if mimetype == "application/json":
+        return False
+    return not raw.lstrip().startswith(b"[")
+
+
+def parse_body(raw: bytes, ndjson: bool) -> Tuple[List[Tuple[int, Any]], Dict[int, str]]:
+    """Devuelve [(indice, objeto)] y errores de parseo por índice."""
+    errors: Dict[int, str] = {}
+    if not ndjson:
+        try:
+            items = json.loads(raw)
+        except ValueError as e:
+            raise ValueError(f"JSON inválido: {e}") from e
+        if not isinstance(items, list):
+            raise ValueError("se esperaba un arreglo JSON de eventos")
+        return list(enumerate(items)), errors
+
+    items: List[Tuple[int, Any]] = []
+    index = 0
+    for line in raw.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            items.append((index, json.loads(line)))
+        except ValueError as e:
+            errors[index] = f"JSON inválido: {e}"
+        index += 1
+    return items, errors
+
+
+def validate_events(items: List[Tuple[int, Any]]) -> Tuple[List[Tuple[int, SensorEvent]], Dict[int, str]]:
+    # Una sola pasada de validación para todo el lote; si hay errores se
+    # descartan los índices fallidos y se re-valida el resto (ya conocido válido).
+    errors: Dict[int, str] = {}
+    try:
+        events = _EVENTS_ADAPTER.validate_python([obj for _, obj in items])
+        return [(idx, ev) for (idx, _), ev in zip(items, events)], errors
+    except ValidationError as e:
+        bad = {}
+        for err in e.errors():
+            pos = err["loc"][0]
+            field = ".".join(str(p) for p in err["loc"][1:]) or "evento"
+            bad.setdefault(pos, []).append(f"{field}: {err['msg']}")
+
+    for pos, msgs in bad.items():
+        errors[items[pos][0]] = "payload inválido: " + "; ".join(msgs)
+    good = [item for pos, item in enumerate(items) if pos not in bad]
+    events = _EVENTS_ADAPTER.validate_python([obj for _, obj in good]) if good else []
+    return [(idx, ev) for (idx, _), ev in zip(good, events)], errors
+
+
+# ---- Construcción de documentos/filas ----
+def build_doc(
+    data: SensorEvent, now: Optional[datetime] = None, sensor_meta: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    # _id fijo desde ya (y no al insertar): los reintentos de un lote y la copia
+    # de to_layout llevan el mismo, así Mongo no duplica el crudo.
+    doc = {
+        "_id": ObjectId(),
+        "sensor_id": data.sensor_id,
+        "estacionamiento_id": data.estacionamiento_id,
+        "estado": data.estado,
+        "ts": data.ts or now or datetime.utcnow(),
+        "payload": data.payload or {},
+    }
+    if sensor_meta:
+        doc["sensor"] = sensor_meta  # campus, tipo, ... desde el registro en memoria
+    return doc
+
+
+def registro_row(doc: Dict[str, Any]) -> tuple:
+    ts = doc["ts"]
+    hora_ocupado = ts if doc["estado"] == "ocupado" else None
+    hora_libre = ts if doc["estado"] == "libre" else None
+    return (doc["sensor_id"], doc["estacionamiento_id"], hora_libre, hora_ocupado, doc["estado"], ts)
+
+
+def state_row(doc: Dict[str, Any]) -> tuple:
+    ts = doc["ts"]
+    return (doc["sensor_id"], doc["estacionamiento_id"], doc["estado"], ts, ts)
+
+
+def notify_row(doc: Dict[str, Any]) -> tuple:
+    return (doc["sensor_id"], doc["estacionamiento_id"], doc["estado"], doc["ts"])
+
+
+# ---- Escritura ----
+def dedup_row(doc: Dict[str, Any]) -> tuple:
+    return state_row(doc) + registro_row(doc)
+
+
+def session_row(doc: Dict[str, Any]) -> tuple:
+    return (doc["sensor_id"], doc["estacionamiento_id"], doc["estado"], doc["ts"])
+
+
+def _write_one(cur: psycopg.Cursor, doc: Dict[str, Any], dedup: bool) -> bool:
+    if dedup:
+        cur.execute(REGISTRO_DEDUP_SQL, dedup_row(doc))
+    else:
+        cur.execute(REGISTRO_INSERT_SQL, registro_row(doc))
+        cur.execute(SENSOR_STATE_UPSERT_SQL, state_row(doc))
+    row = cur.fetchone()
+    transicion = bool(row and row[0])
+    if transicion:
+        cur.execute(SESSION_SQL, session_row(doc))
+    return transicion
+
+
+def pg_write_event(
+    conn: psycopg.Connection, doc: Dict[str, Any], notify: bool = False, dedup: bool = False
+) -> bool:
+    """
+    Inserta el registro y actualiza sensor_state (y parking_session si hubo
+    transición) en una transacción. Con dedup=True el registro sólo se inserta si hubo transición.
+    Devuelve True si el evento fue una transición de estado.
+    """
+    with conn.transaction():
+        with conn.cursor() as cur:
+            transicion = _write_one(cur, doc, dedup)
+            if notify and transicion:
+                cur.execute(NOTIFY_SQL, notify_row(doc))
+    return transicion
+
+
+async def apg_write_event(
+    conn: psycopg.AsyncConnection, doc: Dict[str, Any], notify: bool = False, dedup: bool = False
+) -> bool:
+    """Versión async de pg_write_event (asgi.py)."""
+    async with conn.transaction():
+        async with conn.cursor() as cur:
+            if dedup:
+                await cur.execute(REGISTRO_DEDUP_SQL, dedup_row(doc))
+            else:
+                await cur.execute(REGISTRO_INSERT_SQL, registro_row(doc))
+                await cur.execute(SENSOR_STATE_UPSERT_SQL, state_row(doc))
+            row = await cur.fetchone()
+            transicion = bool(row and row[0])
+            if transicion:
+                await cur.execute(SESSION_SQL, session_row(doc))
+            if notify and transicion:
+                await cur.execute(NOTIFY_SQL, notify_row(doc))
+    return transicion
+
+
+def mongo_insert_many(col, docs: List[Dict[str, Any]], skip_existing: bool = False) -> Dict[int, str]:
+    """
+    insert_many(ordered=False); devuelve errores por posición en `docs`.
+    Los duplicados de _id (reintento de un lote ya escrito) cuentan como
+    éxito. Las time-series no tienen _id único: con skip_existing=True se
+    omiten antes los _id ya guardados (índice id_asc). Fallos de conexión se
+    propagan como PyMongoError.
+    """
+    if not docs:
+        return {}
+    positions = list(range(len(docs)))
+    if skip_existing:
+        found = {d["_id"] for d in col.find({"_id": {"$in": [doc["_id"] for doc in docs]}}, {"_id": 1})}
+        positions = [pos for pos in positions if docs[pos]["_id"] not in found]
+        if not positions:
+            return {}
+    try:
+        col.insert_many([docs[pos] for pos in positions], ordered=False)
+    except BulkWriteError as e:
+        return {
+            positions[err["index"]]: f"mongo insert: {err.get('errmsg')}"
+            for err in e.details.get("writeErrors", [])
+            if err.get("code") != 11000
+        }
+    return {}
+
+
+def pg_write_events(
+    conn: psycopg.Connection, docs: List[Dict[str, Any]], notify: bool = False, dedup: bool = False
+) -> Tuple[Dict[int, str], Set[int]]:
+    """
+    Inserta los registros con COPY y actualiza sensor_state y parking_session
+    (en orden de ts) en una sola transacción; con dedup=True sólo se insertan las transiciones
+    (upsert + insert condicional por evento, sin COPY). Si el lote viola
+    alguna restricción (FK, datos), se reintenta evento a evento con
+    savepoints para aislar los inválidos. Devuelve errores por posición en
+    `docs` y las posiciones que fueron transiciones de estado.
+    """
+    if not docs:
+        return {}, set()
+    order = sorted(range(len(docs)), key=lambda i: docs[i]["ts"])
+    try:
+        with conn.transaction():
+            with conn.cursor() as cur:
+                if dedup:
+                    cur.executemany(REGISTRO_DEDUP_SQL, [dedup_row(docs[i]) for i in order], returning=True)
+                else:
+                    with cur.copy(REGISTRO_COPY_SQL) as copy:
+                        for doc in docs:
+                            copy.write_row(registro_row(doc))
+                    cur.executemany(SENSOR_STATE_UPSERT_SQL, [state_row(docs[i]) for i in order], returning=True)
+                transiciones = set()
+                for i in order:
+                    row = cur.fetchone()
+                    if row and row[0]:
+                        transiciones.add(i)
+                    cur.nextset()
+                if transiciones:
+                    cur.executemany(SESSION_SQL, [session_row(docs[i]) for i in order if i in transiciones])
+                if notify and transiciones:
+                    cur.executemany(NOTIFY_SQL, [notify_row(docs[i]) for i in order if i in transiciones])
+        return {}, transiciones
+    except (psycopg.errors.IntegrityError, psycopg.errors.DataError):
+        pass
+
+    errors: Dict[int, str] = {}
+    transiciones = set()
+    with conn.transaction():
+        with conn.cursor() as cur:
+            for i in order:
+                try:
+                    with conn.transaction():
+                        if _write_one(cur, docs[i], dedup):
+                            if notify:
+                                cur.execute(NOTIFY_SQL, notify_row(docs[i]))
+                            transiciones.add(i)
+                except (psycopg.errors.IntegrityError, psycopg.errors.DataError) as e:
+                    errors[i] = f"pg insert: {str(e).strip()}"
+    return errors, transiciones
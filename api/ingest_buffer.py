@@ -0,0 +1,138 @@
+"""
+Buffer de ingesta diferida (write-behind): los eventos aceptados se encolan
+en memoria y un hilo los persiste en grupos (por tamaño o por tiempo).
+Se activa con INGEST_MODE=buffered; cada worker de gunicorn tiene su cola.
+"""
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+
+class IngestBuffer:
+    def __init__(
+        self,
+        flush_fn: Callable[[List[Dict[str, Any]]], Dict[int, str]],
+        max_size: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 0.2,
+        max_retries: int = 5,
+    ):
+        self._flush_fn = flush_fn
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max_size)
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self._closing = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.stats = {
+            "accepted": 0,
+            "rejected_full": 0,
+            "flushed": 0,
+            "flushes": 0,
+            "item_errors": 0,
+            "dropped": 0,
+            "consecutive_failures": 0,
+            "last_flush_at": None,
+            "last_error": None,
+        }
+
+    # ---- Ciclo de vida ----
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="ingest-flusher", daemon=True)
+        self._thread.start()
+
+    def close(self, timeout: float = 30.0):
+        # Apagado ordenado: deja de aceptar y drena lo pendiente
+        self._closing.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    @property
+    def accepting(self) -> bool:
+        # Si el backend cae, la cola se llena y los productores reciben 429
+        return not self._closing.is_set()
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    # ---- Productor ----
+    def offer(self, doc: Dict[str, Any]) -> bool:
+        try:
+            self._queue.put_nowait(doc)
+        except queue.Full:
+            self._count("rejected_full")
+            return False
+        self._count("accepted")
+        return True
+
+    # ---- Consumidor ----
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch:
+                self._flush(batch)
+            elif self._closing.is_set():
+                return
+
+    def _next_batch(self) -> List[Dict[str, Any]]:
+        try:
+            first = self._queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                # Pasado el plazo sólo se toma lo ya encolado, sin esperar
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch: List[Dict[str, Any]]):
+        # Reintenta con backoff mientras la cola se llena (backpressure natural).
+        for attempt in range(self.max_retries):
+            try:
+                errors = self._flush_fn(batch)
+            except Exception as e:
+                with self._lock:
+                    self.stats["consecutive_failures"] += 1
+                    self.stats["last_error"] = str(e)
+                print(f"[WARN] flush de ingesta falló (intento {attempt + 1}): {e}")
+                time.sleep(min(0.5 * 2 ** attempt, 10))
+                continue
+            with self._lock:
+                self.stats["flushes"] += 1
+                self.stats["flushed"] += len(batch) - len(errors)
+                self.stats["item_errors"] += len(errors)
+                self.stats["consecutive_failures"] = 0
+                self.stats["last_flush_at"] = datetime.now(timezone.utc).isoformat()
+                if errors:
+                    self.stats["last_error"] = next(iter(errors.values()))
+            return
+        self._count("dropped", len(batch))
+        print(f"[WARN] se descartaron {len(batch)} eventos tras {self.max_retries} intentos")
+
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self.stats[key] += n
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+        return {
+            "depth": self.depth,
+            "capacity": self.max_size,
+            "batch_size": self.batch_size,
+            "flush_interval_ms": int(self.flush_interval * 1000),
+            "accepting": self.accepting,
+            **stats,
+        }
@@ -0,0 +1,68 @@
+"""
+Serialización JSON rápida para la API.
+OrjsonProvider reemplaza al proveedor estándar de Flask (jsonify,
+request.get_json) manteniendo su salida: claves ordenadas, claves no
+string y fechas crudas en formato HTTP. Sin orjson instalado queda el
+proveedor de Flask.
+
+row_dicts/columnar arman las listas de las rutas a partir de las tuplas de
+psycopg sin tocar cada valor: las fechas ya vienen como texto ISO 8601
+desde Postgres (iso_sql).
+"""
+from typing import Any, Dict, List, Sequence
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - sin orjson se usa el proveedor de Flask
+    orjson = None
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    # Las fechas pasan por `default` (http_date) igual que con el proveedor estándar
+    options = (orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME) if orjson else 0
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return orjson.dumps(obj, default=self.default, option=self.options).decode()
+
+    def loads(self, s, **kwargs: Any) -> Any:
+        return orjson.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any):
+        obj = self._prepare_response_obj(args, kwargs)
+        option = self.options | orjson.OPT_APPEND_NEWLINE
+        if self.compact is False or (self.compact is None and self._app.debug):
+            option |= orjson.OPT_INDENT_2
+        body = orjson.dumps(obj, default=self.default, option=option)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def init_app(app: Flask):
+    if orjson is not None:
+        app.json = OrjsonProvider(app)
+
+
+# ---- Filas ----
+ISO_SQL_FORMAT = 'YYYY-MM-DD"T"HH24:MI:SS.US"+00:00"'
+
+
+def iso_sql(column: str) -> str:
+    """Expresión SQL que devuelve el timestamptz como texto ISO 8601 en UTC.
+
+    Siempre con seis decimales (to_json los recorta: .12+00:00), para que
+    datetime.fromisoformat lo lea también en Python 3.10 (cursores, NOTIFY).
+    """
+    return f"to_char(({column}) AT TIME ZONE 'UTC', '{ISO_SQL_FORMAT}')"
+
+
+def row_dicts(fields: Sequence[str], rows: List[tuple]) -> List[Dict[str, Any]]:
+    # zip se detiene en el último campo: columnas extra al final (p. ej. id del cursor) no salen
+    return [dict(zip(fields, r)) for r in rows]
+
+
+def columnar(fields: Sequence[str], rows: List[tuple]) -> Dict[str, Any]:
+    """?format=columnar: un arreglo por campo, sin repetir las claves en cada fila."""
+    columns = list(zip(*rows)) if rows else [()] * len(fields)
+    return {"format": "columnar", "fields": list(fields), "columns": dict(zip(fields, map(list, columns)))}
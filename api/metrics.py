@@ -0,0 +1,217 @@
+"""
+Métricas Prometheus para /metrics: latencia y status por ruta, estado del
+pool de Postgres (muestreado de pg_pool.pop_stats()) y comandos/conexiones
+de Mongo (listeners de monitoreo de pymongo).
+
+Con varios workers de gunicorn se usa el modo multiproceso de
+prometheus_client: PROMETHEUS_MULTIPROC_DIR debe existir y estar definido
+antes de importar este módulo (lo hacen gunicorn.conf.py / startup.sh) y
+el hook child_exit marca los workers que terminan.
+"""
+import os
+import threading
+import time
+from typing import Callable, List, Optional
+
+from flask import Flask, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from pymongo import monitoring
+
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+# ---- HTTP ----
+HTTP_LATENCY = Histogram(
+    "smartpark_http_request_duration_seconds", "Latencia por ruta", ["method", "route"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+HTTP_REQUESTS = Counter("smartpark_http_requests_total", "Requests por ruta y status", ["method", "route", "status"])
+
+# ---- Pool de Postgres ----
+PG_POOL_SIZE = Gauge("smartpark_pg_pool_size", "Conexiones abiertas", multiprocess_mode="livesum")
+PG_POOL_IN_USE = Gauge("smartpark_pg_pool_in_use", "Conexiones prestadas", multiprocess_mode="livesum")
+PG_POOL_WAITING = Gauge("smartpark_pg_pool_waiting", "Requests esperando conexión", multiprocess_mode="livesum")
+PG_POOL_MAX = Gauge("smartpark_pg_pool_max", "max_size del pool", multiprocess_mode="livesum")
+PG_POOL_REQUESTS = Counter("smartpark_pg_pool_requests_total", "Conexiones pedidas al pool")
+PG_POOL_QUEUED = Counter("smartpark_pg_pool_requests_queued_total", "Pedidos que tuvieron que esperar")
+PG_POOL_WAIT = Counter("smartpark_pg_pool_wait_seconds_total", "Tiempo total de espera por una conexión")
+PG_POOL_USAGE = Counter("smartpark_pg_pool_usage_seconds_total", "Tiempo total con una conexión prestada")
+PG_POOL_ERRORS = Counter("smartpark_pg_pool_errors_total", "Errores del pool", ["kind"])
+
+# ---- Mongo ----
+MONGO_COMMAND = Histogram(
+    "smartpark_mongo_command_duration_seconds", "Duración de comandos Mongo", ["command", "outcome"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+MONGO_CHECKED_OUT = Gauge("smartpark_mongo_pool_checked_out", "Conexiones Mongo en uso", multiprocess_mode="livesum")
+MONGO_CHECKOUT_FAILED = Counter("smartpark_mongo_pool_checkout_failed_total", "Checkouts fallidos", ["reason"])
+MONGO_CHECKOUT_WAIT = Histogram(
+    "smartpark_mongo_pool_checkout_seconds", "Espera por una conexión del pool de Mongo",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5),
+)
+
+# ---- Ingesta ----
+INGEST_QUEUE_DEPTH = Gauge("smartpark_ingest_queue_depth", "Eventos en cola (modo buffered)", multiprocess_mode="livesum")
+
+# ---- Salud de dependencias (health.HealthMonitor) ----
+DEPENDENCY_UP = Gauge("smartpark_dependency_up", "Último sondeo ok (1) o fallido (0)", ["backend"], multiprocess_mode="livemin")
+DEPENDENCY_LATENCY = Gauge(
+    "smartpark_dependency_probe_seconds", "Latencia del último sondeo", ["backend"], multiprocess_mode="livemax"
+)
+
+# ---- Arranque del worker (app.start_worker) ----
+WORKER_START = Gauge(
+    "smartpark_worker_start_seconds", "Arranque en frío del worker por fase (import, warmup, total)", ["phase"],
+    multiprocess_mode="livemax",
+)
+
+
+# ---- Flask ----
+def init_app(app: Flask):
+    """Registra los hooks de latencia. Llamar antes de otros before_request."""
+
+    @app.before_request
+    def _metrics_start():
+        g._metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _metrics_record(response):
+        _observe(response.status_code)
+        return response
+
+    @app.teardown_request
+    def _metrics_error(exc):
+        if exc is not None:
+            _observe(500)
+
+
+def _observe(status: int):
+    start = g.pop("_metrics_start", None)
+    if start is None:
+        return  # ya registrado (after_request) o request cortado antes del hook
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    observe(request.method, route, status, time.perf_counter() - start)
+
+
+def observe(method: str, route: str, status: int, seconds: float):
+    HTTP_LATENCY.labels(method, route).observe(seconds)
+    HTTP_REQUESTS.labels(method, route, str(status)).inc()
+
+
+def render():
+    """Cuerpo y content-type para /metrics (agregado de todos los workers)."""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+# ---- Muestreo del pool de Postgres ----
+def sample_pool(pool):
+    # pop_stats() devuelve y reinicia los contadores: se acumulan en Counters propios
+    stats = pool.pop_stats()
+    size = stats.get("pool_size", 0)
+    PG_POOL_SIZE.set(size)
+    PG_POOL_IN_USE.set(size - stats.get("pool_available", 0))
+    PG_POOL_WAITING.set(stats.get("requests_waiting", 0))
+    PG_POOL_MAX.set(stats.get("pool_max", 0))
+    PG_POOL_REQUESTS.inc(stats.get("requests_num", 0))
+    PG_POOL_QUEUED.inc(stats.get("requests_queued", 0))
+    PG_POOL_WAIT.inc(stats.get("requests_wait_ms", 0) / 1000)
+    PG_POOL_USAGE.inc(stats.get("usage_ms", 0) / 1000)
+    for kind in ("requests_errors", "connections_errors", "connections_lost", "returns_bad"):
+        if stats.get(kind):
+            PG_POOL_ERRORS.labels(kind).inc(stats[kind])
+
+
+def start_sampler(pool, interval: float = 5.0, queue_depth: Optional[Callable[[], int]] = None) -> threading.Thread:
+    def run():
+        while True:
+            try:
+                sample_pool(pool)
+                if queue_depth:
+                    INGEST_QUEUE_DEPTH.set(queue_depth())
+            except Exception as e:
+                print(f"[WARN] muestreo de métricas: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name="metrics-sampler", daemon=True)
+    thread.start()
+    return thread
+
+
+def observe_cold_start(import_s: float, warmup_s: float, total_s: float):
+    WORKER_START.labels("import").set(import_s)
+    WORKER_START.labels("warmup").set(warmup_s)
+    WORKER_START.labels("total").set(total_s)
+
+
+def observe_dependency(backend: str, result: dict):
+    DEPENDENCY_UP.labels(backend).set(1 if result["ok"] else 0)
+    if result["latency_ms"] is not None:
+        DEPENDENCY_LATENCY.labels(backend).set(result["latency_ms"] / 1000)
+
+
+# ---- Mongo ----
+class MongoCommandMetrics(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_COMMAND.labels(event.command_name, "ok").observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        MONGO_COMMAND.labels(event.command_name, "error").observe(event.duration_micros / 1e6)
+
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    # La espera la mide el driver (event.duration, en s): con AsyncMongoClient
+    # varios checkouts se intercalan en el hilo del event loop y un inicio por
+    # hilo mezclaría las esperas. El evento de inicio no trae connection_id.
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_checked_out(self, event):
+        MONGO_CHECKED_OUT.inc()
+        if event.duration is not None:
+            MONGO_CHECKOUT_WAIT.observe(event.duration)
+
+    def connection_check_out_failed(self, event):
+        MONGO_CHECKOUT_FAILED.labels(str(event.reason)).inc()
+
+    def connection_checked_in(self, event):
+        MONGO_CHECKED_OUT.dec()
+
+    # Eventos sin métrica asociada
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+
+def mongo_listeners() -> List[object]:
+    return [MongoCommandMetrics(), MongoPoolMetrics()]
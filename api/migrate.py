@@ -0,0 +1,49 @@
+"""
+Migraciones de una sola vez, fuera del arranque de los workers: colección
+events_raw (formato y TTL según EVENTS_RAW_*) e índices de Mongo. Es
+idempotente; startup.sh la corre una vez antes de levantar gunicorn
+(MIGRATE_ON_START=0 para omitirla) en lugar de que cada worker pague los
+round trips al importar app.py.
+
+Uso: export $(grep -v '^#' tools/.env | xargs) ; python api/migrate.py
+"""
+import os
+import sys
+import time
+
+import certifi
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+import events_raw
+
+EVENTS_RAW_COLLECTION = os.environ.get("EVENTS_RAW_COLLECTION", "events_raw")
+EVENTS_RAW_LAYOUT = os.environ.get("EVENTS_RAW_LAYOUT", "plain").lower()
+EVENTS_RAW_TTL_SEC = int(os.environ.get("EVENTS_RAW_TTL_SEC", "0"))
+MIGRATE_TIMEOUT_SEC = float(os.environ.get("MIGRATE_TIMEOUT_SEC", "20"))
+
+
+def migrate_mongo(mdb):
+    events_raw.ensure_collection(mdb, EVENTS_RAW_COLLECTION, EVENTS_RAW_LAYOUT, EVENTS_RAW_TTL_SEC)
+
+
+def main():
+    if EVENTS_RAW_LAYOUT not in events_raw.LAYOUTS:
+        sys.exit(f"EVENTS_RAW_LAYOUT inválido: {EVENTS_RAW_LAYOUT}")
+    started = time.monotonic()
+    timeout_ms = int(MIGRATE_TIMEOUT_SEC * 1000)
+    mongo = MongoClient(
+        os.environ["MONGODB_URI"], tlsCAFile=certifi.where(),
+        serverSelectionTimeoutMS=timeout_ms, connectTimeoutMS=timeout_ms,
+    )
+    try:
+        migrate_mongo(mongo["smartpark"])
+    except PyMongoError as e:
+        sys.exit(f"[MIGRATE] mongo: {e}")
+    finally:
+        mongo.close()
+    print(f"[MIGRATE] {EVENTS_RAW_COLLECTION} ({EVENTS_RAW_LAYOUT}) ok en {time.monotonic() - started:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Any, Dict, Optional, Literal
 
 from pydantic import BaseModel, Field
@@ -10,3 +10,15 @@ class SensorEvent(BaseModel):
     estado: Literal["ocupado", "libre"]
     ts: Optional[datetime] = None
     payload: Optional[Dict[str, Any]] = None
+
+
+def parse_ts(value: str) -> datetime:
+    """
+    Fecha ISO 8601 de un filtro from/to. Sin zona horaria se toma como UTC
+    (lo mismo en todas las rutas, sin depender de la TimeZone de la sesión de
+    Postgres). ValueError si no es una fecha válida.
+    """
+    if value.endswith(("Z", "z")):
+        value = value[:-1] + "+00:00"  # fromisoformat de 3.10 no acepta Z
+    ts = datetime.fromisoformat(value)
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
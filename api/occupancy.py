@@ -0,0 +1,104 @@
+"""
+Estado de ocupación en memoria: último estado por sensor y contadores
+agregados por campus, estacionamiento y piso, mantenidos incrementalmente
+en cada evento. Las lecturas cuestan O(grupos), no O(eventos).
+"""
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+def _utc(ts: Optional[datetime]) -> Optional[datetime]:
+    if ts is not None and ts.tzinfo is None:
+        return ts.replace(tzinfo=timezone.utc)
+    return ts
+
+
+class OccupancyState:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sensors: Dict[int, Tuple[Optional[str], Optional[datetime], str]] = {}
+        self._lots: Dict[str, Tuple[str, Optional[int]]] = {}
+        self._groups: Dict[tuple, Dict[str, Any]] = {}
+        self.warmed_at: Optional[datetime] = None
+
+    @property
+    def warmed(self) -> bool:
+        return self.warmed_at is not None
+
+    # ---- Carga completa ----
+    def load(self, lots: Iterable[tuple], sensors: Iterable[tuple]):
+        """
+        lots: (estacionamiento_id, campus_codigo, piso)
+        sensors: (sensor_id, estacionamiento_id, estado | None, ts | None)
+        Construye estructuras nuevas y las intercambia de una vez.
+        """
+        new_lots = {est_id: (campus, piso) for est_id, campus, piso in lots}
+        new_sensors = {}
+        new_groups: Dict[tuple, Dict[str, Any]] = {}
+        for sensor_id, est_id, estado, ts in sensors:
+            ts = _utc(ts)
+            new_sensors[sensor_id] = (estado, ts, est_id)
+            for key in self._group_keys(new_lots, est_id):
+                self._add(new_groups, key, estado, ts, 1)
+        with self._lock:
+            self._lots = new_lots
+            self._sensors = new_sensors
+            self._groups = new_groups
+            self.warmed_at = datetime.now(timezone.utc)
+
+    # ---- Actualización incremental ----
+    def apply(self, sensor_id: int, est_id: str, estado: str, ts: datetime) -> bool:
+        """Aplica un evento; devuelve True si cambió el estado del sensor."""
+        ts = _utc(ts)
+        with self._lock:
+            prev = self._sensors.get(sensor_id)
+            if prev and prev[1] and ts < prev[1]:
+                return False  # evento atrasado: no pisa un estado más reciente
+            if prev:
+                for key in self._group_keys(self._lots, prev[2]):
+                    self._add(self._groups, key, prev[0], None, -1)
+            self._sensors[sensor_id] = (estado, ts, est_id)
+            for key in self._group_keys(self._lots, est_id):
+                self._add(self._groups, key, estado, ts, 1)
+            return not prev or prev[0] != estado
+
+    # ---- Lectura ----
+    def summary(self, campus: Optional[str] = None) -> Dict[str, List[Dict[str, Any]]]:
+        with self._lock:
+            groups = [(key, dict(val)) for key, val in self._groups.items()]
+        out: Dict[str, List[Dict[str, Any]]] = {"campus": [], "estacionamientos": [], "pisos": []}
+        for key, val in sorted(groups, key=lambda kv: tuple(str(k) for k in kv[0])):
+            kind = key[0]
+            if campus and key[1] != campus:
+                continue
+            val["total"] = val["libres"] + val["ocupados"] + val["sin_datos"]
+            last = val.pop("last_ts")
+            val["last_update"] = last.isoformat() if last else None
+            if kind == "campus":
+                out["campus"].append({"codigo": key[1], **val})
+            elif kind == "piso":
+                out["pisos"].append({"campus": key[1], "piso": key[2], **val})
+            else:
+                out["estacionamientos"].append({"id": key[2], "campus": key[1], "piso": key[3], **val})
+        return out
+
+    def campus_of(self, est_id: str) -> str:
+        return self._group_keys(self._lots, est_id)[0][1]
+
+    # ---- Internos ----
+    @staticmethod
+    def _group_keys(lots, est_id: str) -> List[tuple]:
+        # Estacionamientos fuera del catálogo: campus por prefijo del id (MON-1A -> MON)
+        campus, piso = lots.get(est_id) or (est_id.split("-")[0], None)
+        return [("campus", campus), ("piso", campus, piso), ("estacionamiento", campus, est_id, piso)]
+
+    @staticmethod
+    def _add(groups, key, estado, ts, delta):
+        g = groups.get(key)
+        if g is None:
+            g = groups[key] = {"libres": 0, "ocupados": 0, "sin_datos": 0, "last_ts": None}
+        field = "libres" if estado == "libre" else "ocupados" if estado == "ocupado" else "sin_datos"
+        g[field] += delta
+        if ts and (g["last_ts"] is None or ts > g["last_ts"]):
+            g["last_ts"] = ts
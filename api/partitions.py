@@ -0,0 +1,217 @@
+"""
+Mantenimiento de particiones de registro_data (RANGE por created_at).
+Crea por adelantado las particiones futuras, mueve a su partición las filas
+que hayan caído en registro_data_default y separa (detach) o elimina las
+particiones más antiguas que la retención configurada.
+
+Uso: export $(grep -v '^#' tools/.env | xargs) ; python api/partitions.py
+Config:
+  REGISTRO_PARTITION_INTERVAL=month   # month | day
+  REGISTRO_PARTITION_PAST=1           # particiones hacia atrás a asegurar
+  REGISTRO_PARTITION_PREMAKE=3        # particiones futuras a crear
+  REGISTRO_RETENTION=0                # nº de particiones a conservar (0 = sin retención)
+  REGISTRO_RETENTION_ACTION=detach    # detach | drop
+"""
+import argparse
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+import psycopg
+
+PARENT = "registro_data"
+DEFAULT_PARTITION = "registro_data_default"
+INTERVALS = ("month", "day")
+
+INTERVAL = os.environ.get("REGISTRO_PARTITION_INTERVAL", "month")
+PAST = int(os.environ.get("REGISTRO_PARTITION_PAST", "1"))
+PREMAKE = int(os.environ.get("REGISTRO_PARTITION_PREMAKE", "3"))
+RETENTION = int(os.environ.get("REGISTRO_RETENTION", "0"))
+RETENTION_ACTION = os.environ.get("REGISTRO_RETENTION_ACTION", "detach")
+
+# Evita que dos procesos (workers, cron) hagan mantenimiento a la vez
+_LOCK_KEY = 0x5350_0001
+
+_NAME_RE = re.compile(rf"^{PARENT}_p(\d{{6}}|\d{{8}})$")
+
+
+# ---- Límites y nombres ----
+def floor_bound(ts: datetime, interval: str) -> datetime:
+    ts = ts.astimezone(timezone.utc)
+    if interval == "month":
+        return datetime(ts.year, ts.month, 1, tzinfo=timezone.utc)
+    return datetime(ts.year, ts.month, ts.day, tzinfo=timezone.utc)
+
+
+def next_bound(lo: datetime, interval: str) -> datetime:
+    if interval == "month":
+        return datetime(lo.year + lo.month // 12, lo.month % 12 + 1, 1, tzinfo=timezone.utc)
+    return lo + timedelta(days=1)
+
+
+def shift(lo: datetime, interval: str, n: int) -> datetime:
+    if interval == "day":
+        return lo + timedelta(days=n)
+    months = lo.year * 12 + lo.month - 1 + n
+    return datetime(months // 12, months % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def partition_name(lo: datetime, interval: str) -> str:
+    return f"{PARENT}_p{lo.strftime('%Y%m' if interval == 'month' else '%Y%m%d')}"
+
+
+def parse_partition_name(name: str) -> Optional[Tuple[datetime, datetime]]:
+    m = _NAME_RE.match(name)
+    if not m:
+        return None
+    raw = m.group(1)
+    if len(raw) == 6:
+        lo = datetime(int(raw[:4]), int(raw[4:]), 1, tzinfo=timezone.utc)
+        return lo, next_bound(lo, "month")
+    lo = datetime(int(raw[:4]), int(raw[4:6]), int(raw[6:]), tzinfo=timezone.utc)
+    return lo, next_bound(lo, "day")
+
+
+# ---- Operaciones ----
+def attached_partitions(conn: psycopg.Connection) -> List[str]:
+    rows = conn.execute(
+        """
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = %s;
+        """,
+        (PARENT,),
+    ).fetchall()
+    return [r[0] for r in rows]
+
+
+def create_partition(conn: psycopg.Connection, lo: datetime, interval: str) -> str:
+    hi = next_bound(lo, interval)
+    name = partition_name(lo, interval)
+    with conn.transaction():
+        pending = conn.execute(
+            f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE created_at >= %s AND created_at < %s);",
+            (lo, hi),
+        ).fetchone()[0]
+        if not pending:
+            conn.execute(
+                f"CREATE TABLE {name} PARTITION OF {PARENT} FOR VALUES FROM ('{lo.isoformat()}') TO ('{hi.isoformat()}');"
+            )
+        else:
+            # Filas que ya cayeron en la partición por defecto: se mueven a la nueva
+            # tabla antes de adjuntarla (ATTACH exige que default no las contenga).
+            conn.execute(f"CREATE TABLE {name} (LIKE {PARENT} INCLUDING DEFAULTS INCLUDING CONSTRAINTS);")
+            conn.execute(
+                f"""
+                WITH moved AS (
+                    DELETE FROM {DEFAULT_PARTITION}
+                    WHERE created_at >= %s AND created_at < %s
+                    RETURNING *
+                )
+                INSERT INTO {name} SELECT * FROM moved;
+                """,
+                (lo, hi),
+            )
+            conn.execute(
+                f"ALTER TABLE {PARENT} ATTACH PARTITION {name} FOR VALUES FROM ('{lo.isoformat()}') TO ('{hi.isoformat()}');"
+            )
+    return name
+
+
+def ensure_partitions(
+    conn: psycopg.Connection,
+    interval: str = INTERVAL,
+    past: int = PAST,
+    premake: int = PREMAKE,
+    since: Optional[datetime] = None,
+) -> List[str]:
+    """Asegura particiones desde `since` (o `past` intervalos atrás) hasta `premake` adelante."""
+    if interval not in INTERVALS:
+        raise ValueError(f"intervalo no soportado: {interval}")
+    current = floor_bound(datetime.now(timezone.utc), interval)
+    lo = floor_bound(since, interval) if since else shift(current, interval, -past)
+    end = shift(current, interval, premake + 1)
+
+    existing = attached_partitions(conn)
+    covered = [b for b in (parse_partition_name(n) for n in existing) if b]
+    created = []
+    while lo < end:
+        hi = next_bound(lo, interval)
+        # No se solapan rangos si cambió el intervalo (p. ej. month -> day)
+        if not any(c_lo < hi and lo < c_hi for c_lo, c_hi in covered):
+            created.append(create_partition(conn, lo, interval))
+        lo = hi
+    return created
+
+
+def apply_retention(
+    conn: psycopg.Connection,
+    retention: int = RETENTION,
+    action: str = RETENTION_ACTION,
+    interval: str = INTERVAL,
+) -> List[str]:
+    """Separa o elimina particiones cuyo rango terminó antes del horizonte de retención."""
+    if retention <= 0:
+        return []
+    if action not in ("detach", "drop"):
+        raise ValueError(f"acción de retención no soportada: {action}")
+    horizon = shift(floor_bound(datetime.now(timezone.utc), interval), interval, -retention)
+    removed = []
+    for name in sorted(attached_partitions(conn)):
+        bounds = parse_partition_name(name)
+        if not bounds or bounds[1] > horizon:
+            continue
+        conn.execute(f"ALTER TABLE {PARENT} DETACH PARTITION {name};")
+        if action == "drop":
+            conn.execute(f"DROP TABLE {name};")
+        removed.append(name)
+    return removed
+
+
+def maintain(
+    conn: psycopg.Connection,
+    interval: str = INTERVAL,
+    past: int = PAST,
+    premake: int = PREMAKE,
+    retention: int = RETENTION,
+    action: str = RETENTION_ACTION,
+    since: Optional[datetime] = None,
+) -> Dict[str, List[str]]:
+    """Crea particiones y aplica retención bajo un advisory lock. Requiere autocommit."""
+    if not conn.execute("SELECT pg_try_advisory_lock(%s);", (_LOCK_KEY,)).fetchone()[0]:
+        return {"created": [], "removed": [], "skipped": ["mantenimiento en curso en otro proceso"]}
+    try:
+        created = ensure_partitions(conn, interval=interval, past=past, premake=premake, since=since)
+        removed = apply_retention(conn, retention=retention, action=action, interval=interval)
+    finally:
+        conn.execute("SELECT pg_advisory_unlock(%s);", (_LOCK_KEY,))
+    return {"created": created, "removed": removed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mantenimiento de particiones de registro_data")
+    parser.add_argument("--interval", choices=INTERVALS, default=INTERVAL)
+    parser.add_argument("--past", type=int, default=PAST)
+    parser.add_argument("--premake", type=int, default=PREMAKE)
+    parser.add_argument("--retention", type=int, default=RETENTION)
+    parser.add_argument("--action", choices=("detach", "drop"), default=RETENTION_ACTION)
+    args = parser.parse_args()
+
+    with psycopg.connect(os.environ["PG_CONN"], autocommit=True) as conn:
+        result = maintain(
+            conn,
+            interval=args.interval,
+            past=args.past,
+            premake=args.premake,
+            retention=args.retention,
+            action=args.action,
+        )
+    print(f"Particiones creadas: {result['created'] or '-'}")
+    print(f"Particiones retiradas: {result['removed'] or '-'}")
+
+
+if __name__ == "__main__":
+    main()
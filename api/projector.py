@@ -0,0 +1,325 @@
+"""
+Proyector events_raw -> Postgres para INGEST_MODE=raw.
+La API sólo escribe el evento crudo en Mongo; este proceso lo aplica a
+registro_data y sensor_state en lotes grandes (ingest.pg_write_events:
+COPY + upserts en una transacción) y guarda su avance en
+projector_checkpoint dentro de esa misma transacción, así que cada lote se
+aplica una sola vez. Tras una caída retoma desde el checkpoint y se pone al
+día a lotes llenos, sin pausas ni NOTIFY (los workers re-sincronizan la
+ocupación en su refresco periódico).
+
+Fuentes (PROJECTOR_SOURCE):
+- cursor: recorre events_raw en orden de _id desde el checkpoint. El _id lo
+  asigna la API al recibir el evento, así que es orden de inserción: un ts
+  atrasado del sensor o del gateway no importa. No lee los últimos
+  PROJECTOR_LAG_SEC (inserciones en vuelo). Funciona con un Mongo sin
+  réplica y con colecciones time-series. Si aun así algo se inserta detrás
+  del checkpoint (reloj de un host desfasado, inserción más lenta que el
+  margen), un recuento diferido de cada ventana lo suma a `behind`
+  (/ingest/stats) en lugar de perderlo en silencio; se recupera con --rebuild.
+- changestream: change stream de inserts con resume token (replica set,
+  p. ej. Atlas; no disponible para colecciones time-series). Lo anterior al
+  arranque se recorre con el cursor hasta un ObjectId de corte y lo
+  posterior llega por el stream.
+
+Sin checkpoint previo arranca después del último _id de events_raw: lo que ya
+estaba ahí lo escribió el modo sync (o seed_basics.py con su histórico) y ya
+está en Postgres. Es el mismo reloj que recorre el cursor; created_at es la
+hora del sensor y no sirve de corte. --init sólo crea ese checkpoint: se corre
+con la API todavía en sync, antes de pasarla a raw. --rebuild vacía registro_data,
+sensor_state, parking_session y los rollups y rehace todo desde events_raw.
+
+Uso:
+  export $(grep -v '^#' tools/.env | xargs)
+  python api/projector.py              # en continuo
+  python api/projector.py --once       # se pone al día y termina
+  python api/projector.py --init       # sólo el checkpoint inicial (antes de pasar la API a raw)
+  python api/projector.py --rebuild    # con la API en INGEST_MODE=raw
+Config:
+  PROJECTOR_SOURCE=cursor   # cursor | changestream
+  PROJECTOR_BATCH=5000      # eventos por transacción
+  PROJECTOR_LAG_SEC=2       # sólo cursor
+  PROJECTOR_AUDIT_SEC=60    # ventanas del recuento de eventos detrás del checkpoint (0 = sin recuento)
+  PROJECTOR_POLL_SEC=0.5
+"""
+import argparse
+import os
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+import certifi
+import psycopg
+from bson import ObjectId
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+from pymongo import ASCENDING, DESCENDING, MongoClient
+from pymongo.collection import Collection
+from pymongo.errors import OperationFailure
+
+import events_raw
+import ingest
+import partitions
+
+SOURCES = ("cursor", "changestream")
+CHECKPOINT = "registro"
+_CHECKPOINT_COLUMNS = ("last_ts", "last_id", "resume_token", "scan_before", "events", "failed", "behind")
+_HISTORY_LOST = 286  # ChangeStreamHistoryLost: el token ya salió del oplog
+
+# Un solo proyector a la vez
+_LOCK_KEY = 0x5350_0004
+
+
+class Projector:
+    def __init__(
+        self,
+        conn: psycopg.Connection,
+        col: Collection,
+        source: str = "cursor",
+        batch: int = 5000,
+        lag: float = 2.0,
+        poll: float = 0.5,
+        notify: bool = True,
+        dedup: bool = False,
+        name: str = CHECKPOINT,
+        audit: float = 60.0,
+    ):
+        if source not in SOURCES:
+            raise ValueError(f"fuente no soportada: {source}")
+        self.conn = conn
+        self.col = col
+        self.source = source
+        self.batch = batch
+        self.lag = lag
+        self.poll = poll
+        self.notify = notify
+        self.dedup = dedup
+        self.name = name
+        self.audit = audit
+        self._logged = 0.0
+        # Recuento diferido: (desde_id, hasta_id, docs leídos, cuándo contar)
+        self._window: Optional[Dict[str, Any]] = None
+        self._audits: deque = deque()
+
+    # ---- Checkpoint ----
+    def load(self) -> Optional[Dict[str, Any]]:
+        with self.conn.cursor(row_factory=dict_row) as cur:
+            cur.execute(
+                f"SELECT {', '.join(_CHECKPOINT_COLUMNS)} FROM projector_checkpoint WHERE name = %s;", (self.name,)
+            )
+            return cur.fetchone()
+
+    def _save(self, cp: Dict[str, Any]):
+        token = Jsonb(cp["resume_token"]) if cp["resume_token"] is not None else None
+        self.conn.execute(
+            f"""
+            INSERT INTO projector_checkpoint (name, {', '.join(_CHECKPOINT_COLUMNS)}, updated_at)
+            VALUES (%s, {', '.join(['%s'] * len(_CHECKPOINT_COLUMNS))}, now())
+            ON CONFLICT (name) DO UPDATE SET
+              {', '.join(f'{c} = EXCLUDED.{c}' for c in _CHECKPOINT_COLUMNS)}, updated_at = now();
+            """,
+            (self.name, cp["last_ts"], cp["last_id"], token, cp["scan_before"], cp["events"], cp["failed"],
+             cp["behind"]),
+        )
+
+    def _initial(self, after: Optional[ObjectId]) -> Dict[str, Any]:
+        cp = {"last_ts": after.generation_time if after else None, "last_id": str(after) if after else None,
+              "resume_token": None, "scan_before": None, "events": 0, "failed": 0, "behind": 0}
+        if self.source == "changestream":
+            # El stream arranca ahora; lo insertado antes del corte lo recorre el cursor
+            with self.col.watch([{"$match": {"operationType": "insert"}}]) as stream:
+                cp["resume_token"] = stream.resume_token
+            cutoff = datetime.now(timezone.utc).replace(microsecond=0) + timedelta(seconds=2)
+            cp["scan_before"] = str(ObjectId.from_datetime(cutoff))
+        with self.conn.transaction():
+            self._save(cp)
+        return cp
+
+    def reset(self) -> Dict[str, Any]:
+        """Vacía la proyección y deja el checkpoint al inicio de events_raw (--rebuild)."""
+        with self.conn.transaction():
+            self.conn.execute("TRUNCATE registro_data, sensor_state, parking_session, occupancy_rollup;")
+            self.conn.execute("UPDATE occupancy_rollup_state SET last_registro_id = 0, rolled_until = NULL, "
+                              "seen_id = NULL, wait_id = NULL, wait_xmax = NULL, snapshot = NULL;")
+        first = self.col.find_one({}, sort=[("ts", ASCENDING)], projection={"ts": 1})
+        if first:
+            partitions.ensure_partitions(self.conn, since=first["ts"])
+        return self._initial(None)
+
+    # ---- Aplicación de lotes ----
+    def _apply(self, docs: List[Dict[str, Any]], cp: Dict[str, Any], live: bool):
+        rows, invalid = [], 0
+        for doc in docs:
+            doc = events_raw.flatten(doc)
+            if not isinstance(doc.get("ts"), datetime) or any(doc.get(f) is None for f in events_raw.META_FIELDS):
+                invalid += 1
+                continue
+            rows.append({f: doc[f] for f in ("sensor_id", "estacionamiento_id", "estado", "ts")})
+        if self._window is not None:
+            self._window["seen"] += len(docs)
+        with self.conn.transaction():
+            errors, _ = ingest.pg_write_events(self.conn, rows, notify=self.notify and live, dedup=self.dedup)
+            cp["events"] += len(rows) - len(errors)
+            cp["failed"] += len(errors) + invalid
+            self._save(cp)
+        for err in list(errors.values())[:3]:
+            print(f"[PROJECTOR] evento descartado: {err}")
+        self._log(cp, len(docs))
+
+    def _log(self, cp: Dict[str, Any], n: int):
+        now = time.monotonic()
+        if now - self._logged < 5 and n >= self.batch:
+            return  # puesta al día: una línea cada 5 s
+        self._logged = now
+        lag = ""
+        if cp["last_ts"] is not None:
+            lag = f" lag={(datetime.now(timezone.utc) - cp['last_ts']).total_seconds():.1f}s"
+        print(f"[PROJECTOR] +{n} aplicados={cp['events']} fallidos={cp['failed']}{lag}")
+
+    # ---- Fuente cursor ----
+    def _cursor_batch(self, cp: Dict[str, Any], before: ObjectId) -> List[Dict[str, Any]]:
+        # Orden de inserción (_id asignado por la API); last_ts es la hora de inserción del último
+        bounds: Dict[str, Any] = {"$lt": before}
+        if cp["last_id"]:
+            bounds["$gt"] = ObjectId(cp["last_id"])
+        docs = list(self.col.find({"_id": bounds}, sort=[("_id", ASCENDING)], limit=self.batch))
+        if docs:
+            cp["last_id"] = str(docs[-1]["_id"])
+            cp["last_ts"] = docs[-1]["_id"].generation_time
+        return docs
+
+    def _follow_cursor(self, cp: Dict[str, Any], once: bool):
+        while True:
+            self._check_behind(cp)
+            docs = self._cursor_batch(cp, ObjectId.from_datetime(datetime.now(timezone.utc) - timedelta(seconds=self.lag)))
+            if docs:
+                self._apply(docs, cp, live=len(docs) < self.batch)
+                continue
+            if once:
+                return
+            time.sleep(self.poll)
+
+    def _check_behind(self, cp: Dict[str, Any]):
+        # Cada `audit` s se cierra una ventana (desde_id, hasta_id] con los docs leídos en
+        # ella; pasado otro `audit` se cuentan en Mongo. La diferencia son inserciones que
+        # llegaron detrás del checkpoint y que el cursor ya no va a leer.
+        if not self.audit:
+            return
+        now = time.monotonic()
+        if self._window is None:
+            self._window = {"start": cp["last_id"], "seen": 0, "opened": now}
+        elif now - self._window["opened"] >= self.audit and cp["last_id"] != self._window["start"]:
+            w = self._window
+            self._audits.append((w["start"], cp["last_id"], w["seen"], now + self.audit))
+            self._window = {"start": cp["last_id"], "seen": 0, "opened": now}
+        while self._audits and self._audits[0][3] <= now:
+            start, end, seen, _ = self._audits.popleft()
+            bounds: Dict[str, Any] = {"$lte": ObjectId(end)}
+            if start:
+                bounds["$gt"] = ObjectId(start)
+            missed = self.col.count_documents({"_id": bounds}) - seen
+            if missed > 0:
+                cp["behind"] += missed
+                with self.conn.transaction():
+                    self._save(cp)
+                print(f"[WARN] {missed} eventos insertados detrás del checkpoint entre {start} y {end} "
+                      f"(behind={cp['behind']}; recuperar con --rebuild)")
+
+    # ---- Fuente changestream ----
+    def _follow_stream(self, cp: Dict[str, Any], once: bool):
+        if cp["scan_before"]:
+            while docs := self._cursor_batch(cp, ObjectId(cp["scan_before"])):
+                self._apply(docs, cp, live=False)
+
+        match: Dict[str, Any] = {"operationType": "insert"}
+        if cp["scan_before"]:
+            match["fullDocument._id"] = {"$gte": ObjectId(cp["scan_before"])}
+        saved_at = time.monotonic()
+        try:
+            with self.col.watch([{"$match": match}], resume_after=cp["resume_token"], batch_size=self.batch,
+                                max_await_time_ms=int(self.poll * 1000)) as stream:
+                while True:
+                    docs = []
+                    while len(docs) < self.batch:
+                        change = stream.try_next()
+                        if change is None:
+                            break
+                        docs.append(change["fullDocument"])
+                    cp["resume_token"] = stream.resume_token
+                    if docs:
+                        cp["last_ts"] = docs[-1]["_id"].generation_time
+                        self._apply(docs, cp, live=len(docs) < self.batch)
+                        saved_at = time.monotonic()
+                        continue
+                    if cp["scan_before"]:
+                        # Stream al día: lo anterior al corte ya pasó; se reabre sin el filtro
+                        cp["scan_before"] = None
+                        with self.conn.transaction():
+                            self._save(cp)
+                        return self._follow_stream(cp, once)
+                    if once:
+                        return
+                    if time.monotonic() - saved_at > 30:
+                        # El token avanza aunque no haya inserts: evita retomar desde muy atrás en el oplog
+                        with self.conn.transaction():
+                            self._save(cp)
+                        saved_at = time.monotonic()
+        except OperationFailure as e:
+            if e.code == _HISTORY_LOST:
+                raise SystemExit("el resume token ya no está en el oplog: rehacer con --rebuild") from e
+            raise
+
+    def start(self) -> Dict[str, Any]:
+        """Checkpoint guardado o, la primera vez, uno tras el último _id de events_raw (--init)."""
+        cp = self.load()
+        if cp is None:
+            last = self.col.find_one({}, sort=[("_id", DESCENDING)], projection={"_id": 1})
+            cp = self._initial(last["_id"] if last else None)
+        return cp
+
+    def run(self, once: bool = False, rebuild: bool = False):
+        cp = self.reset() if rebuild else self.start()
+        if self.source == "cursor":
+            self._follow_cursor(cp, once)
+        else:
+            self._follow_stream(cp, once)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Proyección de events_raw a registro_data/sensor_state")
+    parser.add_argument("--source", choices=SOURCES, default=os.environ.get("PROJECTOR_SOURCE", "cursor"))
+    parser.add_argument("--batch", type=int, default=int(os.environ.get("PROJECTOR_BATCH", "5000")))
+    parser.add_argument("--lag", type=float, default=float(os.environ.get("PROJECTOR_LAG_SEC", "2")))
+    parser.add_argument("--poll", type=float, default=float(os.environ.get("PROJECTOR_POLL_SEC", "0.5")))
+    parser.add_argument("--audit", type=float, default=float(os.environ.get("PROJECTOR_AUDIT_SEC", "60")))
+    parser.add_argument("--once", action="store_true", help="se pone al día y termina")
+    parser.add_argument("--init", action="store_true", help="sólo crea el checkpoint inicial y termina")
+    parser.add_argument("--rebuild", action="store_true", help="vacía la proyección y la rehace desde events_raw")
+    args = parser.parse_args()
+
+    layout = os.environ.get("EVENTS_RAW_LAYOUT", "plain").lower()
+    if args.source == "changestream" and layout == "timeseries":
+        parser.error("las colecciones time-series no admiten change streams: usar --source cursor")
+    if args.rebuild and os.environ.get("INGEST_MODE", "sync").lower() != "raw":
+        print("[WARN] --rebuild con la API fuera de INGEST_MODE=raw: lo que escriba la API puede quedar duplicado")
+
+    mongo = MongoClient(os.environ["MONGODB_URI"], tlsCAFile=certifi.where(), tz_aware=True)
+    col = mongo["smartpark"][os.environ.get("EVENTS_RAW_COLLECTION", "events_raw")]
+    with psycopg.connect(os.environ["PG_CONN"], autocommit=True) as conn:
+        if not conn.execute("SELECT pg_try_advisory_lock(%s);", (_LOCK_KEY,)).fetchone()[0]:
+            raise SystemExit("ya hay un proyector en ejecución")
+        projector = Projector(
+            conn, col, source=args.source, batch=args.batch, lag=args.lag, poll=args.poll, audit=args.audit,
+            notify=os.environ.get("STREAM_NOTIFY", "1") != "0",
+            dedup=os.environ.get("REGISTRO_MODE", "all").lower() == "transitions",
+        )
+        if args.init:
+            cp = projector.start()
+            print(f"Checkpoint {projector.name}: después de _id {cp['last_id'] or '(events_raw vacía)'}")
+            return
+        projector.run(once=args.once, rebuild=args.rebuild)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Caché de respuestas para rutas de lectura (read-through) con ETag/304.
+Las entradas se indexan por ruta + query args normalizados, caducan por
+TTL y se invalidan con contadores de versión por campus que incrementa la
+ingesta: una entrada sólo es válida si la versión de su campus (o la
+global, para respuestas que abarcan todos) no cambió desde que se llenó.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Callable, Dict, Optional, Tuple
+
+from flask import Response, make_response, request
+
+
+class ResponseCache:
+    def __init__(self, ttl: float = 5.0, max_entries: int = 512, max_age: int = 0):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[tuple, Tuple[tuple, float, bytes, str, str]]" = OrderedDict()
+        # Un solo llenado por clave ante ráfagas de misses (locks por franjas)
+        self._fill_locks = [threading.Lock() for _ in range(32)]
+        self._epoch = 0
+        self._all = 0
+        self._campus: Dict[str, int] = {}
+        self.stats = {"hits": 0, "misses": 0, "not_modified": 0}
+
+    # ---- Versiones ----
+    def bump(self, campus: Optional[str] = None):
+        """Marca cambios en `campus` (y en las vistas globales); sin campus invalida todo."""
+        with self._lock:
+            if campus is None:
+                self._epoch += 1
+                return
+            self._campus[campus] = self._campus.get(campus, 0) + 1
+            self._all += 1
+
+    def token(self, campus: Optional[str]) -> tuple:
+        return (self._epoch, self._all if campus is None else self._campus.get(campus, 0))
+
+    # ---- Entradas ----
+    def get(self, key: tuple, campus: Optional[str]):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            token, expires, _, _, _ = entry
+            if token != self.token(campus) or expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: tuple, token: tuple, body: bytes, etag: str, mimetype: str):
+        with self._lock:
+            if token != self.token(key[1]):
+                return  # hubo ingesta mientras se calculaba: no guardar algo ya viejo
+            self._entries[key] = (token, time.monotonic() + self.ttl, body, etag, mimetype)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def count(self, stat: str):
+        """Suma 1 a hits/misses/not_modified (bajo el lock, como versiones y entradas)."""
+        with self._lock:
+            self.stats[stat] += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self.stats, "entries": len(self._entries), "ttl": self.ttl}
+
+    # ---- Respuestas ----
+    @staticmethod
+    def etag_of(body: bytes) -> str:
+        return hashlib.blake2b(body, digest_size=12).hexdigest()
+
+    def validators(self, etag: str) -> Dict[str, str]:
+        """Headers de revalidación (compartidos con las rutas async de asgi.py)."""
+        return {
+            "ETag": f'"{etag}"',
+            "Cache-Control": f"public, max-age={self.max_age}" if self.max_age > 0 else "no-cache",
+        }
+
+    def _respond(self, body: bytes, etag: str, mimetype: str) -> Response:
+        if etag in request.if_none_match:
+            self.count("not_modified")
+            resp = Response(status=304)
+        else:
+            resp = Response(body, mimetype=mimetype)
+        resp.headers.update(self.validators(etag))
+        return resp
+
+    def cached(self, scope: Callable[[], Optional[str]] = lambda: None):
+        """
+        Decorador de rutas GET. `scope` devuelve el campus del que depende la
+        respuesta (None = todos). Sólo se guardan respuestas 200.
+        """
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                campus = scope()
+                key = (request.path, campus, tuple(sorted(request.args.items(multi=True))))
+                entry = self.get(key, campus) if self.ttl > 0 else None
+                if entry is None and self.ttl > 0:
+                    with self._fill_locks[hash(key) % len(self._fill_locks)]:
+                        entry = self.get(key, campus)
+                        if entry is None:
+                            return self._fill(key, campus, view, args, kwargs)
+                if entry is not None:
+                    self.count("hits")
+                    return self._respond(entry[2], entry[3], entry[4])
+                return self._fill(key, campus, view, args, kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def _fill(self, key, campus, view, args, kwargs):
+        with self._lock:
+            self.stats["misses"] += 1
+            token = self.token(campus)
+        resp = make_response(view(*args, **kwargs))
+        if resp.status_code != 200:
+            return resp
+        body = resp.get_data()
+        etag = self.etag_of(body)
+        if self.ttl > 0:
+            self.put(key, token, body, etag, resp.mimetype)
+        return self._respond(body, etag, resp.mimetype)
@@ -0,0 +1,283 @@
+"""
+Rollups de ocupación (occupancy_rollup): por hora y por día, para cada
+campus y estacionamiento, con ocupación ponderada en el tiempo, nº de
+eventos, cambios de estado y pico de ocupados.
+
+El refresco es incremental: sólo recalcula los buckets de los campus con
+filas nuevas en registro_data (marca de agua por id) más las horas abiertas
+desde la última pasada, en las que el estado vigente sigue sumando tiempo.
+La marca de agua sólo pasa un id cuando ya terminaron todas las
+transacciones que pudieron tomar ids hasta él: cada pasada anota el último
+id entregado por la secuencia y, en la siguiente, el xmax del snapshot; se
+adopta cuando el xmin de una pasada posterior lo supera. Por encima de ella
+sólo cuentan las filas confirmadas después del snapshot de la pasada
+anterior, así que un COPY largo que confirma después de filas con ids
+mayores se lee igual y lo ya agregado no se recalcula.
+
+Uso: export $(grep -v '^#' tools/.env | xargs) ; python api/rollups.py
+Config:
+  ROLLUP_TZ=America/Lima      # zona horaria de los buckets diarios
+  ROLLUP_WINDOW_DAYS=7        # tamaño de cada ventana de recálculo
+"""
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+import psycopg
+
+ROLLUP_TZ = os.environ.get("ROLLUP_TZ", "America/Lima")
+WINDOW = timedelta(days=int(os.environ.get("ROLLUP_WINDOW_DAYS", "7")))
+
+SCOPES = ("campus", "estacionamiento")
+BUCKETS = {"1h": timedelta(hours=1), "1d": timedelta(days=1)}
+
+_LOCK_KEY = 0x5350_0002
+
+STATE_SQL = """
+SELECT last_registro_id, rolled_until, seen_id, wait_id, wait_xmax, snapshot,
+       pg_current_snapshot(),
+       COALESCE(pg_sequence_last_value(pg_get_serial_sequence('registro_data', 'id')::regclass), 0)
+FROM occupancy_rollup_state WHERE id;
+"""
+
+# Campus con filas nuevas y la hora más antigua afectada. Entre los ids no
+# firmes, las que ya eran visibles en el snapshot de la pasada anterior ya se
+# agregaron: sólo cuentan las confirmadas después (xmin >= xmax o en xip de
+# ese snapshot; xmin es de 32 bits, de ahí el módulo y la comparación por age).
+DIRTY_SQL = """
+WITH prev AS (
+  SELECT (pg_snapshot_xmax(s)::text::bigint %% 4294967296)::text::xid AS xmax,
+         ARRAY(SELECT (x::text::bigint %% 4294967296)::text::xid FROM pg_snapshot_xip(s) x) AS xip
+  FROM (SELECT %(snapshot)s::pg_snapshot AS s) p
+)
+SELECT c.codigo, MIN(r.created_at), COUNT(*)
+FROM registro_data r
+JOIN estacionamiento e ON e.id = r.estacionamiento_id
+JOIN campus c ON c.id = e.campus_id
+CROSS JOIN prev
+WHERE r.id > %(last_id)s
+  AND (prev.xmax IS NULL OR age(r.xmin) <= age(prev.xmax) OR r.xmin = ANY(prev.xip))
+GROUP BY c.codigo;
+"""
+
+# Buckets horarios de un campus en [lo, hi). Cada sensor se reconstruye como
+# tramos [desde, hasta) de estado constante, arrancando con su último estado
+# previo a la ventana; el pico sale de la suma acumulada de +1/-1 ocupados.
+HOURLY_SQL = """
+WITH lots AS (
+  SELECT e.id AS estacionamiento_id
+  FROM estacionamiento e JOIN campus c ON c.id = e.campus_id
+  WHERE c.codigo = %(campus)s::text
+),
+eventos AS (
+  SELECT s.id AS sensor_id, s.estacionamiento_id, p.estado, %(lo)s::timestamptz AS at, 0 AS id, FALSE AS en_ventana
+  FROM sensor s
+  JOIN lots l ON l.estacionamiento_id = s.estacionamiento_id
+  CROSS JOIN LATERAL (
+    SELECT r.estado FROM registro_data r
+    WHERE r.sensor_id = s.id AND r.created_at < %(lo)s
+    ORDER BY r.created_at DESC, r.id DESC
+    LIMIT 1
+  ) p
+  UNION ALL
+  SELECT r.sensor_id, r.estacionamiento_id, r.estado, r.created_at, r.id, TRUE
+  FROM registro_data r
+  JOIN lots l ON l.estacionamiento_id = r.estacionamiento_id
+  WHERE r.created_at >= %(lo)s AND r.created_at < %(hi)s
+),
+tramos AS (
+  SELECT sensor_id, estacionamiento_id, estado, en_ventana, at AS desde,
+         COALESCE(LEAD(at) OVER w, GREATEST(at, LEAST(now(), %(hi)s::timestamptz))) AS hasta,
+         LAG(estado) OVER w AS estado_prev
+  FROM eventos
+  WINDOW w AS (PARTITION BY sensor_id ORDER BY at, id)
+),
+buckets AS (
+  SELECT b AS bucket_start, b + interval '1 hour' AS bucket_end
+  FROM generate_series(%(lo)s::timestamptz, %(hi)s::timestamptz - interval '1 hour', interval '1 hour') b
+),
+cobertura AS (
+  SELECT t.estacionamiento_id, t.sensor_id, t.estado, b.bucket_start,
+         t.desde <= b.bucket_start AS cubre_inicio,
+         EXTRACT(EPOCH FROM LEAST(t.hasta, b.bucket_end) - GREATEST(t.desde, b.bucket_start)) AS seg
+  FROM tramos t
+  JOIN buckets b ON t.desde < b.bucket_end AND t.hasta > b.bucket_start
+),
+niveles AS (
+  SELECT estacionamiento_id, desde AS at,
+         SUM(d) OVER (PARTITION BY estacionamiento_id ORDER BY desde, d ROWS UNBOUNDED PRECEDING) AS nivel_est,
+         SUM(d) OVER (ORDER BY desde, d ROWS UNBOUNDED PRECEDING) AS nivel_campus
+  FROM (
+    SELECT estacionamiento_id, desde,
+           (estado = 'ocupado')::int - COALESCE((estado_prev = 'ocupado')::int, 0) AS d
+    FROM tramos
+  ) x
+),
+agg AS (
+  SELECT 'estacionamiento' AS scope, estacionamiento_id AS scope_id, bucket_start,
+         COUNT(DISTINCT sensor_id) AS sensores,
+         SUM(seg) AS seg_obs,
+         COALESCE(SUM(seg) FILTER (WHERE estado = 'ocupado'), 0) AS seg_ocup,
+         COUNT(DISTINCT sensor_id) FILTER (WHERE estado = 'ocupado' AND cubre_inicio) AS ocupados_inicio
+  FROM cobertura GROUP BY estacionamiento_id, bucket_start
+  UNION ALL
+  SELECT 'campus', %(campus)s::text, bucket_start,
+         COUNT(DISTINCT sensor_id),
+         SUM(seg),
+         COALESCE(SUM(seg) FILTER (WHERE estado = 'ocupado'), 0),
+         COUNT(DISTINCT sensor_id) FILTER (WHERE estado = 'ocupado' AND cubre_inicio)
+  FROM cobertura GROUP BY bucket_start
+),
+ev AS (
+  SELECT 'estacionamiento' AS scope, estacionamiento_id AS scope_id, date_trunc('hour', desde, 'UTC') AS bucket_start,
+         COUNT(*) AS eventos,
+         COUNT(*) FILTER (WHERE estado <> estado_prev) AS cambios
+  FROM tramos WHERE en_ventana GROUP BY estacionamiento_id, date_trunc('hour', desde, 'UTC')
+  UNION ALL
+  SELECT 'campus', %(campus)s::text, date_trunc('hour', desde, 'UTC'),
+         COUNT(*),
+         COUNT(*) FILTER (WHERE estado <> estado_prev)
+  FROM tramos WHERE en_ventana GROUP BY date_trunc('hour', desde, 'UTC')
+),
+picos AS (
+  SELECT 'estacionamiento' AS scope, estacionamiento_id AS scope_id, date_trunc('hour', at, 'UTC') AS bucket_start,
+         MAX(nivel_est) AS pico
+  FROM niveles GROUP BY estacionamiento_id, date_trunc('hour', at, 'UTC')
+  UNION ALL
+  SELECT 'campus', %(campus)s::text, date_trunc('hour', at, 'UTC'), MAX(nivel_campus)
+  FROM niveles GROUP BY date_trunc('hour', at, 'UTC')
+)
+INSERT INTO occupancy_rollup (
+  scope, scope_id, bucket, bucket_start, sensores, segundos_observados, segundos_ocupados,
+  eventos, cambios_estado, pico_ocupados
+)
+SELECT a.scope, a.scope_id, '1h', a.bucket_start, a.sensores, a.seg_obs, a.seg_ocup,
+       COALESCE(ev.eventos, 0), COALESCE(ev.cambios, 0),
+       GREATEST(a.ocupados_inicio, COALESCE(p.pico, 0))
+FROM agg a
+LEFT JOIN ev USING (scope, scope_id, bucket_start)
+LEFT JOIN picos p USING (scope, scope_id, bucket_start)
+ON CONFLICT (scope, scope_id, bucket, bucket_start) DO UPDATE SET
+  sensores = EXCLUDED.sensores,
+  segundos_observados = EXCLUDED.segundos_observados,
+  segundos_ocupados = EXCLUDED.segundos_ocupados,
+  eventos = EXCLUDED.eventos,
+  cambios_estado = EXCLUDED.cambios_estado,
+  pico_ocupados = EXCLUDED.pico_ocupados,
+  updated_at = now();
+"""
+
+# Buckets diarios (en ROLLUP_TZ) recompuestos a partir de los horarios.
+DAILY_SQL = """
+INSERT INTO occupancy_rollup (
+  scope, scope_id, bucket, bucket_start, sensores, segundos_observados, segundos_ocupados,
+  eventos, cambios_estado, pico_ocupados
+)
+SELECT r.scope, r.scope_id, '1d', date_trunc('day', r.bucket_start, %(tz)s),
+       MAX(r.sensores), SUM(r.segundos_observados), SUM(r.segundos_ocupados),
+       SUM(r.eventos), SUM(r.cambios_estado), MAX(r.pico_ocupados)
+FROM occupancy_rollup r
+WHERE r.bucket = '1h'
+  AND r.bucket_start >= date_trunc('day', %(lo)s::timestamptz, %(tz)s)
+  AND r.bucket_start < date_trunc('day', %(hi)s::timestamptz - interval '1 second', %(tz)s) + interval '1 day'
+  AND (
+    (r.scope = 'campus' AND r.scope_id = %(campus)s)
+    OR (r.scope = 'estacionamiento' AND r.scope_id IN (
+      SELECT e.id FROM estacionamiento e JOIN campus c ON c.id = e.campus_id WHERE c.codigo = %(campus)s
+    ))
+  )
+GROUP BY r.scope, r.scope_id, date_trunc('day', r.bucket_start, %(tz)s)
+ON CONFLICT (scope, scope_id, bucket, bucket_start) DO UPDATE SET
+  sensores = EXCLUDED.sensores,
+  segundos_observados = EXCLUDED.segundos_observados,
+  segundos_ocupados = EXCLUDED.segundos_ocupados,
+  eventos = EXCLUDED.eventos,
+  cambios_estado = EXCLUDED.cambios_estado,
+  pico_ocupados = EXCLUDED.pico_ocupados,
+  updated_at = now();
+"""
+
+HISTORY_SQL = """
+SELECT scope_id, bucket_start, sensores, segundos_observados, segundos_ocupados,
+       eventos, cambios_estado, pico_ocupados
+FROM occupancy_rollup
+WHERE scope = %s AND bucket = %s AND bucket_start >= %s AND bucket_start < %s {id_filter}
+ORDER BY scope_id, bucket_start
+LIMIT %s;
+"""
+
+
+def _floor_hour(ts: datetime) -> datetime:
+    ts = ts.astimezone(timezone.utc)
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def refresh_campus(conn: psycopg.Connection, campus: str, lo: datetime, hi: datetime):
+    """Recalcula buckets horarios y diarios de un campus en [lo, hi), por ventanas."""
+    start = lo
+    while start < hi:
+        end = min(start + WINDOW, hi)
+        with conn.transaction():
+            conn.execute(HOURLY_SQL, {"campus": campus, "lo": start, "hi": end})
+        start = end
+    with conn.transaction():
+        conn.execute(DAILY_SQL, {"campus": campus, "lo": lo, "hi": hi, "tz": ROLLUP_TZ})
+
+
+def refresh(conn: psycopg.Connection, now: Optional[datetime] = None) -> Dict[str, object]:
+    """Refresco incremental bajo advisory lock. Requiere autocommit."""
+    if not conn.execute("SELECT pg_try_advisory_lock(%s);", (_LOCK_KEY,)).fetchone()[0]:
+        return {"skipped": True, "campus": []}
+    try:
+        last_id, rolled_until, seen_id, wait_id, wait_xmax, snapshot, current, seq_id = (
+            conn.execute(STATE_SQL).fetchone()
+        )
+        dirty = conn.execute(DIRTY_SQL, {"snapshot": snapshot, "last_id": last_id}).fetchall()
+
+        # Ids firmes: wait_id (último id entregado dos pasadas atrás) se adopta cuando
+        # terminaron las transacciones en curso al tomar wait_xmax (una pasada después).
+        xmin, xmax = (int(x) for x in current.split(":")[:2])
+        if wait_xmax is not None and xmin >= int(wait_xmax):
+            last_id, wait_id, wait_xmax = max(last_id, wait_id), None, None
+        if wait_xmax is None and seen_id is not None:
+            wait_id, wait_xmax = seen_id, xmax
+
+        current_hour = _floor_hour(now or datetime.now(timezone.utc))
+        hi = current_hour + timedelta(hours=1)
+        since: Dict[str, datetime] = {row[0]: _floor_hour(row[1]) for row in dirty}
+        if rolled_until:
+            # Las horas abiertas desde la última pasada siguen acumulando tiempo
+            for (codigo,) in conn.execute("SELECT codigo FROM campus;").fetchall():
+                since[codigo] = min(since.get(codigo, rolled_until), rolled_until)
+
+        refreshed: List[str] = []
+        for campus, lo in sorted(since.items()):
+            if lo < hi:
+                refresh_campus(conn, campus, lo, hi)
+                refreshed.append(campus)
+
+        conn.execute(
+            """
+            UPDATE occupancy_rollup_state SET last_registro_id = %s, rolled_until = %s, seen_id = %s,
+                                              wait_id = %s, wait_xmax = %s, snapshot = %s, updated_at = now()
+            WHERE id;
+            """,
+            (last_id, current_hour, seq_id, wait_id, wait_xmax and str(wait_xmax), current),
+        )
+    finally:
+        conn.execute("SELECT pg_advisory_unlock(%s);", (_LOCK_KEY,))
+    return {"skipped": False, "campus": refreshed, "last_registro_id": last_id,
+            "filas": sum(row[2] for row in dirty)}
+
+
+def main():
+    with psycopg.connect(os.environ["PG_CONN"], autocommit=True) as conn:
+        result = refresh(conn)
+    if result["skipped"]:
+        print("Refresco en curso en otro proceso; nada que hacer.")
+    else:
+        print(f"Rollups actualizados para: {', '.join(result['campus']) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
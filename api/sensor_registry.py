@@ -0,0 +1,97 @@
+"""
+Registro de sensores en memoria para validar la ingesta antes de escribir.
+Se construye desde la tabla sensor (+ sensors_meta en Mongo) y se refresca
+de forma incremental por modified_at/created_at; las consultas son O(1).
+"""
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+
+class SensorRegistry:
+    def __init__(self, reject_states: Iterable[str] = ("inactivo", "baja", "retirado")):
+        self._lock = threading.Lock()
+        # sensor_id -> (estacionamiento_id, estado_funcionamiento, metadata)
+        self._sensors: Dict[int, Tuple[str, str, Dict[str, Any]]] = {}
+        self._extra: Dict[int, Dict[str, Any]] = {}
+        self.reject_states = frozenset(s.strip().lower() for s in reject_states if s.strip())
+        self.watermark: Optional[datetime] = None
+        self.warmed_at: Optional[datetime] = None
+
+    @property
+    def warmed(self) -> bool:
+        return self.warmed_at is not None
+
+    def __len__(self) -> int:
+        return len(self._sensors)
+
+    # ---- Carga ----
+    def load(self, rows: Iterable[tuple], extra: Optional[Iterable[Dict[str, Any]]] = None):
+        """
+        rows: (sensor_id, estacionamiento_id, estado_funcionamiento, campus, tipo, changed_at)
+        extra: documentos de sensors_meta ({sensor_id, ...}); None conserva los actuales.
+        Carga completa: reemplaza todo (también elimina sensores borrados).
+        """
+        new_extra = self._index_extra(extra) if extra is not None else dict(self._extra)
+        new_sensors, watermark = {}, None
+        for row in rows:
+            new_sensors[row[0]] = self._entry(row, new_extra)
+            if row[5] and (watermark is None or row[5] > watermark):
+                watermark = row[5]
+        with self._lock:
+            self._sensors = new_sensors
+            self._extra = new_extra
+            self.watermark = watermark
+            self.warmed_at = datetime.now(timezone.utc)
+
+    def upsert(self, rows: Iterable[tuple], extra: Optional[Iterable[Dict[str, Any]]] = None) -> int:
+        """Aplica filas nuevas/modificadas (mismo formato que load). Devuelve cuántas."""
+        count = 0
+        with self._lock:
+            if extra:
+                changed = self._index_extra(extra)
+                self._extra.update(changed)
+                for sensor_id in changed:
+                    if sensor_id in self._sensors:
+                        est_id, estado, meta = self._sensors[sensor_id]
+                        self._sensors[sensor_id] = (est_id, estado, {**meta, **self._extra[sensor_id]})
+            for row in rows:
+                self._sensors[row[0]] = self._entry(row, self._extra)
+                if row[5] and (self.watermark is None or row[5] > self.watermark):
+                    self.watermark = row[5]
+                count += 1
+        return count
+
+    # ---- Consulta ----
+    def check(self, sensor_id: int, est_id: str) -> Optional[str]:
+        """Devuelve el motivo de rechazo o None si el evento es aceptable."""
+        entry = self._sensors.get(sensor_id)
+        if entry is None:
+            return f"sensor_id {sensor_id} no registrado"
+        if entry[0] != est_id:
+            return f"sensor_id {sensor_id} pertenece a {entry[0]}, no a {est_id}"
+        if entry[1].lower() in self.reject_states:
+            return f"sensor_id {sensor_id} no operativo ({entry[1]})"
+        return None
+
+    def known(self, sensor_id: int) -> bool:
+        return sensor_id in self._sensors
+
+    def meta(self, sensor_id: int) -> Dict[str, Any]:
+        entry = self._sensors.get(sensor_id)
+        return entry[2] if entry else {}
+
+    # ---- Internos ----
+    @staticmethod
+    def _index_extra(docs: Iterable[Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+        out = {}
+        for doc in docs:
+            if doc.get("sensor_id") is None:
+                continue
+            out[int(doc["sensor_id"])] = {k: v for k, v in doc.items() if k not in ("_id", "sensor_id", "updated_at")}
+        return out
+
+    @staticmethod
+    def _entry(row: tuple, extra: Dict[int, Dict[str, Any]]) -> Tuple[str, str, Dict[str, Any]]:
+        sensor_id, est_id, estado, campus, tipo, _ = row
+        return est_id, estado, {**extra.get(sensor_id, {}), "campus": campus, "tipo": tipo}
@@ -0,0 +1,151 @@
+"""
+Sesiones de estacionamiento (parking_session): tramos de estado constante por
+sensor con su duración, y tiempo_libre/tiempo_ocupado en registro_data.
+La ingesta las mantiene al día transición a transición (ingest.SESSION_SQL);
+backfill() reconstruye las del histórico existente por tramos de sensores:
+cada tramo borra sus sesiones y las recalcula con un INSERT ... SELECT con
+funciones de ventana, en una transacción que antes bloquea (NOWAIT, con
+reintentos) las filas de sensor_state del tramo para no cruzarse con la
+ingesta. Es idempotente y reanudable (--from-sensor). Sólo ve el histórico
+que sigue en registro_data: lo retirado por retención (partitions.py) no se
+reconstruye.
+
+Uso:
+  export $(grep -v '^#' tools/.env | xargs)
+  python api/sessions.py                          # todo el histórico
+  python api/sessions.py --from-sensor 500 --chunk 100
+Config:
+  SESSIONS_CHUNK_SENSORS=200    # sensores por transacción
+"""
+import argparse
+import os
+import time
+from typing import Any, Callable, Dict, Optional
+
+import psycopg
+
+CHUNK_SENSORS = int(os.environ.get("SESSIONS_CHUNK_SENSORS", "200"))
+LOCK_RETRIES = 50
+LOCK_RETRY_SEC = 0.2
+
+# Un solo backfill a la vez
+_LOCK_KEY = 0x5350_0005
+
+LOCK_SQL = """
+SELECT 1 FROM sensor_state WHERE sensor_id >= %(lo)s AND sensor_id < %(hi)s ORDER BY sensor_id FOR UPDATE NOWAIT;
+"""
+
+DELETE_SQL = "DELETE FROM parking_session WHERE sensor_id >= %(lo)s AND sensor_id < %(hi)s;"
+
+# Cada cambio de estado (o primer evento) abre una sesión que termina en el
+# siguiente cambio; la última queda abierta. Con dos cambios en el mismo ts
+# el primero dura 0 y se descarta, como en la ingesta.
+BACKFILL_SQL = """
+WITH ev AS (
+  SELECT sensor_id, estacionamiento_id, estado, created_at, id,
+         LAG(estado) OVER (PARTITION BY sensor_id ORDER BY created_at, id) AS estado_prev
+  FROM registro_data
+  WHERE sensor_id >= %(lo)s AND sensor_id < %(hi)s
+),
+cambios AS (
+  SELECT sensor_id, estacionamiento_id, estado, created_at AS started_at,
+         LEAD(created_at) OVER (PARTITION BY sensor_id ORDER BY created_at, id) AS ended_at
+  FROM ev
+  WHERE estado_prev IS DISTINCT FROM estado
+)
+INSERT INTO parking_session (sensor_id, estacionamiento_id, estado, started_at, ended_at)
+SELECT sensor_id, estacionamiento_id, estado, started_at, ended_at
+FROM cambios
+WHERE ended_at IS DISTINCT FROM started_at;
+"""
+
+# Duración en la fila que abrió cada sesión cerrada; no reescribe las que ya la tienen
+DURATIONS_SQL = """
+UPDATE registro_data r SET
+  tiempo_libre = CASE WHEN p.estado = 'libre' THEN p.ended_at - p.started_at END,
+  tiempo_ocupado = CASE WHEN p.estado = 'ocupado' THEN p.ended_at - p.started_at END
+FROM parking_session p
+WHERE p.sensor_id >= %(lo)s AND p.sensor_id < %(hi)s AND p.ended_at IS NOT NULL
+  AND r.sensor_id = p.sensor_id AND r.created_at = p.started_at AND r.estado = p.estado
+  AND (r.tiempo_libre, r.tiempo_ocupado) IS DISTINCT FROM (
+    CASE WHEN p.estado = 'libre' THEN p.ended_at - p.started_at END,
+    CASE WHEN p.estado = 'ocupado' THEN p.ended_at - p.started_at END
+  );
+"""
+
+# Permanencia y rotación por estacionamiento con sesiones cerradas en [desde, hasta)
+# (idx_parking_session_est_ended).
+STATS_SQL = """
+SELECT p.estacionamiento_id,
+       (SELECT count(*) FROM sensor s WHERE s.estacionamiento_id = p.estacionamiento_id) AS plazas,
+       COUNT(*) FILTER (WHERE p.estado = 'ocupado') AS sesiones,
+       AVG(p.duracion_s) FILTER (WHERE p.estado = 'ocupado') AS ocupado_prom_s,
+       percentile_cont(0.5) WITHIN GROUP (ORDER BY p.duracion_s) FILTER (WHERE p.estado = 'ocupado') AS ocupado_p50_s,
+       AVG(p.duracion_s) FILTER (WHERE p.estado = 'libre') AS libre_prom_s
+FROM parking_session p
+WHERE p.ended_at IS NOT NULL AND p.ended_at >= %s AND p.ended_at < %s {filter}
+GROUP BY p.estacionamiento_id
+ORDER BY p.estacionamiento_id;
+"""
+
+
+def _backfill_chunk(conn: psycopg.Connection, lo: int, hi: int) -> Dict[str, int]:
+    params = {"lo": lo, "hi": hi}
+    for attempt in range(LOCK_RETRIES):
+        try:
+            with conn.transaction():
+                conn.execute(LOCK_SQL, params)
+                conn.execute(DELETE_SQL, params)
+                sesiones = conn.execute(BACKFILL_SQL, params).rowcount
+                registros = conn.execute(DURATIONS_SQL, params).rowcount
+            return {"sesiones": sesiones, "registros": registros}
+        except psycopg.errors.LockNotAvailable:
+            # La ingesta tiene sensores del tramo: se reintenta sin retener bloqueos
+            time.sleep(LOCK_RETRY_SEC)
+    raise RuntimeError(f"sensores {lo}..{hi - 1} bloqueados por la ingesta tras {LOCK_RETRIES} intentos")
+
+
+def backfill(
+    conn: psycopg.Connection,
+    chunk: int = CHUNK_SENSORS,
+    from_sensor: int = 0,
+    progress: Optional[Callable[[str], None]] = print,
+) -> Dict[str, Any]:
+    """Reconstruye parking_session y las duraciones de registro_data. Requiere autocommit."""
+    if not conn.execute("SELECT pg_try_advisory_lock(%s);", (_LOCK_KEY,)).fetchone()[0]:
+        return {"skipped": True}
+    try:
+        ids = [r[0] for r in conn.execute(
+            "SELECT id FROM sensor WHERE id >= %s ORDER BY id;", (from_sensor,)
+        ).fetchall()]
+        totals = {"sensores": len(ids), "sesiones": 0, "registros": 0}
+        started = time.monotonic()
+        for i in range(0, len(ids), chunk):
+            part = ids[i:i + chunk]
+            result = _backfill_chunk(conn, part[0], part[-1] + 1)
+            totals["sesiones"] += result["sesiones"]
+            totals["registros"] += result["registros"]
+            if progress:
+                progress(f"[SESSIONS] sensores {part[0]}..{part[-1]}: {result['sesiones']} sesiones, "
+                         f"{result['registros']} registros ({time.monotonic() - started:.1f} s)")
+        return {"skipped": False, **totals}
+    finally:
+        conn.execute("SELECT pg_advisory_unlock(%s);", (_LOCK_KEY,))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill de parking_session y de las duraciones de registro_data")
+    parser.add_argument("--chunk", type=int, default=CHUNK_SENSORS, help="sensores por transacción")
+    parser.add_argument("--from-sensor", type=int, default=0, help="reanudar desde este sensor_id")
+    args = parser.parse_args()
+    with psycopg.connect(os.environ["PG_CONN"], autocommit=True) as conn:
+        result = backfill(conn, args.chunk, args.from_sensor)
+    if result["skipped"]:
+        print("Backfill en curso en otro proceso; nada que hacer.")
+    else:
+        print(f"Sesiones reconstruidas: {result['sesiones']} ({result['sensores']} sensores, "
+              f"{result['registros']} registros con duración)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+Snapshot de un entorno sembrado (baseline) para resets rápidos.
+capture() guarda cada tabla con COPY ... TO STDOUT (binario) y cada
+colección de Mongo como BSON crudo (mismo formato que mongodump), más un
+manifest.json con columnas, filas, valores de las secuencias y el hash de
+db_init.sql. restore() vuelve a ese estado en una sola transacción:
+TRUNCATE ... RESTART IDENTITY + COPY FROM, sin reejecutar el DDL ni los seeds.
+Si db_init.sql cambió desde la captura, el snapshot se considera de otro
+esquema y hay que reconstruir (DDL + seeds) y capturar de nuevo.
+
+CLI:
+  export $(grep -v '^#' tools/.env | xargs)
+  python api/snapshot.py capture      # tras sembrar
+  python api/snapshot.py restore
+"""
+import argparse
+import hashlib
+import os
+import shutil
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import bson
+import psycopg
+from bson import json_util
+from pymongo.database import Database
+from pymongo.errors import OperationFailure
+
+import partitions
+
+# Orden de carga (las FK se validan fila a fila durante el COPY)
+TABLES = (
+    "campus", "estacionamiento", "rol", "usuario", "sensor", "gateway", "reserva",
+    "registro_data", "sensor_state", "parking_session", "sensor_threshold", "occupancy_rollup", "occupancy_rollup_state",
+    "projector_checkpoint",
+)
+MANIFEST = "manifest.json"
+JSON_OPTIONS = json_util.RELAXED_JSON_OPTIONS.with_options(tz_aware=True, tzinfo=timezone.utc)
+READ_BYTES = 1024 * 1024
+MONGO_BATCH = 1000
+
+# Un solo reset/captura a la vez entre workers y procesos
+_LOCK_KEY = 0x5350_0003
+
+
+class SnapshotError(Exception):
+    """El snapshot no existe o no corresponde al esquema actual."""
+
+
+def schema_hash(sql_path: Path) -> str:
+    return hashlib.sha256(sql_path.read_bytes()).hexdigest()
+
+
+def load_manifest(directory: Path) -> Optional[Dict[str, Any]]:
+    path = directory / MANIFEST
+    if not path.exists():
+        return None
+    return json_util.loads(path.read_text(), json_options=JSON_OPTIONS)
+
+
+def check(directory: Path, sql_path: Path) -> Dict[str, Any]:
+    """Manifest del snapshot si se puede restaurar sobre el esquema actual. SnapshotError si no."""
+    manifest = load_manifest(directory)
+    if manifest is None:
+        raise SnapshotError(f"no hay snapshot en {directory}")
+    if manifest.get("schema") != schema_hash(sql_path):
+        raise SnapshotError("db_init.sql cambió desde la captura")
+    return manifest
+
+
+def _columns(conn: psycopg.Connection, table: str) -> List[str]:
+    # Columnas generadas (STORED) no admiten COPY FROM: se recalculan al cargar
+    rows = conn.execute(
+        """
+        SELECT attname FROM pg_attribute
+        WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped AND attgenerated = ''
+        ORDER BY attnum
+        """,
+        (table,),
+    ).fetchall()
+    return [r[0] for r in rows]
+
+
+def _sequence(conn: psycopg.Connection, table: str, columns: List[str]) -> Optional[Dict[str, Any]]:
+    if "id" not in columns:
+        return None
+    row = conn.execute("SELECT pg_get_serial_sequence(%s, 'id');", (table,)).fetchone()
+    if not row or not row[0]:
+        return None
+    last_value, is_called = conn.execute(f"SELECT last_value, is_called FROM {row[0]};").fetchone()
+    return {"name": row[0], "last_value": last_value, "is_called": is_called}
+
+
+# ---- Captura ----
+def capture(
+    conn: psycopg.Connection,
+    mdb: Optional[Database],
+    directory: Path,
+    sql_path: Path,
+    progress: Callable[[str], None] = print,
+) -> Dict[str, Any]:
+    """
+    Captura el estado actual en `directory` (reemplaza el snapshot anterior
+    sólo al terminar). Las tablas se leen en una transacción REPEATABLE READ,
+    así que el snapshot es consistente aunque haya escrituras. Requiere autocommit.
+    """
+    tmp = directory.with_name(directory.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    (tmp / "pg").mkdir(parents=True)
+    manifest: Dict[str, Any] = {
+        "created_at": datetime.now(timezone.utc),
+        "schema": schema_hash(sql_path),
+        "tables": [],
+        "mongo": [],
+    }
+
+    with conn.transaction():
+        conn.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY;")
+        for table in TABLES:
+            progress(f"pg: {table}")
+            columns = _columns(conn, table)
+            cols = ", ".join(columns)
+            with conn.cursor() as cur, open(tmp / "pg" / f"{table}.copy", "wb") as f:
+                # COPY (SELECT ...) porque COPY <tabla> no acepta tablas particionadas
+                with cur.copy(f"COPY (SELECT {cols} FROM {table}) TO STDOUT WITH (FORMAT binary)") as copy:
+                    for data in copy:
+                        f.write(data)
+                rows = cur.rowcount
+            manifest["tables"].append(
+                {"name": table, "columns": columns, "rows": rows, "sequence": _sequence(conn, table, columns)}
+            )
+        since = conn.execute(f"SELECT min(created_at) FROM {partitions.PARENT};").fetchone()[0]
+        manifest["registro_since"] = since
+
+    if mdb is not None:
+        (tmp / "mongo").mkdir()
+        for info in mdb.list_collections():
+            name = info["name"]
+            if name.startswith("system.") or info.get("type") == "view":
+                continue
+            progress(f"mongo: {name}")
+            col = mdb[name]
+            docs = 0
+            with open(tmp / "mongo" / f"{name}.bson", "wb") as f:
+                for batch in col.find_raw_batches():
+                    f.write(batch)
+                    docs += _count_bson(batch)
+            indexes = [ix for ix in col.list_indexes() if ix["name"] != "_id_"]
+            manifest["mongo"].append(
+                {"name": name, "options": info.get("options", {}), "indexes": indexes, "docs": docs}
+            )
+
+    (tmp / MANIFEST).write_text(json_util.dumps(manifest, indent=2, json_options=JSON_OPTIONS))
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp, directory)
+    return _summary(manifest)
+
+
+# ---- Restauración ----
+def restore(
+    conn: psycopg.Connection,
+    mdb: Optional[Database],
+    directory: Path,
+    sql_path: Path,
+    progress: Callable[[str], None] = print,
+) -> Dict[str, Any]:
+    """Vuelve al snapshot. SnapshotError si no existe o es de otro esquema. Requiere autocommit."""
+    manifest = check(directory, sql_path)
+    missing = [t["name"] for t in manifest["tables"]
+               if conn.execute("SELECT to_regclass(%s);", (t["name"],)).fetchone()[0] is None]
+    if missing:
+        raise SnapshotError(f"faltan tablas: {', '.join(missing)}")
+
+    # Particiones del rango capturado antes del COPY: las filas no pasan por la default
+    partitions.ensure_partitions(conn, since=manifest.get("registro_since"))
+
+    names = ", ".join(t["name"] for t in manifest["tables"])
+    with conn.transaction():
+        progress("pg: truncate")
+        conn.execute(f"TRUNCATE {names} RESTART IDENTITY CASCADE;")
+        for table in manifest["tables"]:
+            progress(f"pg: {table['name']}")
+            cols = ", ".join(table["columns"])
+            with conn.cursor() as cur, open(directory / "pg" / f"{table['name']}.copy", "rb") as f:
+                with cur.copy(f"COPY {table['name']} ({cols}) FROM STDIN WITH (FORMAT binary)") as copy:
+                    while data := f.read(READ_BYTES):
+                        copy.write(data)
+            seq = table.get("sequence")
+            if seq:
+                conn.execute("SELECT setval(%s, %s, %s);", (seq["name"], seq["last_value"], seq["is_called"]))
+
+    if mdb is not None:
+        for col_info in manifest["mongo"]:
+            progress(f"mongo: {col_info['name']}")
+            _restore_collection(mdb, directory, col_info)
+    return _summary(manifest)
+
+
+def _restore_collection(mdb: Database, directory: Path, col_info: Dict[str, Any]):
+    # drop + create: también sirve para time-series, donde delete_many({}) no siempre está permitido
+    name = col_info["name"]
+    mdb.drop_collection(name)
+    mdb.create_collection(name, **col_info["options"])
+    col = mdb[name]
+    for ix in col_info["indexes"]:
+        opts = {k: v for k, v in ix.items() if k not in ("v", "key", "ns")}
+        try:
+            col.create_index(list(ix["key"].items()), **opts)
+        except OperationFailure:
+            pass  # índice implícito de la colección (p. ej. meta+ts de una time-series)
+    path = directory / "mongo" / f"{name}.bson"
+    if not path.exists():
+        return
+    batch = []
+    with open(path, "rb") as f:
+        for doc in bson.decode_file_iter(f):
+            batch.append(doc)
+            if len(batch) >= MONGO_BATCH:
+                col.insert_many(batch, ordered=False)
+                batch.clear()
+    if batch:
+        col.insert_many(batch, ordered=False)
+
+
+def _count_bson(data: bytes) -> int:
+    # Documentos concatenados: cada uno empieza con su largo (int32 little-endian)
+    n = pos = 0
+    while pos < len(data):
+        pos += int.from_bytes(data[pos:pos + 4], "little")
+        n += 1
+    return n
+
+
+def _summary(manifest: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "snapshot_at": manifest["created_at"].isoformat(),
+        "tables": {t["name"]: t["rows"] for t in manifest["tables"]},
+        "collections": {c["name"]: c["docs"] for c in manifest["mongo"]},
+    }
+
+
+# ---- Exclusión entre workers ----
+def try_lock(conn: psycopg.Connection) -> bool:
+    """Advisory lock de sesión: se mantiene en `conn` hasta unlock() o hasta cerrarla."""
+    return conn.execute("SELECT pg_try_advisory_lock(%s);", (_LOCK_KEY,)).fetchone()[0]
+
+
+def unlock(conn: psycopg.Connection):
+    conn.execute("SELECT pg_advisory_unlock(%s);", (_LOCK_KEY,))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Snapshot/restore del entorno sembrado")
+    parser.add_argument("action", choices=("capture", "restore"))
+    root = Path(__file__).resolve().parents[1]
+    parser.add_argument("--dir", type=Path,
+                        default=Path(os.environ.get("SNAPSHOT_DIR", root / "snapshots")) / "baseline")
+    parser.add_argument("--no-mongo", action="store_true", help="sólo Postgres")
+    args = parser.parse_args()
+
+    mdb = None
+    if not args.no_mongo:
+        import certifi
+        from pymongo import MongoClient
+
+        mdb = MongoClient(os.environ["MONGODB_URI"], tlsCAFile=certifi.where())["smartpark"]
+    sql_path = root / "api" / "db_init.sql"
+    started = time.monotonic()
+    with psycopg.connect(os.environ["PG_CONN"], autocommit=True) as conn:
+        if not try_lock(conn):
+            raise SystemExit("hay un reset/captura en curso")
+        fn = capture if args.action == "capture" else restore
+        result = fn(conn, mdb, args.dir, sql_path)
+    print(f"{args.action} en {time.monotonic() - started:.1f} s: {result['tables']} {result['collections']}")
+
+
+if __name__ == "__main__":
+    main()
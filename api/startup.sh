@@ -12,6 +12,23 @@ fi
 echo "PG_CONN está definido: ${PG_CONN:+SI}"
 echo "MONGODB_URI está definido: ${MONGODB_URI:+SI}"
 
-# Gunicorn para producción en App Service
+# Gunicorn para producción en App Service. Workers gthread: cada conexión
+# /stream (SSE) ocupa un hilo, así que Flask las limita a STREAM_MAX_SUBSCRIBERS
+# por worker (503 + Retry-After). Con muchos dashboards abiertos usar
+# API_SERVER=asgi: asgi.py sirve /stream en el event loop, sin hilos.
 GUNICORN_CMD_ARGS=${GUNICORN_CMD_ARGS:---timeout 120}
-exec gunicorn ${GUNICORN_CMD_ARGS} -w 2 -b 0.0.0.0:${PORT:-8080} app:app
+# Índices/colecciones de Mongo una sola vez (no en cada worker); si falla, la API arranca igual
+if [ "${MIGRATE_ON_START:-1}" = "1" ]; then
+    python migrate.py || echo "[WARN] migrate.py falló; se continúa con el arranque"
+fi
+# --preload: el master importa la app una vez (sin abrir conexiones) y los workers
+# nacen con el código cargado; post_fork (gunicorn.conf.py) abre los pools de cada uno
+if [ "${GUNICORN_PRELOAD:-1}" = "1" ]; then
+    GUNICORN_CMD_ARGS="${GUNICORN_CMD_ARGS} --preload"
+fi
+# gunicorn.conf.py: métricas Prometheus multiproceso (/metrics agrega todos los workers)
+if [ "${API_SERVER:-wsgi}" = "asgi" ]; then
+    # asgi.py: /sensor_event y /status_overview con drivers async, el resto vía Flask montado
+    exec gunicorn ${GUNICORN_CMD_ARGS} -c gunicorn.conf.py -w 2 -k uvicorn_worker.UvicornWorker -b 0.0.0.0:${PORT:-8080} asgi:app
+fi
+exec gunicorn ${GUNICORN_CMD_ARGS} -c gunicorn.conf.py -w 2 -k gthread --threads ${GUNICORN_THREADS:-32} -b 0.0.0.0:${PORT:-8080} app:app
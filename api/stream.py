@@ -0,0 +1,170 @@
+"""
+Difusión de cambios de estado para /stream (Server-Sent Events).
+Cada worker mantiene una sola conexión LISTEN a Postgres y reparte en
+memoria los avisos a todos sus suscriptores, así que ningún cliente abre
+conexiones a la base y los cambios llegan sin importar qué worker ingirió
+el evento. Un buffer circular permite reanudar con Last-Event-ID.
+subscribe() retiene un hilo por cliente (Flask/gthread); asubscribe() es la
+versión para asgi.py, donde los clientes sólo esperan en el event loop.
+"""
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+from itertools import islice
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+import psycopg
+
+
+class ChangeHub:
+    def __init__(self, buffer_size: int = 2000):
+        self._cond = threading.Condition()
+        # (seq local, id global, evento); seq sólo crece dentro del worker
+        self._buffer: Deque[Tuple[int, str, Dict[str, Any]]] = deque(maxlen=buffer_size)
+        self._next_seq = 0
+        self.subscribers = 0
+        # Un Event por event loop (asubscribe): un solo aviso por loop y evento, no uno por cliente
+        self._loop_events: Dict[asyncio.AbstractEventLoop, asyncio.Event] = {}
+
+    def publish(self, event: Dict[str, Any]):
+        with self._cond:
+            self._buffer.append((self._next_seq, str(event["id"]), event))
+            self._next_seq += 1
+            self._cond.notify_all()
+            loops = list(self._loop_events)
+        for loop in loops:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(self._wake, loop)
+
+    def _wake(self, loop: asyncio.AbstractEventLoop):
+        # Corre en el loop: despierta a sus suscriptores y deja un Event nuevo para la próxima espera
+        with self._cond:
+            event = self._loop_events.get(loop)
+            if event is not None:
+                self._loop_events[loop] = asyncio.Event()
+        if event is not None:
+            event.set()
+
+    def _collect(self, cursor: int) -> Tuple[List[Tuple[int, str, Dict[str, Any]]], bool, int]:
+        # Con el lock tomado. Los seq del buffer son consecutivos: lo pendiente son
+        # los últimos next_seq - cursor elementos (O(pendientes), no O(buffer)).
+        lost = bool(self._buffer) and self._buffer[0][0] > cursor
+        count = min(self._next_seq - cursor, len(self._buffer))
+        pending = list(islice(reversed(self._buffer), count))[::-1] if count > 0 else []
+        return pending, lost, self._next_seq
+
+    def _resume_seq(self, last_id: Optional[str]) -> Optional[int]:
+        # Posición (no comparación numérica): los ids de la secuencia pueden
+        # llegar fuera de orden entre transacciones, el orden de commit no.
+        if not last_id:
+            return self._next_seq
+        for seq, event_id, _ in reversed(self._buffer):
+            if event_id == last_id:
+                return seq + 1
+        return None
+
+    def subscribe(
+        self,
+        last_id: Optional[str] = None,
+        match: Callable[[Dict[str, Any]], bool] = lambda e: True,
+        heartbeat: float = 15.0,
+    ) -> Iterator[str]:
+        with self._cond:
+            cursor = self._resume_seq(last_id)
+            self.subscribers += 1
+        try:
+            if cursor is None:
+                # Last-Event-ID fuera del buffer: el cliente debe recargar el estado
+                yield _sse("resync", {"reason": "last_event_id fuera de la ventana"})
+                cursor = self._next_seq
+            while True:
+                with self._cond:
+                    if self._next_seq <= cursor:
+                        self._cond.wait(heartbeat)
+                    pending, lost, cursor = self._collect(cursor)
+                yield from _frames(pending, lost, match)
+        finally:
+            with self._cond:
+                self.subscribers -= 1
+
+    async def asubscribe(
+        self,
+        last_id: Optional[str] = None,
+        match: Callable[[Dict[str, Any]], bool] = lambda e: True,
+        heartbeat: float = 15.0,
+    ) -> AsyncIterator[str]:
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            cursor = self._resume_seq(last_id)
+            self.subscribers += 1
+        try:
+            if cursor is None:
+                yield _sse("resync", {"reason": "last_event_id fuera de la ventana"})
+                with self._cond:
+                    cursor = self._next_seq
+            while True:
+                with self._cond:
+                    wake = None
+                    if self._next_seq <= cursor:
+                        wake = self._loop_events.setdefault(loop, asyncio.Event())
+                if wake is not None:
+                    try:
+                        await asyncio.wait_for(wake.wait(), heartbeat)
+                    except asyncio.TimeoutError:
+                        pass
+                with self._cond:
+                    pending, lost, cursor = self._collect(cursor)
+                for frame in _frames(pending, lost, match):
+                    yield frame
+        finally:
+            with self._cond:
+                self.subscribers -= 1
+
+
+def _frames(pending, lost: bool, match: Callable[[Dict[str, Any]], bool]) -> Iterator[str]:
+    if lost:
+        yield _sse("resync", {"reason": "suscriptor demasiado lento"})
+    if not pending and not lost:
+        yield ": ping\n\n"
+    for _, event_id, event in pending:
+        if match(event):
+            yield _sse("cambio", event, event_id)
+
+
+def _sse(event: str, data: Dict[str, Any], event_id: Optional[str] = None) -> str:
+    head = f"id: {event_id}\n" if event_id else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def start_listener(
+    conninfo: str,
+    channel: str,
+    handlers: List[Callable[[Dict[str, Any]], None]],
+    retry_seconds: float = 5.0,
+) -> threading.Thread:
+    """Hilo con conexión dedicada LISTEN; reconecta ante fallos."""
+
+    def run():
+        while True:
+            try:
+                with psycopg.connect(conninfo, autocommit=True) as conn:
+                    conn.execute(f"LISTEN {channel};")
+                    for notify in conn.notifies():
+                        try:
+                            event = json.loads(notify.payload)
+                        except ValueError:
+                            continue
+                        for handler in handlers:
+                            try:
+                                handler(event)
+                            except Exception as e:
+                                print(f"[WARN] handler de stream: {e}")
+            except Exception as e:
+                print(f"[WARN] listener {channel}: {e}")
+            time.sleep(retry_seconds)
+
+    thread = threading.Thread(target=run, name=f"listen-{channel}", daemon=True)
+    thread.start()
+    return thread
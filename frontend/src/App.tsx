@@ -1,5 +1,5 @@
 import { useEffect, useMemo, useState } from "react";
-import { api, RegistroData } from "./api/client";
+import { api } from "./api/client";
 
 const STORAGE_KEY = "smartpark:selectedCampus";
 const CAMPUS = [
@@ -39,56 +39,69 @@ function App() {
     return localStorage.getItem(STORAGE_KEY) || defaultCampus;
   });
   const status = useAsync(() => api.statusOverview(), []);
+  const [liveVersion, setLiveVersion] = useState(0);
+  const occupancy = useAsync(() => api.occupancy(), [liveVersion]);
+
+  // Cambios en vivo: cada aviso del stream (agrupados en 1 s) recarga /occupancy.
+  // Si el servidor rechaza la conexión (503 por tope de suscriptores) EventSource
+  // no reintenta solo: se recarga /occupancy y se reconecta con backoff.
+  useEffect(() => {
+    let source: EventSource | undefined;
+    let timer: number | undefined;
+    let retry: number | undefined;
+    let delay = 30000;
+    const bump = () => {
+      if (timer) return;
+      timer = window.setTimeout(() => {
+        timer = undefined;
+        setLiveVersion((v) => v + 1);
+      }, 1000);
+    };
+    const connect = () => {
+      source = new EventSource(api.streamUrl());
+      source.addEventListener("open", () => {
+        delay = 30000;
+      });
+      source.addEventListener("cambio", bump);
+      source.addEventListener("resync", bump);
+      source.addEventListener("error", () => {
+        if (source?.readyState !== EventSource.CLOSED) return;
+        bump();
+        retry = window.setTimeout(connect, delay);
+        delay = Math.min(delay * 2, 300000);
+      });
+    };
+    connect();
+    return () => {
+      window.clearTimeout(timer);
+      window.clearTimeout(retry);
+      source?.close();
+    };
+  }, []);
   const registros = useAsync(() => api.registroData({ limit: 400 }), []);
 
   const regItems = registros.data?.items || [];
 
-  const latestBySensor = useMemo(() => {
-    const map = new Map<number, RegistroData>();
-    for (const item of regItems) {
-      const prev = map.get(item.sensor_id);
-      const prevDate = prev?.created_at ? new Date(prev.created_at).getTime() : 0;
-      const currDate = item.created_at ? new Date(item.created_at).getTime() : 0;
-      if (!prev || currDate >= prevDate) {
-        map.set(item.sensor_id, item);
-      }
-    }
-    return map;
-  }, [regItems]);
-
-  const sensorsByCampus = useMemo(() => {
-    const map = new Map<string, RegistroData[]>();
-    for (const entry of latestBySensor.values()) {
-      const campus = entry.estacionamiento_id?.split("-")[0];
-      if (!campus) continue;
-      const list = map.get(campus) ?? [];
-      list.push(entry);
-      map.set(campus, list);
-    }
-    return map;
-  }, [latestBySensor]);
+  const toTime = (ts?: string | null) => (ts ? new Date(ts).getTime() : 0);
 
   const campusCards = useMemo(() => {
+    const byCode = new Map((occupancy.data?.campus ?? []).map((c) => [c.codigo, c]));
     return CAMPUS.map((c) => {
-      const sensors = sensorsByCampus.get(c.code) ?? [];
-      const total = sensors.length;
-      const libres = sensors.filter((r) => r.estado === "libre").length;
-      const ocupados = total - libres;
+      const counts = byCode.get(c.code);
+      const libres = counts?.libres ?? 0;
+      const ocupados = counts?.ocupados ?? 0;
+      const total = libres + ocupados;
       const freeRatio = total ? Math.round((libres / total) * 100) : 0;
-      const lastUpdated = sensors.reduce((acc, r) => {
-        const t = r.created_at ? new Date(r.created_at).getTime() : 0;
-        return t > acc ? t : acc;
-      }, 0);
       return {
         ...c,
         total,
         ocupados,
         libres,
         freeRatio,
-        lastUpdated
+        lastUpdated: toTime(counts?.last_update)
       };
     }).sort((a, b) => b.libres - a.libres);
-  }, [sensorsByCampus]);
+  }, [occupancy.data]);
 
   useEffect(() => {
     if (typeof window !== "undefined" && selectedCampus) {
@@ -137,26 +150,21 @@ function App() {
   const minutesSinceSelectedUpdate = minutesAgo(selectedCampusData?.lastUpdated);
   const selectedCampusFloors = useMemo(() => {
     if (!selectedCampus) return [];
-    const sensors = sensorsByCampus.get(selectedCampus) ?? [];
-    const floorMap = new Map<
-      string,
-      { code: string; libres: number; ocupados: number; total: number; lastUpdated: number }
-    >();
-    for (const sensor of sensors) {
-      const [, rawFloor] = (sensor.estacionamiento_id || "").split("-");
-      const floorCode = rawFloor || "General";
-      const entry =
-        floorMap.get(floorCode) ||
-        { code: floorCode, libres: 0, ocupados: 0, total: 0, lastUpdated: 0 };
-      entry.total += 1;
-      if (sensor.estado === "libre") entry.libres += 1;
-      else entry.ocupados += 1;
-      const created = sensor.created_at ? new Date(sensor.created_at).getTime() : 0;
-      if (created > entry.lastUpdated) entry.lastUpdated = created;
-      floorMap.set(floorCode, entry);
-    }
-    return Array.from(floorMap.values()).sort((a, b) => b.libres - a.libres);
-  }, [selectedCampus, sensorsByCampus]);
+    return (occupancy.data?.estacionamientos ?? [])
+      .filter((lot) => lot.campus === selectedCampus)
+      .map((lot) => {
+        const [, rawFloor] = lot.id.split("-");
+        return {
+          code: rawFloor || "General",
+          libres: lot.libres,
+          ocupados: lot.ocupados,
+          total: lot.libres + lot.ocupados,
+          lastUpdated: toTime(lot.last_update)
+        };
+      })
+      .filter((floor) => floor.total > 0)
+      .sort((a, b) => b.libres - a.libres);
+  }, [selectedCampus, occupancy.data]);
 
   const preferredFloor = selectedCampusFloors[0] || null;
   const backupFloor = selectedCampusFloors[1] || null;
@@ -174,7 +182,7 @@ function App() {
           </div>
           <div className="flex items-center gap-3 text-sm text-slate-600">
             <span className="inline-flex h-3 w-3 rounded-full bg-emerald-400 shadow-[0_0_0_6px_rgba(16,185,129,0.2)]"></span>
-            {status.loading || registros.loading ? "Actualizando datos…" : "Datos sincronizados"}
+            {status.loading || occupancy.loading || registros.loading ? "Actualizando datos…" : "Datos sincronizados"}
           </div>
         </div>
       </header>
@@ -12,6 +12,22 @@ export type StatusOverview = {
   registro_data: RegistroData[];
 };
 
+export type OccupancyCounts = {
+  libres: number;
+  ocupados: number;
+  sin_datos: number;
+  total: number;
+  last_update: string | null;
+};
+
+export type Occupancy = {
+  ok: boolean;
+  warmed_at: string;
+  campus: (OccupancyCounts & { codigo: string })[];
+  estacionamientos: (OccupancyCounts & { id: string; campus: string; piso: number | null })[];
+  pisos: (OccupancyCounts & { campus: string; piso: number | null })[];
+};
+
 const API_BASE = import.meta.env.VITE_API_BASE || "https://smartparksystemapi.azurewebsites.net";
 
 async function http<T>(path: string, init?: RequestInit): Promise<T> {
@@ -27,13 +43,19 @@ async function http<T>(path: string, init?: RequestInit): Promise<T> {
 }
 
 export const api = {
+  streamUrl: (campus?: string) => `${API_BASE}/stream${campus ? `?campus=${encodeURIComponent(campus)}` : ""}`,
   statusOverview: () => http<StatusOverview>("/status_overview"),
-  registroData: (params: { limit?: number; estacionamiento_id?: string; sensor_id?: number } = {}) => {
+  occupancy: (campus?: string) =>
+    http<Occupancy>(`/occupancy${campus ? `?campus=${encodeURIComponent(campus)}` : ""}`),
+  registroData: (
+    params: { limit?: number; estacionamiento_id?: string; sensor_id?: number; cursor?: string | null } = {}
+  ) => {
     const search = new URLSearchParams();
     if (params.limit) search.set("limit", String(params.limit));
     if (params.estacionamiento_id) search.set("estacionamiento_id", params.estacionamiento_id);
     if (params.sensor_id) search.set("sensor_id", String(params.sensor_id));
+    if (params.cursor) search.set("cursor", params.cursor);
     const qs = search.toString();
-    return http<{ ok: boolean; count: number; items: RegistroData[] }>(`/registro_data${qs ? `?${qs}` : ""}`);
+    return http<{ ok: boolean; count: number; items: RegistroData[]; next_cursor: string | null }>(`/registro_data${qs ? `?${qs}` : ""}`);
   }
 };
@@ -0,0 +1,360 @@
+"""
+Micro-benchmarks de las rutas calientes de la API, sin bases de datos:
+importa api/app.py con dobles en proceso de Postgres (pool/cursor que
+devuelven filas sintéticas) y Mongo (colección que serializa a BSON como
+el driver) y mide el costo de CPU por etapa de /sensor_event, de la
+serialización de /registro_data y de los hooks CORS. app.cold_import mide
+el import de la app en un proceso nuevo (parte del arranque en frío de cada
+worker que no depende de la red).
+
+Uso:
+  python tools/bench.py                       # mide e imprime
+  python tools/bench.py --save                # guarda la línea base
+  python tools/bench.py --compare             # compara contra la línea base (% de diferencia)
+  BENCH_PG_CONN=postgresql://... python tools/bench.py   # añade pg_write_event contra un Postgres local
+Config:
+  --baseline bench_baseline.json   # ruta de la línea base (depende de la máquina: no versionar)
+  --threshold 10                   # % de empeoramiento que se marca como regresión
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import bson
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "api"))
+
+N_SENSORS = 400
+N_REGISTRO_ROWS = 501  # limit=500 + 1 para next_cursor
+
+
+# ---- Dobles de Postgres ----
+class FakeCopy:
+    def write_row(self, row):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeCursor:
+    def __init__(self, conn: "FakeConnection"):
+        self.conn = conn
+        self._rows: List[tuple] = []
+
+    def execute(self, sql: str, params=None):
+        self.conn.calls += 1
+        self._rows = self.conn.rows_for(sql)
+        return self
+
+    def executemany(self, sql: str, params_seq, returning: bool = False):
+        params_seq = list(params_seq)
+        self.conn.calls += len(params_seq)
+        self._rows = [(True,)] * len(params_seq) if returning else []
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def nextset(self):
+        return True
+
+    def copy(self, sql: str):
+        return FakeCopy()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeConnection:
+    def __init__(self, tables: Dict[str, List[tuple]]):
+        self.tables = tables
+        self.calls = 0
+
+    def rows_for(self, sql: str) -> List[tuple]:
+        if "sensor_state" in sql and "INSERT" in sql:
+            return [(True,)]  # upsert ... RETURNING transicion
+        for marker, rows in self.tables.items():
+            if marker in sql:
+                return list(rows)
+        return []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def execute(self, sql: str, params=None):
+        return self.cursor().execute(sql, params)
+
+    @contextmanager
+    def transaction(self):
+        yield
+
+
+class FakePool:
+    tables: Dict[str, List[tuple]] = {}
+
+    def __init__(self, *args, **kwargs):
+        self.conn = FakeConnection(FakePool.tables)
+
+    @contextmanager
+    def connection(self):
+        yield self.conn
+
+
+# ---- Doble de Mongo ----
+class FakeCollection:
+    """insert_one/insert_many codifican a BSON (el costo de CPU del driver) sin red."""
+
+    def __init__(self):
+        self.count = 0
+
+    def insert_one(self, doc):
+        doc.setdefault("_id", bson.ObjectId())
+        bson.encode(doc)
+        self.count += 1
+
+    def insert_many(self, docs, ordered=True):
+        for doc in docs:
+            self.insert_one(doc)
+
+    def create_index(self, *args, **kwargs):
+        return "fake"
+
+    def find(self, *args, **kwargs):
+        return FakeFind()
+
+
+class FakeFind(list):
+    def sort(self, *args, **kwargs):
+        return self
+
+    def limit(self, *args, **kwargs):
+        return self
+
+
+class FakeDatabase(dict):
+    def __missing__(self, name):
+        col = self[name] = FakeCollection()
+        return col
+
+
+class FakeMongoClient:
+    def __init__(self, *args, **kwargs):
+        self._dbs = {}
+        self.admin = self
+
+    def __getitem__(self, name):
+        return self._dbs.setdefault(name, FakeDatabase())
+
+    def command(self, *args, **kwargs):
+        return {"ok": 1}
+
+
+# ---- Carga de la app con dobles ----
+def synthetic_tables(now: datetime) -> Dict[str, List[tuple]]:
+    registro = []
+    for i in range(N_REGISTRO_ROWS):
+        # Las fechas llegan como texto ISO (iso_sql en la consulta), igual que desde Postgres
+        ts = (now - timedelta(seconds=i)).isoformat()
+        estado = "ocupado" if i % 2 else "libre"
+        registro.append((
+            1001 + i % N_SENSORS, f"MON-{1 + i % 5}A", estado,
+            ts if estado == "libre" else None, ts if estado == "ocupado" else None, ts, 10_000_000 - i,
+        ))
+    return {"FROM registro_data": registro}
+
+
+def load_app():
+    os.environ.setdefault("PG_CONN", "postgresql://bench@localhost/bench")
+    os.environ.setdefault("MONGODB_URI", "mongodb://localhost:1")
+    # Sin hilos de fondo, sin LISTEN y sin caché: se mide el trabajo de cada request
+    os.environ.update({
+        "STREAM_NOTIFY": "0",
+        "OCCUPANCY_REFRESH_SEC": "0",
+        "SENSOR_REGISTRY_REFRESH_SEC": "0",
+        "ROLLUP_REFRESH_SEC": "0",
+        "RESPONSE_CACHE_TTL": "0",
+        "INGEST_MODE": "sync",
+        "ALLOWED_ORIGINS": "*",
+    })
+    import psycopg_pool
+    import pymongo
+
+    FakePool.tables = synthetic_tables(datetime.now(timezone.utc))
+    psycopg_pool.ConnectionPool = FakePool
+    pymongo.MongoClient = FakeMongoClient
+
+    import app as app_module
+
+    # Registro de sensores precargado (la validación previa a la ingesta forma parte del hot path)
+    app_module.sensor_registry.load([
+        (1001 + i, f"MON-{1 + i % 5}A", "operativo", "MON", "lorawan", None) for i in range(N_SENSORS)
+    ], [])
+    return app_module
+
+
+# ---- Medición ----
+def measure(fn: Callable[[], Any], number: int, repeat: int, context=None) -> Dict[str, float]:
+    with context() if context else nullcontext():
+        for _ in range(max(1, number // 10)):
+            fn()  # calentamiento
+        samples = []
+        for _ in range(repeat):
+            t0 = time.perf_counter_ns()
+            for _ in range(number):
+                fn()
+            samples.append((time.perf_counter_ns() - t0) / number / 1000)
+    return {"median_us": round(statistics.median(samples), 3), "min_us": round(min(samples), 3)}
+
+
+def build_stages(app_module, pg_conn: Optional[str]) -> Dict[str, tuple]:
+    import ingest
+    from models import SensorEvent
+
+    flask_app = app_module.app
+    client = flask_app.test_client()
+    body = {
+        "sensor_id": 1001,
+        "estacionamiento_id": "MON-1A",
+        "estado": "ocupado",
+        "ts": "2025-01-01T12:00:00+00:00",
+        "payload": {"bateria": 3.9},
+    }
+    raw = json.dumps(body).encode()
+    obj = json.loads(raw)
+    data = SensorEvent(**obj)
+    meta = app_module.sensor_registry.meta(1001)
+    fake_conn = FakeConnection({})
+    fake_col = FakeCollection()
+    bulk_raw = b"\n".join(
+        json.dumps({**body, "sensor_id": 1001 + i % N_SENSORS, "estacionamiento_id": f"MON-{1 + i % 5}A"}).encode()
+        for i in range(500)
+    )
+
+    def cors_hooks():
+        app_module.handle_preflight()
+        app_module.ensure_cors_headers(flask_app.response_class())
+
+    def registro_serialization():
+        app_module.registro_data_list.__wrapped__().get_data()
+
+    cors_ctx = lambda: flask_app.test_request_context("/healthz", headers={"Origin": "https://example.org"})
+    registro_ctx = lambda: flask_app.test_request_context("/registro_data?limit=500")
+    columnar_ctx = lambda: flask_app.test_request_context("/registro_data?limit=500&format=columnar")
+
+    # nombre -> (función, iteraciones por ronda, eventos por iteración[, contexto de request])
+    stages = {
+        "sensor_event.json_parse": (lambda: json.loads(raw), 20000, 1),
+        "sensor_event.validate": (lambda: SensorEvent(**obj), 20000, 1),
+        "sensor_event.registry_check": (lambda: app_module._check_sensor(1001, "MON-1A"), 20000, 1),
+        "sensor_event.build_doc": (lambda: ingest.build_doc(data, sensor_meta=meta), 20000, 1),
+        "sensor_event.mongo_encode": (lambda: fake_col.insert_one(ingest.build_doc(data)), 10000, 1),
+        "sensor_event.pg_call_overhead": (lambda: ingest.pg_write_event(fake_conn, ingest.build_doc(data)), 10000, 1),
+        "sensor_event.request_e2e": (lambda: client.post("/sensor_event", data=raw, content_type="application/json"), 1000, 1),
+        "sensor_events.parse_validate_500": (
+            lambda: ingest.validate_events(ingest.parse_body(bulk_raw, True)[0]), 20, 500,
+        ),
+        "registro_data.serialize_500": (registro_serialization, 100, 500, registro_ctx),
+        "registro_data.request_e2e_500": (lambda: client.get("/registro_data?limit=500"), 50, 500),
+        "registro_data.serialize_columnar_500": (registro_serialization, 100, 500, columnar_ctx),
+        "cors.hooks": (cors_hooks, 5000, 1, cors_ctx),
+        "app.cold_import": (
+            lambda: subprocess.run([sys.executable, __file__, "--import-only"], check=True), 1, 1,
+        ),
+    }
+    if pg_conn:
+        import psycopg
+
+        conn = psycopg.connect(pg_conn, autocommit=True)
+        sid, est = conn.execute("SELECT id, estacionamiento_id FROM sensor ORDER BY id LIMIT 1;").fetchone()
+        real = SensorEvent(sensor_id=sid, estacionamiento_id=est, estado="libre")
+        stages["sensor_event.pg_write_event_local"] = (lambda: ingest.pg_write_event(conn, ingest.build_doc(real)), 200, 1)
+    return stages
+
+
+# ---- Reporte ----
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float) -> List[str]:
+    regressions = []
+    print(f"\n{'etapa':<40} {'base mín':>10} {'mín µs':>10} {'diff':>8}")
+    for name, res in results.items():
+        base = baseline.get(name)
+        if not base:
+            print(f"{name:<40} {'-':>10} {res['min_us']:>10.2f} {'nuevo':>8}")
+            continue
+        # Se compara el mínimo: es el menos sensible al ruido de la máquina
+        diff = (res["min_us"] - base["min_us"]) / base["min_us"] * 100
+        flag = "  REGRESIÓN" if diff > threshold else ""
+        print(f"{name:<40} {base['min_us']:>10.2f} {res['min_us']:>10.2f} {diff:>+7.1f}%{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks offline de la API")
+    parser.add_argument("--baseline", default="bench_baseline.json")
+    parser.add_argument("--save", action="store_true", help="guarda los resultados como línea base")
+    parser.add_argument("--compare", action="store_true", help="compara contra la línea base")
+    parser.add_argument("--threshold", type=float, default=10.0, help="%% de empeoramiento tolerado")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplica las iteraciones (0.1 = rápido)")
+    parser.add_argument("--only", help="filtra etapas por prefijo")
+    parser.add_argument("--import-only", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    app_module = load_app()
+    if args.import_only:
+        return
+    stages = build_stages(app_module, os.environ.get("BENCH_PG_CONN"))
+
+    results = {}
+    print(f"{'etapa':<40} {'mediana µs':>11} {'mín µs':>9} {'µs/evento':>10}")
+    for name, (fn, number, events, *context) in stages.items():
+        if args.only and not name.startswith(args.only):
+            continue
+        res = measure(fn, max(1, int(number * args.scale)), args.repeat, *context)
+        res["per_event_us"] = round(res["median_us"] / events, 3)
+        results[name] = res
+        print(f"{name:<40} {res['median_us']:>11.2f} {res['min_us']:>9.2f} {res['per_event_us']:>10.2f}")
+
+    status = 0
+    if args.compare:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} etapa(s) más de {args.threshold}% más lentas que la línea base")
+            status = 1
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump({
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "results": results,
+            }, f, indent=2)
+        print(f"\nLínea base guardada en {args.baseline}")
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
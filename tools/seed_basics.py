@@ -1,97 +1,187 @@
 """
-Carga datos base para el esquema nuevo (campus, estacionamientos, sensores, etc.).
+Carga datos base para el esquema nuevo (campus, estacionamientos, sensores, etc.)
+y, opcionalmente, un histórico sintético de registro_data/events_raw.
+Sin argumentos carga la topología de la demo (4 sedes, 4 sensores por
+estacionamiento); con parámetros genera topologías del tamaño de producción.
+
 Uso: export $(grep -v '^#' tools/.env | xargs) ; python tools/seed_basics.py
+     python tools/seed_basics.py --campuses 50 --sensors-per-lot 200 --history-days 90
+Las tablas grandes se cargan con COPY (vía tabla temporal cuando hace falta
+ON CONFLICT) y el histórico se escribe en lotes de --batch filas: COPY a
+registro_data e insert_many a events_raw, sin tener todo en memoria.
 """
+import argparse
+import json
 import os
+import random
+import sys
+import time
 from datetime import datetime, timedelta, timezone
-import json
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 
 import psycopg
+from psycopg import sql
 from psycopg.rows import dict_row
-
-try:
-    from psycopg.extras import execute_values
-except ImportError:
-    execute_values = None
 from pymongo import MongoClient
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "api"))
+import events_raw  # noqa: E402
+import partitions  # noqa: E402
+import sessions  # noqa: E402
+
 PG_CONN = os.environ["PG_CONN"]
 MONGODB_URI = os.environ["MONGODB_URI"]
 
+# ---- Topología de la demo ----
+CAMPUS_DEF = [
+    ("MON", "Monterrico", "Av. Primavera 123", "-12.10,-76.97"),
+    ("SMG", "San Miguel", "Av. La Marina 456", "-12.07,-77.08"),
+    ("SIZ", "San Isidro", "Av. Javier Prado 789", "-12.09,-77.04"),
+    ("VIL", "Villa", "Av. Universitaria 321", "-12.16,-76.98"),
+]
+# (id, campus, ubicacion, numero, piso, accesibilidad): 2-3 plantas, 2-3 estacionamientos por planta
+ESTACIONAMIENTOS_DEF = [
+    # Monterrico (3 plantas, 3 por planta)
+    ("MON-1A", "MON", "Ingreso A piso 1", 1, 1, "rampa"),
+    ("MON-1B", "MON", "Ingreso B piso 1", 2, 1, "ascensor"),
+    ("MON-1C", "MON", "Ingreso C piso 1", 3, 1, "rampa"),
+    ("MON-2A", "MON", "Ingreso A piso 2", 1, 2, "ascensor"),
+    ("MON-2B", "MON", "Ingreso B piso 2", 2, 2, "rampa"),
+    ("MON-2C", "MON", "Ingreso C piso 2", 3, 2, "rampa"),
+    ("MON-3A", "MON", "Ingreso A piso 3", 1, 3, "ascensor"),
+    ("MON-3B", "MON", "Ingreso B piso 3", 2, 3, "rampa"),
+    ("MON-3C", "MON", "Ingreso C piso 3", 3, 3, "rampa"),
+    # San Miguel (2 plantas, 2 por planta)
+    ("SMG-1A", "SMG", "Acceso mar piso 1", 1, 1, "rampa"),
+    ("SMG-1B", "SMG", "Acceso costanera piso 1", 2, 1, "ascensor"),
+    ("SMG-2A", "SMG", "Acceso mar piso 2", 1, 2, "ascensor"),
+    ("SMG-2B", "SMG", "Acceso costanera piso 2", 2, 2, "rampa"),
+    # San Isidro (2 plantas, 2 por planta)
+    ("SIZ-1A", "SIZ", "Lobby principal piso 1", 1, 1, "ascensor"),
+    ("SIZ-1B", "SIZ", "Lobby secundario piso 1", 2, 1, "rampa"),
+    ("SIZ-2A", "SIZ", "Lobby principal piso 2", 1, 2, "ascensor"),
+    ("SIZ-2B", "SIZ", "Lobby secundario piso 2", 2, 2, "rampa"),
+    # Villa (2 plantas, 2 por planta)
+    ("VIL-1A", "VIL", "Bloque A piso 1", 1, 1, "rampa"),
+    ("VIL-1B", "VIL", "Bloque B piso 1", 2, 1, "ascensor"),
+    ("VIL-2A", "VIL", "Bloque A piso 2", 1, 2, "ascensor"),
+    ("VIL-2B", "VIL", "Bloque B piso 2", 2, 2, "rampa"),
+]
+FIRST_SENSOR_ID = 1001
+
+
+def build_topology(
+    campuses: int = 4, sensors_per_lot: int = 4, seed: int = 7
+) -> Tuple[List[tuple], List[tuple], List[Tuple[int, str, Optional[str]]]]:
+    """
+    Campus, estacionamientos y sensores (id, estacionamiento_id, tipo). Las
+    primeras 4 sedes son las de la demo; el resto se genera alrededor de Lima
+    con 2-4 plantas y 2-3 ingresos por planta.
+    """
+    rng = random.Random(seed)
+    campus_def = list(CAMPUS_DEF[:campuses])
+    lots = [lot for lot in ESTACIONAMIENTOS_DEF if lot[1] in {c[0] for c in campus_def}]
+    for i in range(len(CAMPUS_DEF), campuses):
+        code = f"C{i + 1:02d}"
+        coord = f"{rng.uniform(-12.25, -11.95):.4f},{rng.uniform(-77.12, -76.90):.4f}"
+        campus_def.append((code, f"Campus {i + 1}", f"Av. Sintética {100 + i}", coord))
+        for piso in range(1, 2 + i % 3 + 1):
+            for numero in range(1, 2 + i % 2 + 1):
+                letra = "ABC"[numero - 1]
+                acc = "rampa" if (piso + numero) % 2 else "ascensor"
+                lots.append((f"{code}-{piso}{letra}", code, f"Ingreso {letra} piso {piso}", numero, piso, acc))
+
+    sensors = []
+    sid = FIRST_SENSOR_ID
+    for est_id, code, *_rest in lots:
+        # Monterrico y San Miguel usan lorawan; las sedes generadas alternan tecnología
+        if code in ("MON", "SMG"):
+            tipo = "lorawan"
+        elif code in ("SIZ", "VIL"):
+            tipo = None
+        else:
+            tipo = ("lorawan", "ultrasonico", None)[int(code[1:]) % 3]
+        for _ in range(sensors_per_lot):
+            sensors.append((sid, est_id, tipo))
+            sid += 1
+    return campus_def, lots, sensors
 
-def seed_postgres():
+
+# ---- Carga por lotes ----
+def copy_rows(cur, table: str, columns: Sequence[str], rows: Iterable[tuple]) -> int:
+    """COPY directo (tablas sin conflictos posibles, p. ej. registro_data)."""
+    n = 0
+    stmt = sql.SQL("COPY {} ({}) FROM STDIN").format(
+        sql.Identifier(table), sql.SQL(", ").join(map(sql.Identifier, columns))
+    )
+    with cur.copy(stmt) as copy:
+        for row in rows:
+            copy.write_row(row)
+            n += 1
+    return n
+
+
+def copy_upsert(
+    conn: psycopg.Connection, table: str, columns: Sequence[str], rows: Iterable[tuple],
+    conflict: str = "ON CONFLICT DO NOTHING", overriding: bool = False,
+) -> int:
+    """COPY a una tabla temporal y un INSERT ... SELECT con `conflict` (ON CONFLICT o WHERE) para ser idempotente."""
+    cols = sql.SQL(", ").join(map(sql.Identifier, columns))
+    tmp = sql.Identifier(f"_seed_{table}")
+    with conn.transaction():
+        with conn.cursor() as cur:
+            cur.execute(sql.SQL("CREATE TEMP TABLE {} ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA").format(
+                tmp, cols, sql.Identifier(table)))
+            n = copy_rows(cur, f"_seed_{table}", columns, rows)
+            cur.execute(sql.SQL("INSERT INTO {} ({}) {} SELECT {} FROM {} {}").format(
+                sql.Identifier(table), cols, sql.SQL("OVERRIDING SYSTEM VALUE" if overriding else ""),
+                cols, tmp, sql.SQL(conflict)))
+    return n
+
+
+def seed_postgres(campuses: int = 4, sensors_per_lot: int = 4, with_state: bool = True, seed: int = 7):
+    """Topología completa. with_state=False deja registro_data/sensor_state para seed_history."""
     now = datetime.now(timezone.utc)
+    campus_def, lots, sensors = build_topology(campuses, sensors_per_lot, seed)
     with psycopg.connect(PG_CONN, autocommit=True, row_factory=dict_row) as conn:
         cur = conn.cursor()
 
-        # Campus (4 sedes)
-        campus_def = [
-            ("MON", "Monterrico", "Av. Primavera 123", "-12.10,-76.97"),
-            ("SMG", "San Miguel", "Av. La Marina 456", "-12.07,-77.08"),
-            ("SIZ", "San Isidro", "Av. Javier Prado 789", "-12.09,-77.04"),
-            ("VIL", "Villa", "Av. Universitaria 321", "-12.16,-76.98"),
-        ]
-        for code, name, addr, coord in campus_def:
-            cur.execute(
-                """
-                INSERT INTO campus (codigo, nombre, direccion, coordenadas, cantidad_estacionamientos, created_by)
-                VALUES (%s, %s, %s, %s, 0, 'seed')
-                ON CONFLICT (codigo) DO NOTHING;
-                """,
-                (code, name, addr, coord),
-            )
+        # Campus y estacionamientos (pocos: executemany, que psycopg envía en pipeline)
+        coords = {code: tuple(float(x) for x in coord.split(",")) for code, _, _, coord in campus_def}  # (lat, lon)
+        cur.executemany(
+            """
+            INSERT INTO campus (codigo, nombre, direccion, coordenadas, geo, cantidad_estacionamientos, created_by)
+            VALUES (%s, %s, %s, %s, ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography, 0, 'seed')
+            ON CONFLICT (codigo) DO NOTHING;
+            """,
+            [(code, name, addr, coord, coords[code][1], coords[code][0]) for code, name, addr, coord in campus_def],
+        )
         cur.execute("SELECT id, codigo FROM campus;")
         campus = {row["codigo"]: row["id"] for row in cur.fetchall()}
 
-        # Estacionamientos por sede (2-4 plantas, 2-3 estacionamientos por planta)
-        estacionamientos = [
-            # Monterrico (3 plantas, 3 por planta)
-            ("MON-1A", campus["MON"], "Ingreso A piso 1", 1, 1, "rampa"),
-            ("MON-1B", campus["MON"], "Ingreso B piso 1", 2, 1, "ascensor"),
-            ("MON-1C", campus["MON"], "Ingreso C piso 1", 3, 1, "rampa"),
-            ("MON-2A", campus["MON"], "Ingreso A piso 2", 1, 2, "ascensor"),
-            ("MON-2B", campus["MON"], "Ingreso B piso 2", 2, 2, "rampa"),
-            ("MON-2C", campus["MON"], "Ingreso C piso 2", 3, 2, "rampa"),
-            ("MON-3A", campus["MON"], "Ingreso A piso 3", 1, 3, "ascensor"),
-            ("MON-3B", campus["MON"], "Ingreso B piso 3", 2, 3, "rampa"),
-            ("MON-3C", campus["MON"], "Ingreso C piso 3", 3, 3, "rampa"),
-            # San Miguel (2 plantas, 2 por planta)
-            ("SMG-1A", campus["SMG"], "Acceso mar piso 1", 1, 1, "rampa"),
-            ("SMG-1B", campus["SMG"], "Acceso costanera piso 1", 2, 1, "ascensor"),
-            ("SMG-2A", campus["SMG"], "Acceso mar piso 2", 1, 2, "ascensor"),
-            ("SMG-2B", campus["SMG"], "Acceso costanera piso 2", 2, 2, "rampa"),
-            # San Isidro (2 plantas, 2 por planta)
-            ("SIZ-1A", campus["SIZ"], "Lobby principal piso 1", 1, 1, "ascensor"),
-            ("SIZ-1B", campus["SIZ"], "Lobby secundario piso 1", 2, 1, "rampa"),
-            ("SIZ-2A", campus["SIZ"], "Lobby principal piso 2", 1, 2, "ascensor"),
-            ("SIZ-2B", campus["SIZ"], "Lobby secundario piso 2", 2, 2, "rampa"),
-            # Villa (2 plantas, 2 por planta)
-            ("VIL-1A", campus["VIL"], "Bloque A piso 1", 1, 1, "rampa"),
-            ("VIL-1B", campus["VIL"], "Bloque B piso 1", 2, 1, "ascensor"),
-            ("VIL-2A", campus["VIL"], "Bloque A piso 2", 1, 2, "ascensor"),
-            ("VIL-2B", campus["VIL"], "Bloque B piso 2", 2, 2, "rampa"),
-        ]
-        for est_id, campus_id, ubicacion, numero, piso, acc in estacionamientos:
-            cur.execute(
-                """
-                INSERT INTO estacionamiento (id, campus_id, ubicacion, numero, piso, accesibilidad, created_by)
-                VALUES (%s, %s, %s, %s, %s, %s, 'seed')
-                ON CONFLICT (id) DO NOTHING;
-                """,
-                (est_id, campus_id, ubicacion, numero, piso, acc),
-            )
+        # Cada ingreso (numero) a ~100 m del anterior dentro del campus; los pisos comparten punto
+        cur.executemany(
+            """
+            INSERT INTO estacionamiento (id, campus_id, ubicacion, numero, piso, accesibilidad, geo, created_by)
+            VALUES (%s, %s, %s, %s, %s, %s, ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography, 'seed')
+            ON CONFLICT (id) DO NOTHING;
+            """,
+            [
+                (est_id, campus[code], ubicacion, numero, piso, acc,
+                 coords[code][1] + 0.001 * (numero - 1), coords[code][0])
+                for est_id, code, ubicacion, numero, piso, acc in lots
+            ],
+        )
 
         # Actualizar contador de estacionamientos por campus
-        for code, campus_id in campus.items():
-            cur.execute(
-                """
-                UPDATE campus SET cantidad_estacionamientos = (
-                    SELECT COUNT(*) FROM estacionamiento WHERE campus_id = %s
-                )
-                WHERE id = %s;
-                """,
-                (campus_id, campus_id),
-            )
+        cur.execute(
+            """
+            UPDATE campus c SET cantidad_estacionamientos = (
+                SELECT COUNT(*) FROM estacionamiento e WHERE e.campus_id = c.id
+            );
+            """
+        )
 
         # Roles y usuarios
         cur.execute(
@@ -108,102 +198,48 @@ def seed_postgres():
             ("Ana", "Admin", "ana.admin@example.com", "ADM001", "admin"),
             ("Oscar", "Operador", "oscar.op@example.com", "OP001", "operador"),
         ]
-        for nombre, apellido, email, codigo, rol_name in users:
-            cur.execute(
-                """
-                INSERT INTO usuario (nombre, apellido, email, codigo, rol, rol_id, created_by)
-                VALUES (%s, %s, %s, %s, %s, %s, 'seed')
-                ON CONFLICT (email) DO NOTHING;
-                """,
-                (nombre, apellido, email, codigo, rol_name, roles[rol_name]),
-            )
+        cur.executemany(
+            """
+            INSERT INTO usuario (nombre, apellido, email, codigo, rol, rol_id, created_by)
+            VALUES (%s, %s, %s, %s, %s, %s, 'seed')
+            ON CONFLICT (email) DO NOTHING;
+            """,
+            [(nombre, apellido, email, codigo, rol, roles[rol]) for nombre, apellido, email, codigo, rol in users],
+        )
 
-        # Sensores (IDs fijos, tipos por sede)
+        # Sensores (IDs fijos desde FIRST_SENSOR_ID, tipo por sede)
         install_dt = now - timedelta(days=30)
         maint_dt = now - timedelta(days=5)
-        sensor_rows = []
-        sid_counter = 1000
-        for est_id, campus_id, *_rest in estacionamientos:
-            # Monterrico y San Miguel alternan lorawan / ultrasonico
-            tipo = None
-            campus_code = [k for k, v in campus.items() if v == campus_id][0]
-            if campus_code in ("MON", "SMG"):
-                tipo = "lorawan" if sid_counter % 2 == 0 else "ultrasonico"
-            for _ in range(4):  # 4 sensores por estacionamiento
-                sid_counter += 1
-                sensor_rows.append((est_id, sid_counter, tipo))
-
-        if sensor_rows:
-            values = [
-                (
-                    sid,
-                    est_id,
-                    "operativo",
-                    "Acme",
-                    "SP-1",
-                    install_dt,
-                    maint_dt,
-                    "1.0.0",
-                    json.dumps({"tipo": tipo} if tipo else {}),
-                    "seed",
-                )
-                for est_id, sid, tipo in sensor_rows
-            ]
-            if execute_values:
-                execute_values(
-                    cur,
-                    """
-                    INSERT INTO sensor (
-                      id, estacionamiento_id, estado_funcionamiento, fabricante, modelo,
-                      fecha_instalacion, fecha_mantenimiento, version_firmware, config, created_by
-                    )
-                    OVERRIDING SYSTEM VALUE
-                    VALUES %s
-                    ON CONFLICT (id) DO NOTHING;
-                    """,
-                    values,
-                )
-            else:
-                for v in values:
-                    cur.execute(
-                        """
-                        INSERT INTO sensor (
-                          id, estacionamiento_id, estado_funcionamiento, fabricante, modelo,
-                          fecha_instalacion, fecha_mantenimiento, version_firmware, config, created_by
-                        )
-                        OVERRIDING SYSTEM VALUE
-                        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-                        ON CONFLICT (id) DO NOTHING;
-                        """,
-                        v,
-                    )
+        copy_upsert(
+            conn, "sensor",
+            ("id", "estacionamiento_id", "estado_funcionamiento", "fabricante", "modelo", "fecha_instalacion",
+             "fecha_mantenimiento", "version_firmware", "config", "created_by"),
+            (
+                (sid, est_id, "operativo", "Acme", "SP-1", install_dt, maint_dt, "1.0.0",
+                 json.dumps({"tipo": tipo} if tipo else {}), "seed")
+                for sid, est_id, tipo in sensors
+            ),
+            conflict="ON CONFLICT (id) DO NOTHING", overriding=True,
+        )
+        # OVERRIDING SYSTEM VALUE no avanza la identidad: sin esto la próxima alta
+        # de sensor (sin id) choca con los IDs del seed
+        cur.execute("SELECT setval(pg_get_serial_sequence('sensor', 'id'), (SELECT max(id) FROM sensor));")
 
-        # Gateways (uno por sensor)
-        cur.execute("SELECT id, estacionamiento_id FROM sensor;")
-        sensor_rows_full = cur.fetchall()
-        sensor_ids = [row["id"] for row in sensor_rows_full]
-        if sensor_ids:
-            gw_values = [(sid, f"GW-{sid}", "GW-Edge", "ethernet", "online", now, "seed") for sid in sensor_ids]
-            if execute_values:
-                execute_values(
-                    cur,
-                    """
-                    INSERT INTO gateway (sensor_id, serial, modelo, tipo_conexion, estado, ultima_comunicacion, created_by)
-                    VALUES %s
-                    ON CONFLICT DO NOTHING;
-                    """,
-                    gw_values,
-                )
-            else:
-                for v in gw_values:
-                    cur.execute(
-                        """
-                        INSERT INTO gateway (sensor_id, serial, modelo, tipo_conexion, estado, ultima_comunicacion, created_by)
-                        VALUES (%s,%s,%s,%s,%s,%s,%s)
-                        ON CONFLICT DO NOTHING;
-                        """,
-                        v,
-                    )
+        # Gateways y umbrales (uno por sensor; sólo para sensores que aún no los tienen)
+        sensor_ids = [sid for sid, _, _ in sensors]
+        copy_upsert(
+            conn, "gateway",
+            ("sensor_id", "serial", "modelo", "tipo_conexion", "estado", "ultima_comunicacion", "created_by"),
+            ((sid, f"GW-{sid}", "GW-Edge", "ethernet", "online", now, "seed") for sid in sensor_ids),
+            conflict="WHERE NOT EXISTS (SELECT 1 FROM gateway g WHERE g.sensor_id = _seed_gateway.sensor_id)",
+        )
+        copy_upsert(
+            conn, "sensor_threshold",
+            ("sensor_id", "min_value", "max_value", "alert_level", "description", "created_by"),
+            ((sid, 1, 100, "info", "umbral base", "seed") for sid in sensor_ids),
+            conflict="WHERE NOT EXISTS (SELECT 1 FROM sensor_threshold t "
+                     "WHERE t.sensor_id = _seed_sensor_threshold.sensor_id)",
+        )
 
         # Reservas de ejemplo
         cur.execute("SELECT id FROM usuario WHERE email = 'oscar.op@example.com';")
@@ -211,66 +247,132 @@ def seed_postgres():
         cur.execute("SELECT id FROM estacionamiento ORDER BY id LIMIT 1;")
         est_row = cur.fetchone()
         if user_row and est_row:
-            usuario_id = user_row["id"]
-            est_id_sample = est_row["id"]
             cur.execute(
                 """
                 INSERT INTO reserva (usuario_id, estacionamiento_id, hora_inicio, hora_fin, estado, fecha_creacion, created_by)
                 VALUES (%s, %s, %s, %s, 'confirmada', %s, 'seed')
                 ON CONFLICT DO NOTHING;
                 """,
-                (usuario_id, est_id_sample, now, now + timedelta(hours=2), now),
+                (user_row["id"], est_row["id"], now, now + timedelta(hours=2), now),
             )
 
-        # Registro de datos inicial
-        if sensor_rows_full:
-            reg_values = [(row["id"], row["estacionamiento_id"], now, None, "libre", "seed") for row in sensor_rows_full]
-            if execute_values:
-                execute_values(
-                    cur,
-                    """
-                    INSERT INTO registro_data (sensor_id, estacionamiento_id, hora_libre, hora_ocupado, estado, created_by)
-                    VALUES %s
-                    ON CONFLICT DO NOTHING;
-                    """,
-                    reg_values,
+        if with_state:
+            # Registro inicial y estado actual coherente con él (todos libres)
+            with conn.transaction(), conn.cursor() as copy_cur:
+                copy_rows(
+                    copy_cur, "registro_data",
+                    ("sensor_id", "estacionamiento_id", "hora_libre", "hora_ocupado", "estado", "created_by"),
+                    ((sid, est_id, now, None, "libre", "seed") for sid, est_id, _ in sensors),
                 )
-            else:
-                for v in reg_values:
-                    cur.execute(
-                        """
-                        INSERT INTO registro_data (sensor_id, estacionamiento_id, hora_libre, hora_ocupado, estado, created_by)
-                        VALUES (%s,%s,%s,%s,%s,%s)
-                        ON CONFLICT DO NOTHING;
-                        """,
-                        v,
-                    )
+            copy_upsert(
+                conn, "sensor_state",
+                ("sensor_id", "estacionamiento_id", "estado", "last_change_at", "last_seen_at"),
+                ((sid, est_id, "libre", now, now) for sid, est_id, _ in sensors),
+                conflict="ON CONFLICT (sensor_id) DO NOTHING",
+            )
 
-        # Umbrales
-        if sensor_ids:
-            th_values = [(sid, 1, 100, "info", "umbral base", "seed") for sid in sensor_ids]
-            if execute_values:
-                execute_values(
-                    cur,
-                    """
-                    INSERT INTO sensor_threshold (sensor_id, min_value, max_value, alert_level, description, created_by)
-                    VALUES %s
-                    ON CONFLICT DO NOTHING;
-                    """,
-                    th_values,
-                )
-            else:
-                for v in th_values:
-                    cur.execute(
-                        """
-                        INSERT INTO sensor_threshold (sensor_id, min_value, max_value, alert_level, description, created_by)
-                        VALUES (%s,%s,%s,%s,%s,%s)
-                        ON CONFLICT DO NOTHING;
-                        """,
-                        v,
+        print(f"Seed Postgres completo: {len(campus_def)} campus, {len(lots)} estacionamientos, {len(sensors)} sensores.")
+    return sensors
+
+
+# ---- Histórico sintético ----
+def sensor_history(
+    rng: random.Random, start: datetime, end: datetime, events_per_day: float
+) -> Iterable[Tuple[datetime, str]]:
+    """
+    Transiciones libre/ocupado de un sensor. Permanencias exponenciales con
+    media 24h/events_per_day, más cortas libre en horario diurno (7-19 h,
+    hora de Lima) y más largas de noche.
+    """
+    mean = 86400 / events_per_day
+    estado = "ocupado" if rng.random() < 0.3 else "libre"
+    ts = start + timedelta(seconds=rng.uniform(0, mean))
+    while ts < end:
+        yield ts, estado
+        hour = (ts.hour - 5) % 24
+        diurno = 7 <= hour < 19
+        if estado == "libre":
+            dwell = mean * (0.5 if diurno else 2.0)
+        else:
+            dwell = mean * (1.0 if diurno else 1.5)
+        ts += timedelta(seconds=rng.expovariate(1 / dwell))
+        estado = "ocupado" if estado == "libre" else "libre"
+
+
+def seed_history(
+    sensors: List[Tuple[int, str, Optional[str]]], days: float, events_per_day: float = 12, batch: int = 50000,
+    mongo: bool = True, seed: int = 7,
+) -> Dict[str, int]:
+    """
+    Genera el histórico sensor por sensor y lo escribe en lotes de `batch`:
+    COPY a registro_data (particiones creadas antes) e insert_many a
+    events_raw según EVENTS_RAW_LAYOUT. Termina fijando sensor_state al
+    último evento de cada sensor y reconstruyendo parking_session.
+    """
+    rng = random.Random(seed)
+    end = datetime.now(timezone.utc)
+    start = end - timedelta(days=days)
+    layout = os.environ.get("EVENTS_RAW_LAYOUT", "plain").lower()
+    col = None
+    if mongo:
+        mdb = MongoClient(MONGODB_URI, tls=True, tlsAllowInvalidCertificates=False)["smartpark"]
+        name = os.environ.get("EVENTS_RAW_COLLECTION", "events_raw")
+        col = events_raw.ensure_collection(mdb, name, layout, int(os.environ.get("EVENTS_RAW_TTL_SEC", "0")))
+
+    stats = {"registro_data": 0, "events_raw": 0}
+    last: Dict[int, Tuple[str, str, datetime]] = {}
+    pg_rows: List[tuple] = []
+    docs: List[dict] = []
+    t0 = time.monotonic()
+
+    with psycopg.connect(PG_CONN, autocommit=True) as conn:
+        partitions.ensure_partitions(conn, since=start)  # el histórico cae en su partición, no en la default
+
+        def flush():
+            if pg_rows:
+                with conn.transaction(), conn.cursor() as copy_cur:
+                    stats["registro_data"] += copy_rows(
+                        copy_cur, "registro_data",
+                        ("sensor_id", "estacionamiento_id", "hora_libre", "hora_ocupado", "estado", "created_by",
+                         "created_at"),
+                        pg_rows,
                     )
+                pg_rows.clear()
+            if docs:
+                col.insert_many(docs, ordered=False)
+                stats["events_raw"] += len(docs)
+                docs.clear()
+            rate = stats["registro_data"] / max(time.monotonic() - t0, 1e-6)
+            print(f"[SEED] registro_data={stats['registro_data']} events_raw={stats['events_raw']} ({rate:.0f} filas/s)")
+
+        for sid, est_id, tipo in sensors:
+            meta = {"tipo": tipo} if tipo else {}
+            for ts, estado in sensor_history(rng, start, end, events_per_day):
+                libre = ts if estado == "libre" else None
+                ocupado = ts if estado == "ocupado" else None
+                pg_rows.append((sid, est_id, libre, ocupado, estado, "seed", ts))
+                if col is not None:
+                    doc = {"sensor_id": sid, "estacionamiento_id": est_id, "estado": estado, "ts": ts,
+                           "payload": {}, "sensor": meta}
+                    docs.append(events_raw.to_layout(doc, layout))
+                last[sid] = (est_id, estado, ts)
+            if len(pg_rows) >= batch:
+                flush()
+        flush()
 
-        print("Seed Postgres completo.")
+        copy_upsert(
+            conn, "sensor_state",
+            ("sensor_id", "estacionamiento_id", "estado", "last_change_at", "last_seen_at"),
+            ((sid, est_id, estado, ts, ts) for sid, (est_id, estado, ts) in last.items()),
+            conflict="""ON CONFLICT (sensor_id) DO UPDATE SET estado = EXCLUDED.estado,
+                        last_change_at = EXCLUDED.last_change_at, last_seen_at = EXCLUDED.last_seen_at,
+                        updated_at = now()
+                        WHERE sensor_state.last_change_at <= EXCLUDED.last_change_at""",
+        )
+        sessions.backfill(conn, progress=None)  # parking_session y duraciones del histórico
+    print(f"Histórico completo en {time.monotonic() - t0:.0f} s "
+          f"(recalcular rollups: python api/rollups.py).")
+    return stats
 
 
 def seed_mongo():
@@ -282,8 +384,21 @@ def seed_mongo():
 
 
 def main():
-    seed_postgres()
+    parser = argparse.ArgumentParser(description="Seed de la topología y del histórico sintético")
+    parser.add_argument("--campuses", type=int, default=4, help="sedes (las 4 primeras son las de la demo)")
+    parser.add_argument("--sensors-per-lot", type=int, default=4)
+    parser.add_argument("--history-days", type=float, default=0, help="días de histórico (0 = sólo estado inicial)")
+    parser.add_argument("--events-per-day", type=float, default=12, help="transiciones por sensor y día (media)")
+    parser.add_argument("--batch", type=int, default=50000, help="filas por COPY/insert_many del histórico")
+    parser.add_argument("--no-mongo-history", action="store_true", help="histórico sólo en Postgres")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    sensors = seed_postgres(args.campuses, args.sensors_per_lot, with_state=args.history_days <= 0, seed=args.seed)
     seed_mongo()
+    if args.history_days > 0:
+        seed_history(sensors, args.history_days, args.events_per_day, args.batch,
+                     mongo=not args.no_mongo_history, seed=args.seed)
 
 
 if __name__ == "__main__":
@@ -1,78 +1,395 @@
 """
-Simulador de eventos: envía bursts a /sensor_event
-Uso: export $(grep -v '^#' tools/.env | xargs) ; python tools/simulator.py
-Config:
+Generador de carga asíncrono: simula los sensores de todos los campus
+(los que cargó seed_basics) con una máquina de estados libre/ocupado por
+sensor y envía sus reportes a /sensor_event (o en lotes a /sensor_events)
+con conexiones keep-alive. Al terminar imprime latencias (p50/p95/p99),
+throughput y errores; opcionalmente los guarda en JSON para comparar corridas.
+
+Uso: export $(grep -v '^#' tools/.env | xargs) ; python tools/simulator.py --rate 500 --duration 60
+Config (flags o variables de entorno):
   API_BASE=http://localhost:8080
-  SIM_EST=EST-001            # estacionamiento objetivo
-  SIM_SENSOR_IDS=1001,1002   # opcional, lista explícita
-  PG_CONN=...                # opcional, para obtener sensores desde la DB
-  SIM_PERIOD=2.0             # segundos entre eventos
+  SIM_RATE=50                # eventos/s objetivo (total)
+  SIM_DURATION=60            # segundos (0 = hasta Ctrl-C)
+  SIM_ARRIVAL=poisson        # poisson | uniform | burst
+  SIM_CONNECTIONS=32         # conexiones keep-alive concurrentes
+  SIM_BULK=0                 # >0: eventos por request a /sensor_events (NDJSON)
+  SIM_CAMPUS=MON,SMG         # opcional, filtra campus
+  SIM_EST=MON-1A             # opcional, filtra un estacionamiento
+  SIM_SENSOR_IDS=1001,1002   # opcional, lista explícita (requiere SIM_EST)
+  PG_CONN=...                # para cargar sensores desde la DB
 """
+import argparse
+import asyncio
 import json
 import os
 import random
+import signal
+import ssl
 import time
+from collections import Counter
 from datetime import datetime, timezone
-import urllib.request
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
 
 import psycopg
-from psycopg.rows import dict_row
 
 API_BASE = os.environ.get("API_BASE", "http://localhost:8080")
-ESTACIONAMIENTO = os.environ.get("SIM_EST", "EST-001")
-SIM_SENSOR_IDS = os.environ.get("SIM_SENSOR_IDS")
-PERIOD_SEC = float(os.environ.get("SIM_PERIOD", "2.0"))
-PG_CONN = os.environ.get("PG_CONN")  # opcional
+PG_CONN = os.environ.get("PG_CONN")
 
+# Cotas del histograma (ms)
+HISTOGRAM_BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
 
-def post(path, payload):
-    data = json.dumps(payload).encode("utf-8")
-    req = urllib.request.Request(
-        f"{API_BASE}{path}",
-        data=data,
-        headers={"Content-Type": "application/json"},
-        method="POST"
-    )
-    with urllib.request.urlopen(req, timeout=5) as resp:
-        return resp.read()
 
+# ---- Sensores ----
+class SensorSim:
+    """
+    Máquina de estados por sensor en tiempo virtual: permanencias
+    exponenciales en libre/ocupado. Entre cambios el sensor re-reporta
+    su estado vigente (como los dispositivos reales).
+    """
 
-def load_sensor_ids():
-    if SIM_SENSOR_IDS:
-        return [int(x.strip()) for x in SIM_SENSOR_IDS.split(",") if x.strip()]
+    __slots__ = ("sensor_id", "estacionamiento_id", "estado", "next_change")
 
-    if PG_CONN:
-        with psycopg.connect(PG_CONN, row_factory=dict_row) as conn:
-            cur = conn.cursor()
-            cur.execute("SELECT id FROM sensor WHERE estacionamiento_id = %s;", (ESTACIONAMIENTO,))
-            rows = cur.fetchall()
-            if not rows:
-                raise RuntimeError(f"No se encontraron sensores para {ESTACIONAMIENTO}")
-            return [row["id"] for row in rows]
+    def __init__(self, sensor_id: int, estacionamiento_id: str, mean_free: float, mean_occupied: float):
+        self.sensor_id = sensor_id
+        self.estacionamiento_id = estacionamiento_id
+        p_occupied = mean_occupied / (mean_free + mean_occupied)
+        self.estado = "ocupado" if random.random() < p_occupied else "libre"
+        mean = mean_occupied if self.estado == "ocupado" else mean_free
+        self.next_change = random.expovariate(1 / mean)
 
-    raise RuntimeError("Define SIM_SENSOR_IDS o PG_CONN para cargar sensores.")
+    def advance(self, vnow: float, mean_free: float, mean_occupied: float) -> str:
+        while vnow >= self.next_change:
+            self.estado = "libre" if self.estado == "ocupado" else "ocupado"
+            mean = mean_occupied if self.estado == "ocupado" else mean_free
+            self.next_change += random.expovariate(1 / mean)
+        return self.estado
 
 
-def main():
-    sensor_ids = load_sensor_ids()
-    print(f"Simulando {len(sensor_ids)} sensores contra {API_BASE} en {ESTACIONAMIENTO}")
-
-    while True:
-        now = datetime.now(tz=timezone.utc).isoformat()
-        sid = random.choice(sensor_ids)
-        estado = "ocupado" if random.random() < 0.5 else "libre"
-        payload = {
-            "sensor_id": sid,
-            "estacionamiento_id": ESTACIONAMIENTO,
-            "estado": estado,
-            "ts": now,
-            "payload": {"bateria": round(random.uniform(3.3, 4.1), 2)}
+def load_sensors(campus: Optional[List[str]], est: Optional[str], explicit: Optional[List[int]]) -> List[Tuple[int, str]]:
+    if explicit:
+        if not est:
+            raise RuntimeError("SIM_SENSOR_IDS requiere SIM_EST")
+        return [(sid, est) for sid in explicit]
+    if not PG_CONN:
+        raise RuntimeError("Define PG_CONN (o SIM_EST + SIM_SENSOR_IDS) para cargar sensores.")
+
+    where, params = ["s.estado_funcionamiento = 'operativo'"], []
+    if campus:
+        where.append("c.codigo = ANY(%s)")
+        params.append(campus)
+    if est:
+        where.append("s.estacionamiento_id = %s")
+        params.append(est)
+    with psycopg.connect(PG_CONN) as conn:
+        rows = conn.execute(
+            f"""
+            SELECT s.id, s.estacionamiento_id
+            FROM sensor s
+            JOIN estacionamiento e ON e.id = s.estacionamiento_id
+            JOIN campus c ON c.id = e.campus_id
+            WHERE {' AND '.join(where)}
+            ORDER BY s.id;
+            """,
+            params,
+        ).fetchall()
+    if not rows:
+        raise RuntimeError("No se encontraron sensores con esos filtros")
+    return [(r[0], r[1]) for r in rows]
+
+
+# ---- Cliente HTTP/1.1 keep-alive (stdlib) ----
+class HttpConnection:
+    def __init__(self, base: str, timeout: float):
+        url = urlsplit(base)
+        self.host = url.hostname
+        self.https = url.scheme == "https"
+        self.port = url.port or (443 if self.https else 80)
+        self.prefix = url.path.rstrip("/")
+        self.timeout = timeout
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.reconnects = 0
+
+    async def _connect(self):
+        ctx = ssl.create_default_context() if self.https else None
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port, ssl=ctx)
+        self.reconnects += 1
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def request(self, method: str, path: str, body: bytes, content_type: str) -> Tuple[int, bytes]:
+        return await asyncio.wait_for(self._request(method, path, body, content_type), self.timeout)
+
+    async def _request(self, method: str, path: str, body: bytes, content_type: str) -> Tuple[int, bytes]:
+        # Un reintento si el servidor cerró la conexión ociosa entre requests
+        for attempt in (0, 1):
+            if self.writer is None:
+                await self._connect()
+            try:
+                head = (
+                    f"{method} {self.prefix}{path} HTTP/1.1\r\nHost: {self.host}\r\n"
+                    f"Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+                    "Connection: keep-alive\r\n\r\n"
+                )
+                self.writer.write(head.encode("latin-1") + body)
+                await self.writer.drain()
+                return await self._read_response()
+            except (ConnectionError, asyncio.IncompleteReadError):
+                self.close()
+                if attempt:
+                    raise
+
+    async def _read_response(self) -> Tuple[int, bytes]:
+        status_line = await self.reader.readuntil(b"\r\n")
+        status = int(status_line.split()[1])
+        headers: Dict[str, str] = {}
+        while True:
+            line = await self.reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await self.reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                data = await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                chunks.append(data[:-2])
+            payload = b"".join(chunks)
+        else:
+            payload = await self.reader.readexactly(int(headers.get("content-length", "0")))
+
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return status, payload
+
+
+# ---- Métricas ----
+class Report:
+    def __init__(self):
+        self.latencies: List[float] = []       # desde el envío
+        self.latencies_sched: List[float] = []  # desde el instante programado (incluye cola local)
+        self.requests = 0
+        self.events = 0
+        self.events_rejected = 0
+        self.errors: Counter = Counter()
+        self.statuses: Counter = Counter()
+        self.transiciones = 0
+        self.backlog_dropped = 0
+
+    @staticmethod
+    def percentile(values: List[float], p: float) -> Optional[float]:
+        if not values:
+            return None
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    def histogram(self) -> List[Tuple[str, int]]:
+        counts = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+        for v in self.latencies:
+            for i, bound in enumerate(HISTOGRAM_BOUNDS):
+                if v <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+        labels = [f"<= {b} ms" for b in HISTOGRAM_BOUNDS] + [f"> {HISTOGRAM_BOUNDS[-1]} ms"]
+        return list(zip(labels, counts))
+
+    def summary(self, elapsed: float, args: argparse.Namespace) -> Dict:
+        pct = lambda vals: {f"p{p}": self.percentile(vals, p) for p in (50, 95, 99)}
+        return {
+            "config": {
+                "api": args.api, "rate": args.rate, "arrival": args.arrival, "connections": args.connections,
+                "bulk": args.bulk, "duration": args.duration, "sensors": args.sensor_count,
+            },
+            "elapsed_s": round(elapsed, 3),
+            "requests": self.requests,
+            "events": self.events,
+            "events_rejected": self.events_rejected,
+            "transiciones": self.transiciones,
+            "throughput": {
+                "requests_per_s": round(self.requests / elapsed, 2) if elapsed else 0,
+                "events_per_s": round(self.events / elapsed, 2) if elapsed else 0,
+            },
+            "latency_ms": {**pct(self.latencies), "max": max(self.latencies, default=None)},
+            "latency_from_schedule_ms": pct(self.latencies_sched),
+            "status": dict(self.statuses),
+            "errors": dict(self.errors),
+            "backlog_dropped": self.backlog_dropped,
+            "histogram": self.histogram(),
         }
+
+
+def print_summary(s: Dict):
+    fmt = lambda v: "-" if v is None else f"{v:.1f}"
+    lat, sched = s["latency_ms"], s["latency_from_schedule_ms"]
+    print(f"\nDuración: {s['elapsed_s']} s  requests: {s['requests']}  eventos: {s['events']} "
+          f"(rechazados {s['events_rejected']}, transiciones {s['transiciones']})")
+    print(f"Throughput: {s['throughput']['requests_per_s']} req/s, {s['throughput']['events_per_s']} eventos/s")
+    print(f"Latencia (ms): p50 {fmt(lat['p50'])}  p95 {fmt(lat['p95'])}  p99 {fmt(lat['p99'])}  max {fmt(lat['max'])}")
+    print(f"Latencia desde lo programado (ms): p50 {fmt(sched['p50'])}  p95 {fmt(sched['p95'])}  p99 {fmt(sched['p99'])}")
+    total = max(1, sum(c for _, c in s["histogram"]))
+    for label, count in s["histogram"]:
+        print(f"  {label:>10} {count:>8} {'#' * int(50 * count / total)}")
+    print(f"Status HTTP: {s['status'] or '-'}")
+    print(f"Errores: {s['errors'] or '-'}")
+    if s["backlog_dropped"]:
+        print(f"[WARN] {s['backlog_dropped']} envíos descartados: el generador no alcanzó la tasa pedida")
+
+
+# ---- Generación ----
+def interarrival(arrival: str, rate: float, burst: int) -> Tuple[float, int]:
+    """Devuelve (espera hasta el siguiente envío, nº de envíos juntos)."""
+    if arrival == "uniform":
+        return 1 / rate, 1
+    if arrival == "burst":
+        return burst / rate, burst
+    return random.expovariate(rate), 1
+
+
+async def run(args: argparse.Namespace) -> Dict:
+    sensors = [SensorSim(sid, est, args.mean_free, args.mean_occupied) for sid, est in args.sensors]
+    report = Report()
+    per_request = max(1, args.bulk)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=args.connections * 50)
+    start = time.perf_counter()
+    deadline = start + args.duration if args.duration > 0 else None
+    # Ctrl-C deja de programar envíos, espera los pendientes e imprime el resumen
+    stop = asyncio.Event()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGINT, stop.set)
+    except NotImplementedError:
+        pass
+
+    def next_payload() -> Tuple[bytes, str, str, int]:
+        vnow = (time.perf_counter() - start) * args.time_scale
+        ts = datetime.now(timezone.utc).isoformat()
+        events = []
+        for sensor in random.choices(sensors, k=per_request):
+            estado = sensor.advance(vnow, args.mean_free, args.mean_occupied)
+            events.append({
+                "sensor_id": sensor.sensor_id,
+                "estacionamiento_id": sensor.estacionamiento_id,
+                "estado": estado,
+                "ts": ts,
+                "payload": {"bateria": round(random.uniform(3.3, 4.1), 2)},
+            })
+        if args.bulk:
+            body = "\n".join(json.dumps(e) for e in events).encode()
+            return body, "/sensor_events", "application/x-ndjson", len(events)
+        return json.dumps(events[0]).encode(), "/sensor_event", "application/json", 1
+
+    async def producer():
+        # Programa envíos en tiempo absoluto: un servidor lento no reduce la
+        # tasa ofrecida (evita la omisión coordinada).
+        rate = args.rate / per_request
+        scheduled = time.perf_counter()
+        while not stop.is_set() and (deadline is None or scheduled < deadline):
+            wait, count = interarrival(args.arrival, rate, args.burst)
+            scheduled += wait
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            for _ in range(count):
+                try:
+                    queue.put_nowait(scheduled)
+                except asyncio.QueueFull:
+                    report.backlog_dropped += 1
+        for _ in range(args.connections):
+            await queue.put(None)
+
+    async def worker():
+        conn = HttpConnection(args.api, args.timeout)
         try:
-            post("/sensor_event", payload)
-        except Exception as e:
-            print(f"[WARN] fallo POST: {e}")
-        time.sleep(PERIOD_SEC)
+            while True:
+                scheduled = await queue.get()
+                if scheduled is None:
+                    return
+                body, path, ctype, n = next_payload()
+                sent = time.perf_counter()
+                try:
+                    status, payload = await conn.request("POST", path, body, ctype)
+                except asyncio.TimeoutError:
+                    conn.close()
+                    report.errors["timeout"] += 1
+                    continue
+                except Exception as e:
+                    conn.close()
+                    report.errors[type(e).__name__] += 1
+                    continue
+                done = time.perf_counter()
+                report.requests += 1
+                report.events += n
+                report.statuses[str(status)] += 1
+                report.latencies.append((done - sent) * 1000)
+                report.latencies_sched.append((done - scheduled) * 1000)
+                if status >= 400:
+                    report.errors[f"http {status}"] += 1
+                    report.events_rejected += n
+                    continue
+                try:
+                    data = json.loads(payload)
+                except ValueError:
+                    continue
+                if args.bulk:
+                    report.events_rejected += data.get("rejected") or 0
+                    report.transiciones += data.get("transiciones") or 0
+                elif data.get("transicion"):
+                    report.transiciones += 1
+        finally:
+            conn.close()
+
+    workers = [asyncio.create_task(worker()) for _ in range(args.connections)]
+    await producer()
+    await asyncio.gather(*workers)
+    return report.summary(time.perf_counter() - start, args)
+
+
+def main():
+    env = os.environ.get
+    parser = argparse.ArgumentParser(description="Generador de carga para la API de SmartPark")
+    parser.add_argument("--api", default=API_BASE)
+    parser.add_argument("--rate", type=float, default=float(env("SIM_RATE", "50")), help="eventos/s objetivo")
+    parser.add_argument("--duration", type=float, default=float(env("SIM_DURATION", "60")), help="segundos (0 = sin fin)")
+    parser.add_argument("--arrival", choices=("poisson", "uniform", "burst"), default=env("SIM_ARRIVAL", "poisson"))
+    parser.add_argument("--burst", type=int, default=int(env("SIM_BURST", "20")), help="envíos por ráfaga (arrival=burst)")
+    parser.add_argument("--connections", type=int, default=int(env("SIM_CONNECTIONS", "32")))
+    parser.add_argument("--bulk", type=int, default=int(env("SIM_BULK", "0")), help="eventos por request a /sensor_events")
+    parser.add_argument("--timeout", type=float, default=float(env("SIM_TIMEOUT", "10")))
+    parser.add_argument("--campus", default=env("SIM_CAMPUS"), help="lista separada por comas")
+    parser.add_argument("--est", default=env("SIM_EST"))
+    parser.add_argument("--sensor-ids", default=env("SIM_SENSOR_IDS"))
+    parser.add_argument("--mean-free", type=float, default=float(env("SIM_MEAN_FREE", "1200")), help="permanencia libre (s virtuales)")
+    parser.add_argument("--mean-occupied", type=float, default=float(env("SIM_MEAN_OCCUPIED", "2700")), help="permanencia ocupado (s virtuales)")
+    parser.add_argument("--time-scale", type=float, default=float(env("SIM_TIME_SCALE", "60")), help="segundos virtuales por segundo real")
+    parser.add_argument("--json", dest="json_out", help="ruta para guardar el resumen en JSON")
+    parser.add_argument("--seed", type=int, help="semilla aleatoria (corridas reproducibles)")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    explicit = [int(x) for x in args.sensor_ids.split(",") if x.strip()] if args.sensor_ids else None
+    campus = [c.strip() for c in args.campus.split(",") if c.strip()] if args.campus else None
+    args.sensors = load_sensors(campus, args.est, explicit)
+    args.sensor_count = len(args.sensors)
+    mode = f"lotes de {args.bulk} a /sensor_events" if args.bulk else "/sensor_event"
+    print(f"Simulando {args.sensor_count} sensores contra {args.api}: {args.rate} eventos/s ({args.arrival}), "
+          f"{args.connections} conexiones, {mode}")
+
+    summary = asyncio.run(run(args))
+    print_summary(summary)
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"Resumen guardado en {args.json_out}")
 
 
 if __name__ == "__main__":